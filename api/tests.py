@@ -1,3 +1,30 @@
-from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from cafeteria.tests import SeededSchoolTestCase
+from menu import cache as menu_cache
+
+
+class ApiQueryTests(SeededSchoolTestCase):
+
+    def test_todays_menu_items(self):
+        self.assertQueryBudget(3, reverse('todays-items'))
+
+    def test_user_lookup(self):
+        self.assertQueryBudget(3, reverse('user-lookup', args=[self.student.lunch_uuid]))
+
+    def test_user_order_lookup(self):
+        self.assertQueryBudget(4, reverse('user-order', args=[self.teacher.lunch_uuid]))
+
+    def test_user_order_submit(self):
+        # Orders are checked against the cached guardian menu
+        menu_cache.todays_menu(menu_cache.GUARDIAN)
+        self.assertQueryBudget(16, reverse('submit-order'), 'post', {
+            'items': [self.menu_items[0].id, self.menu_items[2].id],
+            'transactee': self.student.id
+        })
+
+    def test_user_search(self):
+        self.assertQueryBudget(3, reverse('basic-user-search'), data={'search': 'First1'})
+
+    def test_profile_search(self):
+        self.assertQueryBudget(3, reverse('basic-profile-search'), data={'search': 'Last1'})
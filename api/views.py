@@ -21,7 +21,7 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
 from api import serializers
-from menu.models import MenuItem
+from menu import cache as menu_cache
 from profiles.models import Profile
 from transactions.models import Transaction
 
@@ -29,21 +29,23 @@ from transactions.models import Transaction
 class UserSearch(generics.ListAPIView):
     search_fields = ['first_name', 'last_name']
     filter_backends = [filters.SearchFilter]
-    queryset = User.objects.filter(is_active=True).exclude(profile__pending=True).filter(Q(profile__role=Profile.STUDENT) | Q(profile__role=Profile.STAFF))
+    queryset = User.objects.filter(is_active=True).exclude(profile__pending=True).filter(Q(profile__role=Profile.STUDENT) | Q(profile__role=Profile.STAFF))\
+        .select_related('profile__grade')
     serializer_class = serializers.UserSearchSerializer
 
 
 class ProfileSearch(generics.ListAPIView):
     search_fields = ['user__first_name', 'user__last_name']
     filter_backends = [filters.SearchFilter]
-    queryset = Profile.objects.filter(active=True).exclude(pending=True).filter(Q(role=Profile.STUDENT) | Q(role=Profile.STAFF))
+    queryset = Profile.objects.filter(active=True).exclude(pending=True).filter(Q(role=Profile.STUDENT) | Q(role=Profile.STAFF))\
+        .select_related('user', 'grade')
     serializer_class = serializers.ProfileSerializer
 
 
 @api_view(['GET'])
 def todays_menu_items(request):
     try:
-        items = MenuItem.objects.filter(days_available__name=timezone.localdate(timezone.now()).strftime("%A")).filter(Q(category=MenuItem.ENTREE) | Q(app_only=True))
+        items = menu_cache.todays_menu(menu_cache.KIOSK)
     except:
         return Response(status=status.HTTP_404_NOT_FOUND)
     
@@ -54,7 +56,7 @@ def todays_menu_items(request):
 @api_view(['GET'])
 def user_lookup(request, id):
     try:
-        profile = Profile.objects.get(lunch_uuid=id)
+        profile = Profile.objects.select_related('user', 'grade').get(lunch_uuid=id)
     except Profile.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -65,11 +67,12 @@ def user_lookup(request, id):
 @api_view(['GET'])
 def user_order_lookup(request, id):
     try:
-        profile = Profile.objects.get(lunch_uuid=id)
+        profile = Profile.objects.select_related('user', 'grade').get(lunch_uuid=id)
     except Profile.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
     try:
-        order = Transaction.objects.filter(transactee=profile).filter(submitted__date=timezone.localdate(timezone.now())).filter(transaction_type=Transaction.DEBIT).filter(completed__isnull=True)
+        order = Transaction.objects.filter(transactee=profile).filter(submitted__date=timezone.localdate(timezone.now())).filter(transaction_type=Transaction.DEBIT).filter(completed__isnull=True)\
+            .prefetch_related('line_item__menu_item')
     except Transaction.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -14,7 +14,7 @@ from django.contrib import admin
 
 from rest_framework.authtoken.admin import TokenAdmin
 
-from cafeteria.models import GradeLevel, LunchPeriod, School, Weekday
+from cafeteria.models import GradeLevel, LunchPeriod, School, SyncWatermark, Weekday
 
 
 TokenAdmin.raw_id_fields = ['user']
@@ -52,6 +52,17 @@ class SchoolAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(SyncWatermark)
+class SyncWatermarkAdmin(admin.ModelAdmin):
+    fields = ['resource', 'school', 'synced_through', 'full_sync']
+    readonly_fields = ['resource', 'school']
+    list_filter = ['resource']
+    list_display = ('__str__', 'synced_through', 'full_sync')
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(Weekday)
 class WeekdayAdmin(admin.ModelAdmin):
     fields = ['name', 'abbreviation']
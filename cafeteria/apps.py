@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CafeteriaConfig(AppConfig):
     name = 'cafeteria'
     verbose_name = 'Cafeteria Administration'
+
+    def ready(self):
+        import cafeteria.signals  # noqa
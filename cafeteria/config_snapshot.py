@@ -0,0 +1,65 @@
+import time
+
+from constance import config as constance_config
+from constance import settings as constance_settings
+from constance.backends.database.models import Constance
+
+
+# How often, in seconds, a worker checks whether its snapshot is stale
+CHECK_INTERVAL = 5
+VERSION_KEY = constance_settings.DATABASE_PREFIX + 'SNAPSHOT_VERSION'
+
+
+def bump_version():
+    """ Mark every worker's snapshot as stale """
+    Constance.objects.update_or_create(key=VERSION_KEY, defaults={'value': time.time_ns()})
+
+
+class ConfigSnapshot:
+    """
+    Process-local copy of the constance settings, read with the same
+    attribute access as constance.config. At most every CHECK_INTERVAL
+    seconds the version row is read, and only when it has changed are all
+    CONSTANCE_CONFIG keys reloaded, in a single query.
+    """
+
+    def __init__(self):
+        super().__setattr__('_values', None)
+        super().__setattr__('_version', None)
+        super().__setattr__('_checked', 0)
+
+    def __getattr__(self, key):
+        if key not in constance_settings.CONFIG:
+            raise AttributeError(key)
+        if self._values is None or time.monotonic() - self._checked > CHECK_INTERVAL:
+            self.refresh()
+        return self._values[key]
+
+    def __setattr__(self, key, value):
+        setattr(constance_config, key, value)
+        self.invalidate()
+
+    def __dir__(self):
+        return constance_settings.CONFIG.keys()
+
+    def invalidate(self):
+        super().__setattr__('_values', None)
+
+    def refresh(self):
+        version = Constance.objects.filter(key=VERSION_KEY).values_list('value', flat=True).first()
+        if self._values is None or version != self._version:
+            prefix = constance_settings.DATABASE_PREFIX
+            stored = {}
+            keys = [prefix + key for key in constance_settings.CONFIG]
+            for row in Constance.objects.filter(key__in=keys):
+                stored[row.key[len(prefix):]] = row.value
+            values = {}
+            for key, options in constance_settings.CONFIG.items():
+                value = stored.get(key)
+                values[key] = options[0] if value is None else value
+            super().__setattr__('_values', values)
+            super().__setattr__('_version', version)
+        super().__setattr__('_checked', time.monotonic())
+
+
+config = ConfigSnapshot()
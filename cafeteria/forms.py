@@ -1,4 +1,5 @@
 from django import forms
+from django.core.exceptions import ValidationError
 
 from cafeteria.models import School
 from menu.models import MenuItem
@@ -27,9 +28,26 @@ class GeneralForm(forms.Form):
 
 
 class MenuItemChoiceField(forms.ModelChoiceField):
+    menu_items = None
+
     def label_from_instance(self, obj):
         return '{} - ${}'.format(obj.name, obj.cost)
 
+    def set_menu_items(self, menu_items):
+        """ Offer an already loaded list of menu items instead of querying for them """
+        self.menu_items = {str(item.pk): item for item in menu_items}
+        self.choices = [('', self.empty_label)] + [(item.pk, self.label_from_instance(item)) for item in menu_items]
+
+    def to_python(self, value):
+        if self.menu_items is None:
+            return super().to_python(value)
+        if value in self.empty_values:
+            return None
+        try:
+            return self.menu_items[str(value)]
+        except KeyError:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
 
 class SchoolsModelForm(forms.ModelForm):
     class Meta:
@@ -51,6 +69,9 @@ class UserOrderForm(forms.Form):
         'class': 'block pl-3 pr-10 py-2 text-sm border-gray-300 focus:outline-none focus:ring-blue-500 focus:border-blue-500 rounded-md'}))
     def __init__(self, *args, **kwargs):
         queryset = kwargs.pop('queryset', None)
+        menu_items = kwargs.pop('menu_items', None)
         super(UserOrderForm, self).__init__(*args, **kwargs)
         if queryset:
-            self.fields['menu_item'].queryset = queryset
\ No newline at end of file
+            self.fields['menu_item'].queryset = queryset
+        if menu_items is not None:
+            self.fields['menu_item'].set_menu_items(menu_items)
@@ -0,0 +1,138 @@
+import copy
+import io
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, List, NamedTuple
+
+from pypdf import PdfWriter
+from reportlab import platypus
+from reportlab.graphics.barcode import qr
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+
+# This module is imported by the worker processes, so it must not import
+# Django models.
+
+
+# Cards rendered by each worker process, rounded up to the end of a homeroom
+CHUNK_SIZE = 250
+
+
+class Card(NamedTuple):
+    """ Everything printed on one lunch card """
+    name: str
+    role: str
+    number: int
+    lunch_uuid: str
+    group: int
+
+
+def render_cards(cards: List[Card], output: BinaryIO):
+    """ Lay out one page per card and write the PDF to output """
+    card_width = 86*mm
+    card_height = 54*mm
+    margin = 2*mm
+    document = platypus.BaseDocTemplate(output, pagesize=(card_width, card_height), rightMargin=margin, leftMargin=margin, topMargin=margin, bottomMargin=margin)
+
+    styles = getSampleStyleSheet()
+    normal_style = copy.copy(styles['Normal'])
+    normal_style.fontSize = 16
+    normal_style.leading = 18
+    normal_style.alignment = TA_CENTER
+    role_style = copy.copy(styles['Normal'])
+    role_style.fontSize = 8
+    role_style.leading = 8
+    role_style.textTransform = 'uppercase'
+    role_style.alignment = TA_CENTER
+    small_style = copy.copy(styles['Heading2'])
+    small_style.fontSize = 10
+    small_style.leading = 10
+    small_style.spaceBefore = 0
+    small_style.spaceAfter = 0
+    title_style = copy.copy(styles['Title'])
+    title_style.fontSize = 20
+    title_style.leading = 20
+    title_style.spaceBefore = 0
+    title_style.spaceAfter = 0
+
+    qr_size = 37*mm
+    top_offset = 4*mm
+    role_height = 8*mm
+    title_height = card_height - qr_size - top_offset
+
+    frames = [platypus.Frame(document.leftMargin, card_height - title_height - top_offset, document.width, title_height, id="title-frame")]
+    frames.append(platypus.Frame(document.leftMargin, document.bottomMargin, document.width - qr_size, qr_size, id="image-frame"))
+    frames.append(platypus.Frame(document.leftMargin, document.bottomMargin, document.width - qr_size, qr_size, id="misc-frame"))
+    frames.append(platypus.Frame(document.leftMargin, 0, 12*mm, 9*mm, id="number-frame"))
+    frames.append(platypus.Frame(document.leftMargin, 0, document.width - qr_size, role_height, id="role-frame"))
+    frames.append(platypus.Frame(card_width - qr_size, document.bottomMargin - margin, qr_size, qr_size, id="qr-frame"))
+    template = platypus.PageTemplate(frames=frames)
+    document.addPageTemplates(template)
+
+    image_path = Path(__file__).resolve(strict=True).parent / 'report_images/knights-head.jpg'
+    image = platypus.Image(image_path, width=30*mm, height=30*mm)
+
+    data = []
+    for card in cards:
+        name = platypus.Paragraph(card.name, title_style)
+        data.append(platypus.KeepInFrame(card_width, title_height, content=[name]))
+        data.append(platypus.FrameBreak('image-frame'))
+        data.append(image)
+        data.append(platypus.FrameBreak('misc-frame'))
+        data.append(platypus.Paragraph('NRCA Cafeteria<br/>Lunch Card', normal_style))
+        if card.number > 1:
+            data.append(platypus.FrameBreak('number-frame'))
+            data.append(platypus.Paragraph('R{}'.format(card.number), small_style))
+        data.append(platypus.FrameBreak('role-frame'))
+        data.append(platypus.Paragraph(card.role, role_style))
+        data.append(platypus.FrameBreak('qr-frame'))
+        data.append(qr.QrCode(card.lunch_uuid, qrBorder=0))
+        data.append(platypus.PageBreak())
+    document.build(data)
+
+
+def render_chunk(cards: List[Card]) -> bytes:
+    """ Render cards to PDF bytes, run in a worker process """
+    buffer = io.BytesIO()
+    render_cards(cards, buffer)
+    return buffer.getvalue()
+
+
+def chunk_cards(cards: List[Card], chunk_size: int = CHUNK_SIZE) -> List[List[Card]]:
+    """
+    Split cards, in order, into chunks of about chunk_size. Chunks end
+    between groups (homerooms) unless a group is twice the chunk size.
+    """
+    chunks = []
+    chunk = []
+    for card in cards:
+        if chunk and ((len(chunk) >= chunk_size and card.group != chunk[-1].group)
+                      or len(chunk) >= 2 * chunk_size):
+            chunks.append(chunk)
+            chunk = []
+        chunk.append(card)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def render_cards_parallel(cards: List[Card], output: BinaryIO, workers: int, chunk_size: int = CHUNK_SIZE):
+    """
+    Render chunks of cards across a pool of worker processes and write
+    them, concatenated in their original order, to output.
+    """
+    chunks = chunk_cards(cards, chunk_size)
+    if len(chunks) < 2 or workers < 2:
+        render_cards(cards, output)
+        return
+    # Spawned workers start clean rather than inheriting the parent's
+    # threads and database connections
+    context = multiprocessing.get_context('spawn')
+    writer = PdfWriter()
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as pool:
+        for part in pool.map(render_chunk, chunks):
+            writer.append(io.BytesIO(part))
+    writer.write(output)
@@ -11,16 +11,22 @@
 
 
 import logging
+import time
+from decimal import Decimal
 from typing import List
 
 from django.core.mail import EmailMessage
 from django.core.management.base import BaseCommand
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+from django.db.models.query import QuerySet
 from django.template.loader import render_to_string
 from django.utils import timezone
 
 from constance import config
 
 from profiles.models import Profile
+from transactions import ledger
 from transactions.models import Transaction
 
 
@@ -28,7 +34,7 @@ logger = logging.getLogger(__file__)
 
 
 class Command(BaseCommand):
-    help = 'Audit current account balance based on transaction history.'
+    help = 'Audit current account balance based on completed transaction history.'
 
     def add_arguments(self, parser):
         group = parser.add_mutually_exclusive_group(required=True)
@@ -45,37 +51,98 @@ class Command(BaseCommand):
             action='store_true',
             help='Audit the current balance of all profiles.'
         )
+        parser.add_argument(
+            '-s',
+            '--school',
+            type=int,
+            help='Only audit profiles in the school with this ID.'
+        )
+        parser.add_argument(
+            '-g',
+            '--grade',
+            type=int,
+            help='Only audit profiles in the grade level with this value.'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Replay every transaction instead of starting from the balance checkpoints.'
+        )
+        parser.add_argument(
+            '--no-checkpoint',
+            action='store_true',
+            help='Do not record new balance checkpoints for the profiles that pass.'
+        )
 
     def handle(self, *args, **options):
-        incorrect_balances = []
+        started = time.perf_counter()
+        profiles = Profile.objects.all()
         if options['all']:
-            all_users = Profile.objects.filter(active=True)
-            for user in all_users:
-                audit_info = self.audit_current_balance(user.id)
-                if audit_info:
-                    incorrect_balances.append(audit_info)
+            profiles = profiles.filter(active=True)
         else:
-            for profile_id in options['profile_ids']:
-                audit_info = self.audit_current_balance(profile_id)
-                if audit_info:
-                    incorrect_balances.append(audit_info)
+            profiles = profiles.filter(id__in=options['profile_ids'])
+        if options['school']:
+            profiles = profiles.filter(grade__school=options['school'])
+        if options['grade'] is not None:
+            profiles = profiles.filter(grade__value=options['grade'])
+        mismatches = self.audit_current_balances(profiles, options['full'])
+        incorrect_balances = []
+        for user in mismatches:
+            logger.info("*** Incorrect Balance ***\n{}'s balance should be ${}, but is listed as ${}.".format(user.name(), user.balance, user.current_balance))
+            incorrect_balances.append([user.name, user.transaction_count, user.current_balance, user.balance])
+        elapsed = time.perf_counter() - started
+        logger.info('Balance audit found {} incorrect balances in {:.3f}s.'.format(len(incorrect_balances), elapsed))
+        self.stdout.write('Found {} incorrect balances in {:.3f}s.'.format(len(incorrect_balances), elapsed))
+        if not options['no_checkpoint']:
+            count = ledger.record_checkpoints(self.verified_balances(profiles, options['full']))
+            self.stdout.write('Recorded {} balance checkpoints.'.format(count))
         if incorrect_balances:
                 self.email_audit_report(incorrect_balances)
 
-    def audit_current_balance(self, profile_id: int):
-        user = Profile.objects.get(id=profile_id)
-        transactions = Transaction.objects.filter(transactee=user)
-        balance = 0
-        for transaction in transactions:
-            if transaction.transaction_type == Transaction.CREDIT:
-                balance = balance + transaction.amount
-            else:
-                balance = balance - abs(transaction.amount)
-        if user.current_balance != balance:
-            logger.info("*** Incorrect Balance ***\n{}'s balance should be ${}, but is listed as ${}.".format(user.name(), balance, user.current_balance))
-            return [user.name, transactions.count(), user.current_balance, balance]
-        else:
-            return None
+    def audit_current_balances(self, profiles: QuerySet, full: bool = False) -> QuerySet:
+        """
+        Compare each profile's current balance with its checkpoint plus the
+        completed transactions after it, or with all of its completed
+        transactions when full is set, in a single grouped query. Returns
+        only the mismatched profiles, annotated with balance and
+        transaction_count.
+        """
+        return self.replayed_balances(profiles, full)\
+            .exclude(balance=F('current_balance'))\
+            .select_related('user').order_by('user__last_name', 'user__first_name')
+
+    def verified_balances(self, profiles: QuerySet, full: bool = False) -> QuerySet:
+        """
+        (profile ID, transaction ID, balance) rows for the profiles whose
+        current balance matches, as of the latest completed transaction the
+        audit checked it against, so nothing posted since is taken as
+        verified. Profiles already checkpointed at that transaction are left
+        out.
+        """
+        return self.replayed_balances(profiles, full)\
+            .filter(balance=F('current_balance'), latest_transaction__isnull=False)\
+            .filter(Q(checkpoint_transaction__isnull=True) | ~Q(checkpoint_transaction=F('latest_transaction')))\
+            .order_by().values_list('id', 'latest_transaction', 'current_balance')
+
+    def replayed_balances(self, profiles: QuerySet, full: bool) -> QuerySet:
+        """ Annotate profiles with the balance their completed transactions add up to """
+        zero = Value(Decimal('0.00'))
+        replayed = Q(transaction__completed__isnull=False)
+        starting_balance = zero
+        if not full:
+            replayed &= ledger.after_checkpoint('transaction__', 'balance_checkpoint')
+            starting_balance = Coalesce('balance_checkpoint__balance', zero)
+        credits = Sum('transaction__amount', filter=replayed & Q(transaction__transaction_type=Transaction.CREDIT))
+        debits = Sum(Abs('transaction__amount'), filter=replayed & Q(transaction__transaction_type=Transaction.DEBIT))
+        return profiles.annotate(
+            balance=ExpressionWrapper(
+                starting_balance + Coalesce(credits, zero) - Coalesce(debits, zero),
+                output_field=DecimalField(max_digits=8, decimal_places=2)
+            ),
+            checkpoint_transaction=F('balance_checkpoint__transaction'),
+            latest_transaction=ledger.latest_completed(),
+            transaction_count=Count('transaction', filter=replayed)
+        )
 
     def email_audit_report(self, incorrect_balances: List):
         recipients_list = config.REPORTS_EMAIL.split(',')
@@ -11,19 +11,25 @@
 
 
 import logging
-from decimal import Decimal
+import time
 
 from django.core.management.base import BaseCommand
+from django.db import transaction as db_transaction
+from django.db.models.query import QuerySet
 
 from profiles.models import Profile
-from transactions.models import Transaction
+from transactions import ledger
+from transactions.models import BalanceCheckpoint, Transaction
 
 
 logger = logging.getLogger(__file__)
 
+# Rows read and written per batch
+BATCH_SIZE = 500
+
 
 class Command(BaseCommand):
-    help = 'Correct current lunch balance by reprocessing each transaction.'
+    help = 'Correct current lunch balance by reprocessing each completed transaction.'
 
     def add_arguments(self, parser):
         group = parser.add_mutually_exclusive_group(required=True)
@@ -38,30 +44,82 @@ class Command(BaseCommand):
             '-a',
             '--all',
             action='store_true',
-            help='Correct the current balance of all profiles. (This may take a long time!)'
+            help='Correct the current balance of all profiles.'
+        )
+        parser.add_argument(
+            '-n',
+            '--dry-run',
+            action='store_true',
+            help='List the balances that would change without saving them.'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Replay every transaction instead of starting from the balance checkpoints.'
         )
 
     def handle(self, *args, **options):
         if options['all']:
-            all_users = Profile.objects.filter(active=True)
-            for user in all_users:
-                self.correct_current_balance(user)
+            profiles = Profile.objects.filter(active=True)
+        else:
+            profiles = Profile.objects.filter(id__in=options['profile_ids'])
+        started = time.perf_counter()
+        if options['dry_run']:
+            transactions, changed_profiles = self.rebuild(profiles, options['full'], dry_run=True)
         else:
-            for profile_id in options['profile_ids']:
-                self.correct_current_balance(Profile.objects.get(id=profile_id))
+            with db_transaction.atomic():
+                ledger.lock_profiles(profiles.values_list('id', flat=True))
+                transactions, changed_profiles = self.rebuild(profiles, options['full'])
+        self.stdout.write('{} {} transactions and {} current balances in {:.2f}s.'.format(
+            'Would correct' if options['dry_run'] else 'Corrected',
+            transactions, changed_profiles, time.perf_counter() - started))
 
-    def correct_current_balance(self, profile: Profile):
-        transactions = Transaction.objects.filter(transactee=profile).order_by('completed', 'submitted')
-        if transactions.count() > 0:
-            balance = Decimal(0)
-            for transaction in transactions:
-                transaction.beginning_balance = balance
-                if transaction.transaction_type == Transaction.CREDIT:
-                    balance = balance + transaction.amount
+    def rebuild(self, profiles: QuerySet, full: bool = False, dry_run: bool = False) -> (int, int):
+        """
+        Replay the completed transactions of the profiles in SQL, starting
+        from their balance checkpoints unless full is set, and write back,
+        in batches, only the balances that differ.
+        """
+        names = {profile.id: profile.name() for profile in profiles.select_related('user')}
+        replayed = Transaction.objects.filter(transactee__in=profiles.values('id')).filter(completed__isnull=False)
+        starting_balances = {}
+        if not full:
+            replayed = replayed.filter(ledger.after_checkpoint())
+            starting_balances = dict(BalanceCheckpoint.objects.filter(profile__in=profiles.values('id'))
+                                     .values_list('profile_id', 'balance'))
+        current_balances = dict(starting_balances)
+        changed = []
+        transactions = ledger.running_balances(replayed).values_list('id', 'transactee_id', 'beginning_balance', 'ending_balance', 'change', 'running_balance')
+        for transaction_id, transactee_id, beginning_balance, ending_balance, change, running_balance in transactions.iterator(chunk_size=BATCH_SIZE):
+            running_balance = running_balance + starting_balances.get(transactee_id, 0)
+            correct_beginning = running_balance - change
+            if beginning_balance != correct_beginning or ending_balance != running_balance:
+                if dry_run:
+                    self.stdout.write('Transaction #{} for {}: beginning {} -> {}, ending {} -> {}'.format(
+                        transaction_id, names[transactee_id], beginning_balance, correct_beginning, ending_balance, running_balance))
+                changed.append(Transaction(
+                    id=transaction_id, transactee_id=transactee_id,
+                    beginning_balance=correct_beginning, ending_balance=running_balance))
+            current_balances[transactee_id] = running_balance
+
+        changed_profiles = []
+        for profile in profiles.filter(id__in=current_balances.keys()).only('id', 'current_balance'):
+            if profile.current_balance != current_balances[profile.id]:
+                if dry_run:
+                    self.stdout.write('{}: current balance {} -> {}'.format(
+                        names[profile.id], profile.current_balance, current_balances[profile.id]))
                 else:
-                    balance = balance - abs(transaction.amount)
-                transaction.ending_balance = balance
-                transaction.save()
-            profile.current_balance = balance
-            profile.save()
-            logger.info("\n*** Balance Corrected for {} ***\n{} transactions were reprocessed".format(profile.name(), transactions.count()))
+                    logger.info("\n*** Balance Corrected for {} ***\n{} -> {}".format(
+                        names[profile.id], profile.current_balance, current_balances[profile.id]))
+                profile.current_balance = current_balances[profile.id]
+                changed_profiles.append(profile)
+
+        if not dry_run:
+            Transaction.objects.bulk_update(changed, ['beginning_balance', 'ending_balance'], batch_size=BATCH_SIZE)
+            Profile.objects.bulk_update(changed_profiles, ['current_balance'], batch_size=BATCH_SIZE)
+            if full:
+                # A full replay that changed anything proves the checkpoints wrong
+                corrected = {transaction.transactee_id for transaction in changed}
+                corrected.update(profile.id for profile in changed_profiles)
+                BalanceCheckpoint.objects.filter(profile__in=corrected).delete()
+        return len(changed), len(changed_profiles)
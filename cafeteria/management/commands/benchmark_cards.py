@@ -0,0 +1,79 @@
+#
+# benchmark_cards.py
+#
+# Copyright (c) 2022 Doug Penny
+# Licensed under MIT
+#
+# See LICENSE.md for license information
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import os
+import tempfile
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from cafeteria import lunchcards
+
+
+class Command(BaseCommand):
+    help = 'Compare the wall time of serial and parallel lunch card rendering using generated cards. No data is read or written.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-c',
+            '--cards',
+            default=[500, 2000, 5000],
+            dest='sizes',
+            help='One or more numbers of cards to render.',
+            nargs='+',
+            type=int
+        )
+        parser.add_argument(
+            '-w',
+            '--workers',
+            default=os.cpu_count(),
+            help='Worker processes for the parallel run. Defaults to the number of CPUs.',
+            type=int
+        )
+        parser.add_argument(
+            '--chunk-size',
+            default=lunchcards.CHUNK_SIZE,
+            help='Cards rendered by each worker.',
+            type=int
+        )
+
+    def fake_cards(self, count: int):
+        # Homerooms of 25 students, each led by their teacher
+        for number in range(count):
+            group = number // 26
+            role = 'Staff' if number % 26 == 0 else 'Student'
+            yield lunchcards.Card(
+                name='Student {}'.format(number),
+                role=role,
+                number=1 + number % 3,
+                lunch_uuid=str(uuid.uuid4()),
+                group=group
+            )
+
+    def time_render(self, render, cards):
+        with tempfile.TemporaryFile() as output:
+            started = time.perf_counter()
+            render(cards, output)
+            return time.perf_counter() - started, output.tell()
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        chunk_size = options['chunk_size']
+        self.stdout.write('{:>7}  {:>10}  {:>12}  {:>8}'.format('Cards', 'Serial', 'Parallel ({})'.format(workers), 'Speedup'))
+        for size in options['sizes']:
+            cards = list(self.fake_cards(size))
+            serial, serial_bytes = self.time_render(lunchcards.render_cards, cards)
+            parallel, parallel_bytes = self.time_render(
+                lambda cards, output: lunchcards.render_cards_parallel(cards, output, workers, chunk_size), cards)
+            self.stdout.write('{:>7}  {:>9.2f}s  {:>11.2f}s  {:>7.2f}x'.format(size, serial, parallel, serial / parallel))
+            self.stdout.write('         {:.1f} MB serial, {:.1f} MB parallel'.format(serial_bytes / 2**20, parallel_bytes / 2**20))
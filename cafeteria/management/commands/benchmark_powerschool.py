@@ -0,0 +1,115 @@
+#
+# benchmark_powerschool.py
+#
+# Copyright (c) 2022 Doug Penny
+# Licensed under MIT
+#
+# See LICENSE.md for license information
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+
+from powerschool import powerschool
+from powerschool.powerschool import Powerschool
+
+
+class FakePowerschoolHandler(BaseHTTPRequestHandler):
+    """ Answers token, count and student page requests after the server's latency """
+    protocol_version = 'HTTP/1.1'
+    # Send each small response at once rather than waiting on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, body: dict):
+        time.sleep(self.server.latency)
+        content = json.dumps(body).encode('UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_json({'access_token': 'benchmark', 'expires_in': 3600})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith('/count'):
+            return self.send_json({'resource': {'count': self.server.records}})
+        params = parse_qs(url.query)
+        page_size = int(params['pagesize'][0])
+        first = (int(params['page'][0]) - 1) * page_size
+        students = [
+            {'id': number, 'name': {'first_name': 'First{}'.format(number), 'last_name': 'Last{}'.format(number)}}
+            for number in range(first, min(first + page_size, self.server.records))
+        ]
+        self.send_json({'students': {'student': students}})
+
+
+class Command(BaseCommand):
+    help = 'Compare the wall time of fetching a paged PowerSchool resource one page at a time and concurrently, from a local fake server that waits before every response. No data is read or written.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-r',
+            '--records',
+            default=3000,
+            help='Students the fake server returns.',
+            type=int
+        )
+        parser.add_argument(
+            '-l',
+            '--latency',
+            default=0.1,
+            help='Seconds the fake server waits before each response.',
+            type=float
+        )
+        parser.add_argument(
+            '-c',
+            '--concurrency',
+            default=[2, 4, 8],
+            help='One or more page fetching limits to compare against one page at a time.',
+            nargs='+',
+            type=int
+        )
+
+    def time_fetch(self, client: Powerschool, concurrency: int):
+        started = time.perf_counter()
+        students = client.resource('ws/v1/school/1/student', concurrency=concurrency)
+        return time.perf_counter() - started, students
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakePowerschoolHandler)
+        server.daemon_threads = True
+        server.latency = options['latency']
+        server.records = options['records']
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = Powerschool('http://127.0.0.1:{}/'.format(server.server_port), 'benchmark', 'benchmark', batch=True)
+            pages = -(-options['records'] // powerschool.PAGE_SIZE)
+            self.stdout.write('{} records in {} pages, {:.0f}ms latency'.format(
+                options['records'], pages, options['latency'] * 1000))
+            self.stdout.write('{:>11}  {:>9}  {:>8}'.format('Concurrency', 'Time', 'Speedup'))
+            serial, expected = self.time_fetch(client, 1)
+            self.stdout.write('{:>11}  {:>8.2f}s  {:>7.2f}x'.format(1, serial, 1))
+            for concurrency in options['concurrency']:
+                elapsed, students = self.time_fetch(client, concurrency)
+                if students != expected:
+                    self.stderr.write('Concurrency {} returned the records out of order.'.format(concurrency))
+                self.stdout.write('{:>11}  {:>8.2f}s  {:>7.2f}x'.format(concurrency, elapsed, serial / elapsed))
+        finally:
+            server.shutdown()
+            server.server_close()
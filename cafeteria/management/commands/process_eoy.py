@@ -10,6 +10,8 @@
 #
 
 
+import time
+
 from django.core.management.base import BaseCommand
 
 from constance import config
@@ -37,8 +39,10 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
+        started = time.perf_counter()
         if options['profile']:
             profile = Profile.objects.get(id=options['profile'])
-            end_of_year_process(options['year'], profile)
+            rolled_over = end_of_year_process(options['year'], profile, progress=self.stdout.write)
         else:
-            end_of_year_process(options['year'])
\ No newline at end of file
+            rolled_over = end_of_year_process(options['year'], progress=self.stdout.write)
+        self.stdout.write('Rolled over {} profiles in {:.1f}s.'.format(rolled_over, time.perf_counter() - started))
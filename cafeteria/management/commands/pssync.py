@@ -12,21 +12,45 @@
 
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.utils import IntegrityError
 from django.utils import timezone
 
+from datetime import timedelta
+from itertools import islice
+
 import logging
 
-from cafeteria.models import GradeLevel, School
-from powerschool.powerschool import Powerschool
+from cafeteria.models import GradeLevel, School, SyncWatermark
+from powerschool.powerschool import Powerschool, PowerschoolError
 from profiles.models import Profile
 
 
 logger = logging.getLogger(__file__)
 
+# Records written in each database transaction while later pages download
+CHUNK_SIZE = 200
+# Incremental syncs fall back to a full one when the last full sync is
+# older than this. mark_inactive deactivates profiles that have not synced
+# in two days, and only a full sync touches every profile.
+FULL_SYNC_INTERVAL = timedelta(days=1)
+# PowerSchool q filter for students modified on or after a date
+STUDENTS_MODIFIED_SINCE = 'transaction_date=ge={}'
+
+
+def chunked(records, size):
+    """ Split an iterable of records into lists of up to size records """
+    records = iter(records)
+    chunk = list(islice(records, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(records, size))
+
 
 class Command(BaseCommand):
     help = 'Synchronize resources from PowerSchool to Lunch Manager'
+    chunk_size = CHUNK_SIZE
+    full = True
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -36,19 +60,38 @@ class Command(BaseCommand):
             help='Select the resource to sycn from PowerSchool. The default is to sync ALL resources.',
             nargs='?'
         )
+        parser.add_argument(
+            '--chunk-size',
+            default=CHUNK_SIZE,
+            help='Records written in each database transaction while later pages download.',
+            type=int
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Fetch every record instead of only those modified since the last sync.'
+        )
 
     def handle(self, *args, **options):
-        client = Powerschool()
-        if options['resource'] == 'all':
-            self.sync_schools_using_client(client)
-            self.sync_students_using_client(client)
-            self.sync_staff_using_client(client)
-        elif options['resource'] == 'schools':
-            self.sync_schools_using_client(client)
-        elif options['resource'] == 'staff':
-            self.sync_staff_using_client(client)
-        elif options['resource'] == 'students':
-            self.sync_students_using_client(client)
+        self.chunk_size = options['chunk_size']
+        self.full = options['full']
+        client = Powerschool(batch=True)
+        try:
+            if options['resource'] == 'all':
+                self.sync_schools_using_client(client)
+                self.sync_students_using_client(client)
+                self.sync_staff_using_client(client)
+            elif options['resource'] == 'schools':
+                self.sync_schools_using_client(client)
+            elif options['resource'] == 'staff':
+                self.sync_staff_using_client(client)
+            elif options['resource'] == 'students':
+                self.sync_students_using_client(client)
+        except PowerschoolError as e:
+            raise CommandError('Synchronization stopped: {}'.format(e))
+        finally:
+            for line in client.latency_report():
+                logger.info('PowerSchool {}'.format(line))
 
     def sync_schools_using_client(self, client):
         logger.info('Synchronizing schools...')
@@ -69,11 +112,66 @@ class Command(BaseCommand):
                         })
         logger.info('All schools successfully synchronized...')
 
+    def modified_since(self, resource, school=None):
+        """
+        The date to fetch modified records from, or None when every record
+        should be fetched: with --full, on the first sync, and when the last
+        full sync is older than FULL_SYNC_INTERVAL.
+        """
+        if self.full:
+            return None
+        watermark = SyncWatermark.objects.filter(resource=resource, school=school).first()
+        if not watermark or not watermark.full_sync or watermark.full_sync < timezone.now() - FULL_SYNC_INTERVAL:
+            return None
+        return timezone.localdate(watermark.synced_through)
+
+    def advance_watermark(self, resource, school, started, full):
+        defaults = {'synced_through': started}
+        if full:
+            defaults['full_sync'] = started
+        SyncWatermark.objects.update_or_create(resource=resource, school=school, defaults=defaults)
+
     def sync_staff_using_client(self, client):
         logger.info('Synchronizing staff...')
-        active_staff = client.active_staff()
+        started = timezone.now()
+        since = self.modified_since(SyncWatermark.STAFF)
+        try:
+            retrieved, newly_created = self.sync_staff_records(client, client.iter_active_staff(since))
+        except PowerschoolError as e:
+            if since is None:
+                raise
+            # The PowerQuery is defined in the district's plugin, which may
+            # not accept the modified_since argument
+            logger.warning('Could not fetch staff modified since {}, synchronizing all staff: {}'.format(since, e))
+            since = None
+            retrieved, newly_created = self.sync_staff_records(client, client.iter_active_staff())
+        self.advance_watermark(SyncWatermark.STAFF, None, started, since is None)
+        logger.info('Retrieved {} staff{}, created {} new staff members'.format(
+            retrieved, ' modified since {}'.format(since) if since else '', newly_created))
+
+    def sync_staff_records(self, client, active_staff):
+        grades = {grade.value: grade for grade in GradeLevel.objects.all()}
+        retrieved = 0
         newly_created = 0
-        for member in active_staff:
+        for chunk in chunked(active_staff, self.chunk_size):
+            with transaction.atomic():
+                newly_created += self.upsert_staff(client, chunk, grades)
+            retrieved += len(chunk)
+        return retrieved, newly_created
+
+    def upsert_staff(self, client, members, grades):
+        """
+        Update or create staff profiles and users and their homerooms,
+        returning how many were created. A staff member whose homeroom
+        roster cannot be retrieved keeps their grade and homeroom students.
+        """
+        now = timezone.now()
+        rows = []
+        rosters = {}
+        grades_by_id = {grade.id: grade for grade in grades.values()}
+        kept_grades = dict(Profile.objects.filter(user_dcid__in=[int(member['dcid']) for member in members])
+                           .values_list('user_dcid', 'grade_id'))
+        for member in members:
             try:
                 phone = 'x' + member['school_phone'][-4:]
             except:
@@ -82,17 +180,6 @@ class Command(BaseCommand):
                 room = member['homeroom']
             except:
                 room = 'n/a'
-            # look for an existing profile and create a new one if not found
-            staff, created = Profile.objects.update_or_create(user_dcid=member['dcid'],
-                                                              defaults={
-                'last_sync': timezone.now(),
-                'phone': phone,
-                'role': Profile.STAFF,
-                'room': room,
-                'active': True,
-                'user_number': member['teachernumber'],
-            }
-            )
             try:
                 email_address = member['teacherloginid'] + '@nrcaknights.com'
             except:
@@ -100,119 +187,176 @@ class Command(BaseCommand):
                     email_address = member['loginid'] + '@nrcaknights.com'
                 except:
                     email_address = member['user_dcid'] + '@nrcaknights.com'
-            # if a new profile is created, create the corresponding user
-            if created:
-                user, created = User.objects.get_or_create(
-                    first_name=member['first_name'],
-                    last_name=member['last_name'],
-                    email=email_address,
-                    username=email_address,
-                )
-                staff.user = user
-                staff.save()
-                newly_created = newly_created + 1
-            # if the staff member already exists, update the user info
+            # if the staff member has a homeroom, their grade comes from its roster
+            user_dcid = int(member['dcid'])
+            grade = None
+            try:
+                homeroom_roster = client.homeroom_roster_for_teacher(user_dcid)
+            except PowerschoolError as e:
+                logger.error('Could not fetch the homeroom roster of {} {}, keeping their homeroom: {}'.format(
+                    member['first_name'], member['last_name'], e))
+                homeroom_roster = None
+                grade = grades_by_id.get(kept_grades.get(user_dcid))
             else:
-                user = staff.user
-                if user:
-                    user.first_name = member['first_name']
-                    user.last_name = member['last_name']
-                    user.email = email_address
-                    user.username = email_address
-                    user.is_active = True
-                    user.save()
-                else:
-                    user, created = User.objects.get_or_create(
-                        first_name=member['first_name'],
-                        last_name=member['last_name'],
-                        email=email_address,
-                        username=email_address,
-                    )
-                    staff.user = user
-                    staff.save()
-            # if the staff member has a homeroom, update their roster
-            homeroom_roster = client.homeroom_roster_for_teacher(
-                staff.user_dcid)
+                rosters[user_dcid] = [int(student['dcid']) for student in homeroom_roster]
             if homeroom_roster:
+                grade_levels = [student['grade_level'] for student in homeroom_roster if student['grade_level'] != ""]
                 try:
-                    grade_level = homeroom_roster[0]['grade_level']
-                    count = 1
-                    while grade_level == "" and count < len(homeroom_roster):
-                        grade_level = homeroom_roster[count]['grade_level']
-                        count = count + 1
-                    staff.grade = GradeLevel.objects.get(value=int(grade_level))
+                    grade = grades[int(grade_levels[0])]
                 except:
-                    staff.grade = None
-                    logger.error('No grade level assigned to homeroom teacher: {}'.format(staff.name()))
-                staff.students.clear()
-                for student in homeroom_roster:
-                    try:
-                        student = Profile.objects.get(
-                            student_dcid=int(student['dcid']))
-                        staff.students.add(student)
-                    except:
-                        pass
+                    logger.error('No grade level assigned to homeroom teacher: {} {}'.format(
+                        member['first_name'], member['last_name']))
+            rows.append((user_dcid, {
+                'active': True,
+                'grade': grade,
+                'last_sync': now,
+                'phone': phone,
+                'role': Profile.STAFF,
+                'room': room,
+                'user_number': member['teachernumber'],
+            }, {
+                'first_name': member['first_name'],
+                'last_name': member['last_name'],
+                'email': email_address,
+                'username': email_address,
+            }))
+        profiles, newly_created = self.upsert_profiles('user_dcid', rows)
+        # Replace the rosters that were retrieved with one UPDATE to clear
+        # them and one per homeroom
+        Profile.objects.filter(homeroom_teacher__in=[staff for staff in profiles if staff.user_dcid in rosters])\
+            .update(homeroom_teacher=None)
+        for staff in profiles:
+            if staff.user_dcid in rosters:
+                Profile.objects.filter(student_dcid__in=rosters[staff.user_dcid]).update(homeroom_teacher=staff)
+        return newly_created
+
+    def upsert_profiles(self, key_field, rows):
+        """
+        Update or create a profile and user for each (key, profile fields,
+        user fields) row, where key is the profile's key_field value. The
+        existing profiles and users are read with one query each, compared
+        in memory, and written back with bulk creates and updates. Returns
+        the profiles and how many of them were created.
+        """
+        existing_profiles = Profile.objects.select_related('user').in_bulk([key for key, _, _ in rows], field_name=key_field)
+        existing_users = User.objects.in_bulk([user_fields['username'] for _, _, user_fields in rows], field_name='username')
+        profiles = []
+        new_profiles = []
+        changed_profiles = []
+        new_users = []
+        changed_users = {}
+        for key, profile_fields, user_fields in rows:
+            profile = existing_profiles.get(key)
+            if profile is None:
+                profile = Profile(**{key_field: key})
+                new_profiles.append(profile)
             else:
-                staff.grade = None
-            staff.save()
-        logger.info('Retrieved {} staff, created {} new staff members'.format(
-            len(active_staff), newly_created))
+                changed_profiles.append(profile)
+            for field, value in profile_fields.items():
+                setattr(profile, field, value)
+            user = profile.user or existing_users.get(user_fields['username'])
+            if user is None:
+                user = User(is_active=True, **user_fields)
+                existing_users[user.username] = user
+                new_users.append(user)
+            else:
+                owner = existing_users.get(user_fields['username'])
+                if owner is not None and owner != user:
+                    logger.error('Username {} already belongs to another user; not updating {} {}'.format(
+                        user_fields['username'], user.first_name, user.last_name))
+                    user_fields = dict(user_fields, username=user.username)
+                changed = not user.is_active
+                for field, value in user_fields.items():
+                    changed = changed or getattr(user, field) != value
+                    setattr(user, field, value)
+                user.is_active = True
+                if changed:
+                    changed_users[user.id] = user
+            profiles.append((profile, user))
+        User.objects.bulk_create(new_users, batch_size=500)
+        # Not every database returns the IDs of bulk created rows
+        created_ids = User.objects.filter(username__in=[user.username for user in new_users]).values_list('username', 'id')
+        for username, user_id in created_ids:
+            existing_users[username].id = user_id
+        User.objects.bulk_update(changed_users.values(), ['first_name', 'last_name', 'email', 'username', 'is_active'], batch_size=500)
+        for profile, user in profiles:
+            profile.user = user
+        Profile.objects.bulk_create(new_profiles, batch_size=500)
+        if changed_profiles:
+            Profile.objects.bulk_update(changed_profiles, list(rows[0][1]) + ['user'], batch_size=500)
+        created_profiles = Profile.objects.in_bulk([getattr(profile, key_field) for profile in new_profiles], field_name=key_field)
+        return changed_profiles + list(created_profiles.values()), len(new_profiles)
 
     def sync_students_using_client(self, client):
         logger.info('Synchronizing students...')
-        for school in School.objects.filter(active=True):
+        grades = {grade.value: grade for grade in GradeLevel.objects.all()}
+        schools = {school.id: school for school in School.objects.all()}
+        for school in schools.values():
+            if not school.active:
+                continue
             logger.info('Sycning students from {} (id {})...'.format(
                 school, school.id))
-            active_students = client.studentsForSchool(
-                school.id, 'lunch,school_enrollment')
-            newly_created = 0
-            for member in active_students:
-                # look for an existing student and create a new one if not found
-                grade = GradeLevel.objects.get(value=member['school_enrollment']['grade_level'])
-                student, created = Profile.objects.update_or_create(student_dcid=member['id'],
-                                                                    defaults={
-                    'grade': grade,
-                    'last_sync': timezone.now(),
-                    'role': Profile.STUDENT,
-                    'school': School.objects.get(id=member['school_enrollment']['school_id']),
-                    'active': True,
-                    'user_number': member['local_id'],
-                }
-                )
-                try:
-                    email_address = member['student_username'] + \
-                        '@nrcaknights.com'
-                except:
-                    email_address = str(member['id']) + '@nrcaknights.com'
-                # if a new student is created, create the corresponding user
-                if created:
-                    user, created = User.objects.get_or_create(
-                        first_name=member['name']['first_name'],
-                        last_name=member['name']['last_name'],
-                        email=email_address,
-                        username=email_address,
-                    )
-                    student.user = user
-                    student.save()
-                    newly_created = newly_created + 1
-                # if the student already exists, update the user info
-                else:
-                    user = student.user
-                    if user:
-                        user.first_name = member['name']['first_name']
-                        user.last_name = member['name']['last_name']
-                        user.email = email_address
-                        user.username = email_address
-                        user.is_active = True
-                        user.save()
-                    else:
-                        user, created = User.objects.get_or_create(
-                            first_name=member['name']['first_name'],
-                            last_name=member['name']['last_name'],
-                            email=email_address,
-                            username=email_address,
-                        )
-                        student.user = user
-                        student.save()
-            logger.info('Retreived {} students, created {} new students'.format(
-                len(active_students), newly_created))
+            since = self.modified_since(SyncWatermark.STUDENTS, school)
+            try:
+                retrieved, newly_created = self.sync_school_students(client, school, since, grades, schools)
+            except PowerschoolError as e:
+                if since is None:
+                    raise
+                # The failed fetch's writes were rolled back with its transaction
+                logger.warning('Could not fetch students from {} modified since {}, synchronizing all of them: {}'.format(
+                    school, since, e))
+                since = None
+                retrieved, newly_created = self.sync_school_students(client, school, None, grades, schools)
+            logger.info('Retreived {} students{}, created {} new students'.format(
+                retrieved, ' modified since {}'.format(since) if since else '', newly_created))
+
+    def sync_school_students(self, client, school, since, grades, schools):
+        """
+        Fetch a school's students, only those modified since a date if
+        given, and write them and the school's watermark in one transaction
+        """
+        started = timezone.now()
+        query = STUDENTS_MODIFIED_SINCE.format(since.isoformat()) if since else None
+        active_students = client.iter_students_for_school(
+            school.id, 'lunch,school_enrollment', query=query)
+        retrieved = 0
+        newly_created = 0
+        with transaction.atomic():
+            for chunk in chunked(active_students, self.chunk_size):
+                newly_created += self.upsert_students(chunk, grades, schools)
+                retrieved += len(chunk)
+            self.advance_watermark(SyncWatermark.STUDENTS, school, started, since is None)
+        return retrieved, newly_created
+
+    def upsert_students(self, members, grades, schools):
+        """ Update or create student profiles and users, returning how many were created """
+        now = timezone.now()
+        rows = []
+        for member in members:
+            enrollment = member['school_enrollment']
+            try:
+                grade = grades[int(enrollment['grade_level'])]
+                school = schools[int(enrollment['school_id'])]
+            except (KeyError, ValueError):
+                logger.error('No grade level {} at school {} for student {}'.format(
+                    enrollment['grade_level'], enrollment['school_id'], member['id']))
+                continue
+            try:
+                email_address = member['student_username'] + \
+                    '@nrcaknights.com'
+            except:
+                email_address = str(member['id']) + '@nrcaknights.com'
+            rows.append((int(member['id']), {
+                'active': True,
+                'grade': grade,
+                'last_sync': now,
+                'role': Profile.STUDENT,
+                'school': school,
+                'user_number': member['local_id'],
+            }, {
+                'first_name': member['name']['first_name'],
+                'last_name': member['name']['last_name'],
+                'email': email_address,
+                'username': email_address,
+            }))
+        return self.upsert_profiles('student_dcid', rows)[1]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.13 on 2026-10-17 01:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cafeteria', '0017_lunchperiod_floating_staff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('full_sync', models.DateTimeField(blank=True, help_text='Start of the last sync that fetched every record.', null=True)),
+                ('resource', models.CharField(choices=[('staff', 'Staff'), ('students', 'Students')], max_length=16)),
+                ('synced_through', models.DateTimeField(help_text='Start of the last successful sync. Later syncs only fetch records modified since.')),
+                ('school', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_watermarks', to='cafeteria.school')),
+            ],
+            options={
+                'verbose_name_plural': 'Sync Watermarks',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='syncwatermark',
+            constraint=models.UniqueConstraint(fields=('resource', 'school'), name='unique_resource_school_watermark'),
+        ),
+        migrations.AddConstraint(
+            model_name='syncwatermark',
+            constraint=models.UniqueConstraint(condition=models.Q(('school__isnull', True)), fields=('resource',), name='unique_resource_district_watermark'),
+        ),
+    ]
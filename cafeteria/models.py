@@ -55,6 +55,31 @@ class School(models.Model):
             return self.name
 
 
+class SyncWatermark(models.Model):
+    STAFF = 'staff'
+    STUDENTS = 'students'
+    RESOURCE_CHOICES = [
+        (STAFF, 'Staff'),
+        (STUDENTS, 'Students'),
+    ]
+    full_sync = models.DateTimeField(blank=True, null=True, help_text='Start of the last sync that fetched every record.')
+    resource = models.CharField(choices=RESOURCE_CHOICES, max_length=16)
+    school = models.ForeignKey('School', on_delete=models.CASCADE, blank=True, null=True, related_name='sync_watermarks')
+    synced_through = models.DateTimeField(help_text='Start of the last successful sync. Later syncs only fetch records modified since.')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['resource', 'school'], name='unique_resource_school_watermark'),
+            models.UniqueConstraint(fields=['resource'], condition=models.Q(school__isnull=True), name='unique_resource_district_watermark'),
+        ]
+        verbose_name_plural = 'Sync Watermarks'
+
+    def __str__(self):
+        if self.school:
+            return '{} at {}'.format(self.get_resource_display(), self.school)
+        return self.get_resource_display()
+
+
 class Weekday(models.Model):
     abbreviation = models.CharField(max_length=3)
     name = models.CharField(max_length=12)
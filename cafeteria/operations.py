@@ -1,45 +1,64 @@
 import logging
 
 from datetime import timedelta
-from typing import List
+from typing import Callable, List
+from django.db import transaction as db_transaction
+from django.db.models import Exists, OuterRef
 from django.db.models.query import QuerySet
 
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 from profiles.models import Profile
+from transactions import archive, ledger
 from transactions.models import Transaction
 
 
 logger = logging.getLogger(__file__)
 
 
-def end_of_year_process(year: str, profile: Profile = None):
-    users = []
-    if profile:
-        users.append(profile)
-    else:
-        users = Profile.objects.filter(active=True)
-    for user in users:
-        transactions = Transaction.objects.filter(transactee=user)
-        if transactions.count() != 0:
-            transactions.delete()
-            temp_balance = user.current_balance
-            user.current_balance = 0
-            user.save()
-            transaction = Transaction(
-                amount=temp_balance,
-                beginning_balance=user.current_balance,
-                completed=timezone.now(),
-                description='Ending balance from the {} school year.'.format(year),
-                ending_balance=user.current_balance + temp_balance,
-                submitted=timezone.now(),
-                transactee=user,
-                transaction_type=Transaction.CREDIT,
-            )
-            transaction.save()
-            user.current_balance = transaction.ending_balance
-            user.save()
+# Profiles archived and rolled over together
+ROLLOVER_BATCH_SIZE = 500
+
+
+def end_of_year_process(year: str, profile: Profile = None, progress: Callable[[str], None] = logger.info) -> int:
+    """
+    Archive every active profile's transactions under the closing school
+    year and replace them with a single credit carrying its balance
+    forward. The balances are read once, under row locks, and the whole
+    rollover runs in one database transaction.
+    Returns the number of profiles rolled over.
+    """
+    profiles = Profile.objects.filter(id=profile.id) if profile else Profile.objects.filter(active=True)
+    completed = timezone.now()
+    with db_transaction.atomic():
+        ledger.lock_profiles(profiles.values_list('id', flat=True))
+        balances = list(
+            profiles.filter(Exists(Transaction.objects.filter(transactee=OuterRef('pk'))))
+            .order_by('id').values_list('id', 'current_balance')
+        )
+        progress('Rolling over {} profiles.'.format(len(balances)))
+        for start in range(0, len(balances), ROLLOVER_BATCH_SIZE):
+            batch = balances[start:start + ROLLOVER_BATCH_SIZE]
+            profile_ids = [profile_id for profile_id, _ in batch]
+            # The balances are carried forward below rather than rebased
+            archive.archive_transactions(Transaction.objects.filter(transactee_id__in=profile_ids), year)
+            Transaction.objects.bulk_create([
+                Transaction(
+                    amount=balance,
+                    beginning_balance=0,
+                    completed=completed,
+                    description='Ending balance from the {} school year.'.format(year),
+                    ending_balance=balance,
+                    submitted=completed,
+                    transactee_id=profile_id,
+                    transaction_type=Transaction.CREDIT,
+                )
+                for profile_id, balance in batch
+            ])
+            progress('Rolled over {} of {} profiles.'.format(start + len(batch), len(balances)))
+    return len(balances)
+
 
 def check_for_inactive(profiles: QuerySet):
     for profile in profiles:
@@ -1,26 +1,31 @@
-import collections
 import copy
 import io
+import tempfile
 
-from pathlib import Path
 from typing import Dict, List
 
 from reportlab import platypus
-from reportlab.graphics.barcode import qr
 from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch, mm
+from reportlab.lib.units import inch
 
+from django.conf import settings
+from django.db.models import F
 from django.http import FileResponse
 from django.utils import timezone
 
+from cafeteria import lunchcards
 from menu.models import MenuItem
 from profiles.models import Profile
 from transactions.models import MenuLineItem
 
 
-def entree_report_by_period(lunch_periods: Dict) -> FileResponse:
+# Bytes of PDF kept in memory before it is spooled to a temporary file
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+def entree_report_by_period(entree_counts: Dict) -> FileResponse:
     buffer = io.BytesIO()
     styles = getSampleStyleSheet()
     
@@ -52,15 +57,17 @@ def entree_report_by_period(lunch_periods: Dict) -> FileResponse:
     document.addPageTemplates(template)
 
     data = []
-    for period in lunch_periods:
-        if len(lunch_periods[period]) > 0:
+    for period, counts in entree_counts['periods'].items():
+        if period.floating_staff and period == entree_counts['floating_period']:
+            counts = entree_counts['floating_staff']
+        if len(counts) > 0:
             title = period.display_name
             data.append(platypus.Paragraph('<u>{}</u>'.format(title), title_style))
             if not period.floating_staff:
-                for item in lunch_periods[period]:
+                for item in counts:
                     if item.pizza:
-                        left_over_slices = lunch_periods[period][item] % item.slices_per
-                        pizzas = lunch_periods[period][item] // item.slices_per
+                        left_over_slices = counts[item] % item.slices_per
+                        pizzas = counts[item] // item.slices_per
                         pizza_string = 'pizzas' if pizzas > 1 else 'pizza'
                         slice_string = 'slices' if left_over_slices > 1 else 'slice'
                         if left_over_slices == 0:
@@ -68,24 +75,12 @@ def entree_report_by_period(lunch_periods: Dict) -> FileResponse:
                         else:
                             data.append(platypus.Paragraph('<u>{}</u><br/><br/><b>{}</b> {}<br/><br/><b>{}</b> {}'.format(item, pizzas, pizza_string, left_over_slices, slice_string), entree_style))
                     else:
-                        data.append(platypus.Paragraph('{} - <b>{}</b>'.format(item, lunch_periods[period][item]), entree_style))
+                        data.append(platypus.Paragraph('{} - <b>{}</b>'.format(item, counts[item]), entree_style))
                 data.append(platypus.PageBreak())
             else:
-                item_orders = {}
-                for order in lunch_periods[period]:
-                    staff = order.transactee.name()
-                    line_item = MenuLineItem.objects.filter(transaction=order)
-                    for item in line_item:
-                        if item.quantity > 1:
-                            staff = staff + ' ({})'.format(item.quantity)
-                        if item.menu_item in item_orders:
-                            item_orders[item.menu_item].append(staff)
-                        else:
-                            item_orders[item.menu_item] = [staff]
-                item_orders = collections.OrderedDict(sorted(item_orders.items(), key=lambda menu_item: menu_item[0].sequence))
-                for item in item_orders:
+                for item in counts:
                     content = [platypus.Paragraph('<b><u>{}</u></b>'.format(item.name), staff_style)]
-                    for staff in item_orders[item]:
+                    for staff in counts[item]:
                         content.append(platypus.Paragraph(staff, staff_style))
                     content.append(platypus.Paragraph('<br/><br/>', staff_style))
                     data.append(platypus.KeepTogether(content))
@@ -97,71 +92,35 @@ def entree_report_by_period(lunch_periods: Dict) -> FileResponse:
 
 
 def lunch_card_for_users(profiles: List[Profile]) -> FileResponse:
-    buffer = io.BytesIO()
-    card_width = 86*mm
-    card_height = 54*mm
-    margin = 2*mm
-    document = platypus.BaseDocTemplate(buffer, pagesize=(card_width, card_height), rightMargin=margin, leftMargin=margin, topMargin=margin, bottomMargin=margin)
-
-    styles = getSampleStyleSheet()
-    normal_style = copy.copy(styles['Normal'])
-    normal_style.fontSize = 16
-    normal_style.leading = 18
-    normal_style.alignment = TA_CENTER
-    role_style = copy.copy(styles['Normal'])
-    role_style.fontSize = 8
-    role_style.leading = 8
-    role_style.textTransform = 'uppercase'
-    role_style.alignment = TA_CENTER
-    small_style = copy.copy(styles['Heading2'])
-    small_style.fontSize = 10
-    small_style.leading = 10
-    small_style.spaceBefore = 0
-    small_style.spaceAfter = 0
-    title_style = copy.copy(styles['Title'])
-    title_style.fontSize = 20
-    title_style.leading = 20
-    title_style.spaceBefore = 0
-    title_style.spaceAfter = 0
-
-    qr_size = 37*mm
-    top_offset = 4*mm
-    role_height = 8*mm
-    title_height = card_height - qr_size - top_offset
-    
-    frames = [platypus.Frame(document.leftMargin, card_height - title_height - top_offset, document.width, title_height, id="title-frame")]
-    frames.append(platypus.Frame(document.leftMargin, document.bottomMargin, document.width - qr_size, qr_size, id="image-frame"))
-    frames.append(platypus.Frame(document.leftMargin, document.bottomMargin, document.width - qr_size, qr_size, id="misc-frame"))
-    frames.append(platypus.Frame(document.leftMargin, 0, 12*mm, 9*mm, id="number-frame"))
-    frames.append(platypus.Frame(document.leftMargin, 0, document.width - qr_size, role_height, id="role-frame"))
-    frames.append(platypus.Frame(card_width - qr_size, document.bottomMargin - margin, qr_size, qr_size, id="qr-frame"))
-    template = platypus.PageTemplate(frames=frames)
-    document.addPageTemplates(template)
-
-    image_path = Path(__file__).resolve(strict=True).parent / 'report_images/knights-head.jpg'
-    image = platypus.Image(image_path, width=30*mm, height=30*mm)
-
-    data = []
-    for profile in profiles:
-        profile.cards_printed = profile.cards_printed + 1
-        profile.save()
-        name = platypus.Paragraph(profile.name(), title_style)
-        data.append(platypus.KeepInFrame(card_width, title_height, content=[name]))
-        data.append(platypus.FrameBreak('image-frame'))
-        data.append(image)
-        data.append(platypus.FrameBreak('misc-frame'))
-        data.append(platypus.Paragraph('NRCA Cafeteria<br/>Lunch Card', normal_style))
-        if profile.cards_printed > 1:
-            data.append(platypus.FrameBreak('number-frame'))
-            data.append(platypus.Paragraph('R{}'.format(profile.cards_printed), small_style))
-        data.append(platypus.FrameBreak('role-frame'))
-        data.append(platypus.Paragraph(profile.get_role_display(), role_style))
-        data.append(platypus.FrameBreak('qr-frame'))
-        data.append(qr.QrCode(str(profile.lunch_uuid), qrBorder=0))
-        data.append(platypus.PageBreak())
-    document.build(data)
+    """
+    Print a lunch card for each profile and increment their cards_printed
+    with a single UPDATE once the PDF is built. Large runs are rendered
+    across LUNCH_CARD_WORKERS processes. The PDF is spooled to disk past
+    SPOOL_MAX_SIZE and streamed to the client from there.
+    """
+    profiles = list(profiles)
+    cards = [
+        lunchcards.Card(
+            name=profile.name(),
+            role=profile.get_role_display(),
+            number=profile.cards_printed + 1,
+            lunch_uuid=str(profile.lunch_uuid),
+            group=profile.homeroom_teacher_id or profile.id
+        )
+        for profile in profiles
+    ]
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    if settings.LUNCH_CARD_WORKERS > 1:
+        lunchcards.render_cards_parallel(cards, buffer, settings.LUNCH_CARD_WORKERS)
+    else:
+        lunchcards.render_cards(cards, buffer)
+    Profile.objects.filter(id__in=[profile.id for profile in profiles])\
+        .update(cards_printed=F('cards_printed') + 1)
+    size = buffer.tell()
     buffer.seek(0)
-    return FileResponse(buffer, as_attachment=True, filename='lunch_cards.pdf')
+    response = FileResponse(buffer, as_attachment=True, filename='lunch_cards.pdf')
+    response['Content-Length'] = size
+    return response
 
 
 def orders_report_by_homeroom(todays_orders: List) -> FileResponse:
@@ -190,10 +149,6 @@ def orders_report_by_homeroom(todays_orders: List) -> FileResponse:
     title_frame = platypus.Frame(document.leftMargin, title_frame_bottom, document.width, title_frame_height)
     frames = [title_frame]
     
-    # create a frame for a message when there are no orders
-    no_orders_frame = platypus.Frame(document.leftMargin, document.height / 2.0, document.width, 1.0*inch, id='no-orders-frame')
-    frames.append(no_orders_frame)
-
     # create three frames to hold the list of orders for each item
     entree_frame_height = 1.0*inch
     item_frame_height = 1.5*inch
@@ -224,48 +179,32 @@ def orders_report_by_homeroom(todays_orders: List) -> FileResponse:
     
     data = []
     for orders in todays_orders:
-        item_orders = {}
-        item_counts = {}
         teacher = orders['teacher']
-        for item in orders['orders']:
-            student = item.transaction.transactee.name()
-            if item.quantity > 1:
-                student = student + ' ({})'.format(item.quantity)
-            if item.menu_item in item_orders:
-                item_orders[item.menu_item].append(student)
-            else:
-                item_orders[item.menu_item] = [student]
-            if item.menu_item in item_counts:
-                item_counts[item.menu_item] = item_counts[item.menu_item] + item.quantity
-            else:
-                item_counts[item.menu_item] = item.quantity
-        item_orders = collections.OrderedDict(sorted(item_orders.items(), key=lambda menu_item: menu_item[0].sequence))
-        item_counts = collections.OrderedDict(sorted(item_counts.items(), key=lambda menu_item: menu_item[0].sequence))
         title = teacher.user.last_name
         data.append(platypus.Paragraph('<u>{}</u>'.format(title), title_style))
-        if len(item_orders) > 0:
-            data.append(platypus.FrameBreak('student-frame-0'))
-            for item in item_orders:
-                content = [platypus.Paragraph('<b><u>{}</u></b>'.format(item.name), normal_style)]
-                for student in item_orders[item]:
-                    content.append(platypus.Paragraph(student, normal_style))
-                content.append(platypus.Paragraph('<br/><br/>', normal_style))
-                data.append(platypus.KeepTogether(content))
-            data.append(platypus.FrameBreak('divider-frame'))
-            data.append(platypus.HRFlowable())
-            data.append(platypus.FrameBreak('entree-frame-0'))
-            item_content = []
-            for item in item_counts:
-                if item.category == MenuItem.ENTREE:
-                    data.append(platypus.Paragraph('{} - <b>{}</b>'.format(item.short_name, item_counts[item]), entree_count_style))
-                else:
-                    item_content.append(platypus.Paragraph('{} - <b>{}</b>'.format(item.name, item_counts[item]), item_count_style))
-            data.append(platypus.FrameBreak('item-frame'))
-            if item_content:
-                data.append(platypus.BalancedColumns(item_content, nCols = 2))
-        else:
-            data.append(platypus.FrameBreak('no-orders-frame'))
-            data.append(platypus.Paragraph('No Orders Today', title_style))
+        data.append(platypus.FrameBreak('student-frame-0'))
+        for item, line_items in orders['items'].items():
+            content = [platypus.Paragraph('<b><u>{}</u></b>'.format(item.name), normal_style)]
+            for line_item in line_items:
+                student = line_item.transaction.transactee.name()
+                if line_item.quantity > 1:
+                    student = student + ' ({})'.format(line_item.quantity)
+                content.append(platypus.Paragraph(student, normal_style))
+            content.append(platypus.Paragraph('<br/><br/>', normal_style))
+            data.append(platypus.KeepTogether(content))
+        data.append(platypus.FrameBreak('divider-frame'))
+        data.append(platypus.HRFlowable())
+        data.append(platypus.FrameBreak('entree-frame-0'))
+        item_content = []
+        for item, line_items in orders['items'].items():
+            count = sum(line_item.quantity for line_item in line_items)
+            if item.category == MenuItem.ENTREE:
+                data.append(platypus.Paragraph('{} - <b>{}</b>'.format(item.short_name, count), entree_count_style))
+            else:
+                item_content.append(platypus.Paragraph('{} - <b>{}</b>'.format(item.name, count), item_count_style))
+        data.append(platypus.FrameBreak('item-frame'))
+        if item_content:
+            data.append(platypus.BalancedColumns(item_content, nCols = 2))
         data.append(platypus.PageBreak())
     document.build(data)
     buffer.seek(0)
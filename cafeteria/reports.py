@@ -0,0 +1,127 @@
+import collections
+
+from datetime import date
+from typing import Dict, List
+
+from django.db.models import Q
+from django.db.models.query import QuerySet
+
+from cafeteria.models import LunchPeriod
+from menu.models import MenuItem
+from profiles.models import Profile
+from transactions.models import DailyItemTally, MenuLineItem, Transaction
+
+
+def entree_counts(day: date) -> Dict:
+    """
+    Count the items ordered on the given day from the DailyItemTally rows,
+    using a fixed number of queries.
+
+    Returns a dict with:
+        total - {MenuItem: quantity} of entrees across every order
+        periods - {LunchPeriod: {MenuItem: quantity}} of entrees for every
+            lunch period, in display order
+        floating_period - the floating staff LunchPeriod, or None
+        floating_staff - {MenuItem: [staff names]} for staff without a
+            homeroom, ordered by menu sequence
+    """
+    tallies = DailyItemTally.objects.filter(business_date=day)\
+        .filter(menu_item__category=MenuItem.ENTREE)\
+        .filter(quantity__gt=0)\
+        .select_related('menu_item')\
+        .order_by('menu_item__sequence')
+
+    total = {}
+    by_period = collections.defaultdict(dict)
+    for tally in tallies:
+        item = tally.menu_item
+        total[item] = total.get(item, 0) + tally.quantity
+        by_period[tally.lunch_period_id][item] = tally.quantity
+
+    periods = {}
+    floating_period = None
+    for lunch_period in LunchPeriod.objects.all():
+        periods[lunch_period] = by_period.get(lunch_period.id, {})
+        if lunch_period.floating_staff and not floating_period:
+            floating_period = lunch_period
+
+    floating_staff = {}
+    staff_line_items = MenuLineItem.objects.filter(transaction__submitted__date=day)\
+        .filter(transaction__transactee__grade=None)\
+        .filter(transaction__transactee__role=Profile.STAFF)\
+        .select_related('menu_item', 'transaction__transactee__user')\
+        .order_by('menu_item__sequence', 'transaction__submitted')
+    for line_item in staff_line_items:
+        staff = line_item.transaction.transactee.name()
+        if line_item.quantity > 1:
+            staff = staff + ' ({})'.format(line_item.quantity)
+        floating_staff.setdefault(line_item.menu_item, []).append(staff)
+
+    return {
+        'total': total,
+        'periods': periods,
+        'floating_period': floating_period,
+        'floating_staff': floating_staff,
+    }
+
+
+def homeroom_orders(teachers: QuerySet, day: date) -> List[Dict]:
+    """
+    Group the day's line items by homeroom, using two queries for any
+    number of teachers. A teacher's homeroom holds their own orders and
+    those of their students. Homerooms without orders are left out.
+
+    Returns a list, in the order of teachers, of dicts with:
+        teacher - the staff Profile
+        items - {MenuItem: [MenuLineItem]} ordered by menu sequence
+    """
+    teacher_ids = teachers.values('id')
+    teachers = list(teachers.select_related('user', 'grade'))
+    homerooms = {teacher.id: collections.OrderedDict() for teacher in teachers}
+    line_items = MenuLineItem.objects.filter(transaction__submitted__date=day)\
+        .filter(Q(transaction__transactee__in=teacher_ids)
+                | Q(transaction__transactee__homeroom_teacher__in=teacher_ids))\
+        .select_related('menu_item', 'transaction__transactee__user')\
+        .order_by('menu_item__sequence', 'transaction__transactee__user__last_name',
+                  'transaction__transactee__user__first_name')
+    for line_item in line_items:
+        transactee = line_item.transaction.transactee
+        for teacher_id in {transactee.id, transactee.homeroom_teacher_id}:
+            if teacher_id in homerooms:
+                homerooms[teacher_id].setdefault(line_item.menu_item, []).append(line_item)
+    return [
+        {'teacher': teacher, 'items': homerooms[teacher.id]}
+        for teacher in teachers
+        if homerooms[teacher.id]
+    ]
+
+
+def dashboard_snapshot(day: date) -> Dict:
+    """
+    The figures the admin dashboard shows that change while orders come in,
+    keyed the same way as the data-count and data-order attributes in
+    admin/admin.html. Uses two queries.
+
+    Returns a dict with:
+        counts - {'total-<menu item ID>' or '<lunch period ID>-<menu item ID>':
+            quantity} of entrees
+        orders - {transaction ID: status} of floating staff orders
+    """
+    counts = {}
+    tallies = DailyItemTally.objects.filter(business_date=day)\
+        .filter(menu_item__category=MenuItem.ENTREE)\
+        .filter(quantity__gt=0)\
+        .values_list('lunch_period_id', 'menu_item_id', 'quantity')
+    for lunch_period_id, menu_item_id, quantity in tallies:
+        key = 'total-{}'.format(menu_item_id)
+        counts[key] = counts.get(key, 0) + quantity
+        if lunch_period_id:
+            counts['{}-{}'.format(lunch_period_id, menu_item_id)] = quantity
+
+    staff_orders = Transaction.objects.filter(submitted__date=day)\
+        .filter(transactee__grade=None).filter(transactee__role=Profile.STAFF)\
+        .with_status().values_list('id', 'status')
+    return {
+        'counts': counts,
+        'orders': {str(order_id): status for order_id, status in staff_orders},
+    }
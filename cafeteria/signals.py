@@ -0,0 +1,10 @@
+from django.dispatch import receiver
+
+from constance.signals import config_updated
+
+from cafeteria.config_snapshot import bump_version
+
+
+@receiver(config_updated)
+def constance_updated(sender, key, old_value, new_value, **kwargs):
+    bump_version()
@@ -1,3 +1,389 @@
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+from unittest import mock
+
+import json
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from cafeteria import config_snapshot
+from cafeteria.management.commands import pssync
+from cafeteria.models import GradeLevel, LunchPeriod, School, SyncWatermark, Weekday
+from menu.models import MenuItem
+from powerschool.tests import FakePowerschoolMixin
+from profiles.models import Profile
+from transactions import tallies
+from transactions.models import MenuLineItem, Transaction
+
+
+class SeededSchoolTestCase(TestCase):
+    """
+    A district of several schools, each with its homerooms of students and
+    a day of orders and deposits, for query budget tests. Budgets are
+    checked before and after grow() adds more of everything, so a query
+    per row fails the test.
+    """
+    SCHOOLS = 3
+    GRADES = 4
+    HOMEROOMS = 70
+    STUDENTS = 12
+    FLOATING_STAFF = 20
+
+    usernames = count()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        weekday = Weekday.objects.get_or_create(name=cls.today.strftime('%A'), abbreviation=cls.today.strftime('%a'))[0]
+        cls.periods = [
+            LunchPeriod.objects.create(display_name='Lunch {}'.format(number + 1), sort_order=number)
+            for number in range(3)
+        ]
+        cls.staff_period = LunchPeriod.objects.create(display_name='Staff', floating_staff=True, sort_order=9)
+        cls.menu_items = []
+        for sequence, (name, category) in enumerate([
+                ('Pizza', MenuItem.ENTREE), ('Chicken Sandwich', MenuItem.ENTREE),
+                ('Salad', MenuItem.ENTREE), ('Milk', MenuItem.DRINK)]):
+            item = MenuItem.objects.create(
+                name=name, short_name=name[:8], cost=Decimal('3.50'), category=category, sequence=sequence,
+                pizza=name == 'Pizza', slices_per=8 if name == 'Pizza' else 0)
+            item.days_available.add(weekday)
+            item.lunch_period.add(*cls.periods, cls.staff_period)
+            cls.menu_items.append(item)
+        cls.schools = []
+        for number in range(cls.SCHOOLS + 1):
+            school = School.objects.create(id=number + 1, name='School {}'.format(number + 1), school_number=number + 1, active=True)
+            cls.schools.append(school)
+            for grade in range(cls.GRADES):
+                value = number * cls.GRADES + grade + 1
+                GradeLevel.objects.create(
+                    value=value, display_name='Grade {}'.format(value), school=school,
+                    lunch_period=cls.periods[grade % len(cls.periods)])
+        # The last school is kept small enough to print its lunch cards
+        cls.small_school = cls.schools[-1]
+        for school in cls.schools[:-1]:
+            cls.seed_homerooms(school, cls.HOMEROOMS, cls.STUDENTS)
+        cls.seed_homerooms(cls.small_school, 2, cls.STUDENTS)
+        cls.seed_floating_staff(cls.FLOATING_STAFF)
+        tallies.rebuild([cls.today])
+
+        cls.admin = cls.create_profile('admin', Profile.STAFF, is_staff=True)
+        cls.teacher = Profile.objects.filter(role=Profile.STAFF, grade__isnull=False)\
+            .select_related('user').order_by('id').first()
+        cls.student = Profile.objects.filter(role=Profile.STUDENT).exclude(transaction__transaction_type=Transaction.DEBIT)\
+            .select_related('user').order_by('id').first()
+
+    @classmethod
+    def create_profile(cls, name: str, role: int, grade: GradeLevel = None, is_staff: bool = False) -> Profile:
+        user = User.objects.create(username='{}-{}'.format(name, next(cls.usernames)), first_name=name.title(),
+                                   last_name='Seeded', is_staff=is_staff)
+        return Profile.objects.create(user=user, role=role, grade=grade, active=True, last_sync=timezone.now())
+
+    @classmethod
+    def bulk_profiles(cls, role: int, grades: list, teachers: list = None) -> list:
+        """ Bulk create an active profile for each grade, with homeroom teachers if given """
+        prefix = 'seed-{}-'.format(next(cls.usernames))
+        User.objects.bulk_create([
+            User(username='{}{}'.format(prefix, number), first_name='First{}'.format(number), last_name='Last{}'.format(number))
+            for number in range(len(grades))
+        ])
+        user_ids = User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True)
+        now = timezone.now()
+        Profile.objects.bulk_create([
+            Profile(active=True, grade=grade, homeroom_teacher=teachers[number] if teachers else None,
+                    last_sync=now, role=role, school=grade.school if grade else None, user_id=user_id)
+            for number, (grade, user_id) in enumerate(zip(grades, user_ids))
+        ])
+        return list(Profile.objects.filter(user__username__startswith=prefix).order_by('id'))
+
+    @classmethod
+    def seed_orders(cls, profiles: list, skip_every: int = 10):
+        """ A completed deposit for every profile and an order from most of them """
+        now = timezone.now()
+        transactions = []
+        for number, profile in enumerate(profiles):
+            description = 'Check #{}'.format(1000 + number) if number % 3 else 'Cash Deposit'
+            transactions.append(Transaction(
+                amount=Decimal('20.00'), beginning_balance=0, completed=now, description=description,
+                ending_balance=Decimal('20.00'), submitted=now, transactee=profile,
+                transaction_type=Transaction.CREDIT))
+            if number % skip_every:
+                item = cls.menu_items[number % 3]
+                transactions.append(Transaction(
+                    amount=item.cost, business_date=cls.today, description=item.name, submitted=now,
+                    transactee=profile, transaction_type=Transaction.DEBIT))
+        Transaction.objects.bulk_create(transactions)
+        orders = Transaction.objects.filter(transactee__in=profiles, transaction_type=Transaction.DEBIT, business_date=cls.today)
+        MenuLineItem.objects.bulk_create([
+            MenuLineItem(menu_item=cls.menu_items[['Pizza', 'Chicken Sandwich', 'Salad'].index(description)],
+                         transaction_id=transaction_id, quantity=1)
+            for transaction_id, description in orders.values_list('id', 'description')
+        ])
+        Profile.objects.filter(id__in=[profile.id for profile in profiles]).update(current_balance=Decimal('20.00'))
+        Profile.objects.filter(id__in=[profile.id for profile in profiles[::7]]).update(current_balance=Decimal('-4.50'))
+
+    @classmethod
+    def seed_homerooms(cls, school: School, homerooms: int, students: int):
+        grades = list(school.grades.all())
+        teachers = cls.bulk_profiles(Profile.STAFF, [grades[number % len(grades)] for number in range(homerooms)])
+        Profile.objects.filter(id__in=[teacher.id for teacher in teachers]).update(room='101')
+        classes = [teacher for teacher in teachers for _ in range(students)]
+        children = cls.bulk_profiles(Profile.STUDENT, [teacher.grade for teacher in classes], classes)
+        cls.seed_orders(teachers + children)
+
+    @classmethod
+    def seed_floating_staff(cls, staff: int):
+        cls.seed_orders(cls.bulk_profiles(Profile.STAFF, [None] * staff), skip_every=2)
+
+    def grow(self):
+        """ Add homerooms to every school and more floating staff """
+        for school in self.schools:
+            self.seed_homerooms(school, 3, self.STUDENTS)
+        self.seed_floating_staff(5)
+        tallies.rebuild([self.today])
+
+    def setUp(self):
+        # Keep the settings snapshot from being re-read partway through a test
+        patcher = mock.patch.object(config_snapshot, 'CHECK_INTERVAL', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.admin.user)
+
+    def assertQueryBudget(self, budget: int, url: str, method: str = 'get', data: dict = None):
+        """
+        Request the URL within the query budget, before and after the
+        seeded data grows. The URL is fetched once beforehand to warm the
+        menu and settings caches.
+        """
+        for attempt in range(2):
+            self.client.get(url)
+            with self.assertNumQueries(budget):
+                response = getattr(self.client, method)(url, data)
+                if hasattr(response, 'streaming_content'):
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400)
+            if attempt == 0:
+                self.grow()
+        return response
+
+
+class CafeteriaViewQueryTests(SeededSchoolTestCase):
+
+    def test_home(self):
+        self.client.force_login(self.student.user)
+        self.assertQueryBudget(6, reverse('home'))
+
+    def test_admin_dashboard(self):
+        self.assertQueryBudget(7, reverse('admin'))
+
+    def test_admin_dashboard_feed(self):
+        response = self.assertQueryBudget(4, reverse('admin-feed'))
+        self.assertEqual(set(response.json()), {'counts', 'orders'})
+
+    def test_entree_orders_report(self):
+        self.assertQueryBudget(5, reverse('entrees-report'))
+
+    def test_homeroom_orders_report(self):
+        self.assertQueryBudget(4, reverse('homerooms-report'))
+
+    def test_lunch_period_order_report(self):
+        self.assertQueryBudget(4, reverse('class-orders-report', args=[self.periods[0].id]))
+
+    def test_lunch_cards_for_school(self):
+        self.assertQueryBudget(6, reverse('operations'), 'post',
+                               {'action': 'print-cards', 'group': self.small_school.id})
+
+
+class PowerschoolSyncTests(FakePowerschoolMixin, TestCase):
+    """ pssync against a fake PowerSchool session """
+
+    @classmethod
+    def setUpTestData(cls):
+        period = LunchPeriod.objects.create(display_name='Lunch 1')
+        for number in range(2):
+            school = School.objects.create(id=number + 1, name='School {}'.format(number + 1), school_number=number + 1, active=True)
+            for value in range(number * 2 + 1, number * 2 + 3):
+                GradeLevel.objects.create(value=value, display_name='Grade {}'.format(value), school=school, lunch_period=period)
+
+    def setUp(self):
+        super().setUp()
+        self.session.schools = [
+            {'id': number + 1, 'name': 'School {}'.format(number + 1), 'school_number': number + 1,
+             'low_grade': number * 2 + 1, 'high_grade': number * 2 + 2}
+            for number in range(2)
+        ]
+        self.session.students = [self.student(number) for number in range(1, 9)]
+        self.session.staff = [self.staff_member(number) for number in range(1, 4)]
+        self.session.rosters = {9001: self.roster(1, 2)}
+
+    def student(self, number: int, modified: str = '2020-01-01') -> dict:
+        """ A student in grade 1 to 4, at the school that has the grade """
+        grade = (number - 1) % 4 + 1
+        return {
+            'id': 100 + number,
+            'local_id': str(5000 + number),
+            'student_username': 'student{}'.format(number),
+            'name': {'first_name': 'Student', 'last_name': 'Number{}'.format(number)},
+            'school_enrollment': {'grade_level': grade, 'school_id': (grade + 1) // 2},
+            'modified': modified,
+        }
+
+    def staff_member(self, number: int, modified: str = '2020-01-01') -> dict:
+        return {
+            'dcid': str(9000 + number),
+            'teachernumber': str(700 + number),
+            'first_name': 'Staff',
+            'last_name': 'Number{}'.format(number),
+            'teacherloginid': 'staff{}'.format(number),
+            'school_phone': '555-0123',
+            'homeroom': str(100 + number),
+            'modified': modified,
+        }
+
+    def roster(self, *numbers: int) -> list:
+        return [{'dcid': str(100 + number), 'grade_level': str((number - 1) % 4 + 1)} for number in numbers]
+
+    def sync(self, *args, **options):
+        with self.assertLogs(pssync.logger, 'INFO') as logs:
+            call_command('pssync', *args, **options)
+        return logs.output
+
+    def test_sync_creates_and_updates_profiles(self):
+        self.sync()
+        students = Profile.objects.filter(role=Profile.STUDENT).select_related('user', 'grade', 'school')
+        self.assertEqual(
+            {(profile.student_dcid, profile.user.username, profile.grade.value, profile.school_id) for profile in students},
+            {(student['id'], student['student_username'] + '@nrcaknights.com',
+              student['school_enrollment']['grade_level'], student['school_enrollment']['school_id'])
+             for student in self.session.students})
+        staff = Profile.objects.filter(role=Profile.STAFF).select_related('user')
+        self.assertEqual(
+            {(profile.user_dcid, profile.user.username, profile.room, profile.phone) for profile in staff},
+            {(9000 + number, 'staff{}@nrcaknights.com'.format(number), str(100 + number), 'x0123') for number in range(1, 4)})
+
+        self.session.students[0]['name']['first_name'] = 'Renamed'
+        self.session.staff[0]['homeroom'] = '200'
+        self.sync(full=True)
+        self.assertEqual(Profile.objects.count(), 11)
+        self.assertEqual(User.objects.count(), 11)
+        self.assertEqual(Profile.objects.get(student_dcid=101).user.first_name, 'Renamed')
+        self.assertEqual(Profile.objects.get(user_dcid=9001).room, '200')
+
+    def test_username_conflict_keeps_the_existing_username(self):
+        self.sync()
+        self.session.students[1]['student_username'] = 'student1'
+        self.session.students[1]['name']['first_name'] = 'Renamed'
+        with self.assertLogs(pssync.logger, 'ERROR') as logs:
+            call_command('pssync', 'students', full=True)
+        self.assertIn('Username student1@nrcaknights.com already belongs to another user', logs.output[0])
+        user = Profile.objects.get(student_dcid=102).user
+        self.assertEqual((user.username, user.first_name), ('student2@nrcaknights.com', 'Renamed'))
+        self.assertEqual(Profile.objects.get(student_dcid=101).user.username, 'student1@nrcaknights.com')
+
+    def test_homeroom_rosters_are_replaced(self):
+        self.sync()
+        teacher = Profile.objects.get(user_dcid=9001)
+        self.assertEqual(teacher.grade.value, 1)
+        self.assertEqual(set(teacher.students.values_list('student_dcid', flat=True)), {101, 102})
+
+        self.session.rosters = {9001: self.roster(5), 9002: self.roster(2, 6)}
+        self.sync('staff', full=True)
+        self.assertEqual(set(teacher.students.values_list('student_dcid', flat=True)), {105})
+        self.assertEqual(set(Profile.objects.get(user_dcid=9002).students.values_list('student_dcid', flat=True)), {102, 106})
+        self.assertEqual(Profile.objects.filter(homeroom_teacher__isnull=False).count(), 3)
+
+    def test_failed_roster_keeps_the_homeroom(self):
+        self.sync()
+        self.session.rosters = {9001: self.roster(5), 9002: self.roster(3)}
+        # Only the first staff member's roster request fails
+        self.session.fail('.homeroom_roster', 400)
+        with self.assertLogs(pssync.logger, 'ERROR') as logs:
+            call_command('pssync', 'staff', full=True)
+        self.assertIn('Could not fetch the homeroom roster of Staff Number1', logs.output[0])
+        teacher = Profile.objects.get(user_dcid=9001)
+        self.assertEqual(teacher.grade.value, 1)
+        self.assertEqual(set(teacher.students.values_list('student_dcid', flat=True)), {101, 102})
+        other = Profile.objects.get(user_dcid=9002)
+        self.assertEqual(other.grade.value, 3)
+        self.assertEqual(set(other.students.values_list('student_dcid', flat=True)), {103})
+
+    def test_watermarks_limit_later_syncs_to_modified_records(self):
+        self.sync()
+        watermarks = {(watermark.resource, watermark.school_id): watermark for watermark in SyncWatermark.objects.all()}
+        self.assertEqual(set(watermarks), {(SyncWatermark.STAFF, None), (SyncWatermark.STUDENTS, 1), (SyncWatermark.STUDENTS, 2)})
+        self.assertTrue(all(watermark.full_sync == watermark.synced_through for watermark in watermarks.values()))
+
+        today = timezone.localdate().isoformat()
+        self.session.students[0] = dict(self.student(1, today), name={'first_name': 'Renamed', 'last_name': 'Number1'})
+        self.session.staff[1]['modified'] = today
+        self.session.sent.clear()
+        logs = self.sync()
+        since = timezone.localdate(watermarks[SyncWatermark.STAFF, None].synced_through).isoformat()
+        self.assertTrue(all('q=transaction_date%3Dge%3D' + since in target for target, data in self.sent('/student')))
+        self.assertTrue(all(json.loads(data) == {'modified_since': since} for target, data in self.sent('.active_staff')))
+        self.assertIn('Retreived 1 students modified since {}'.format(since), '\n'.join(logs))
+        self.assertIn('Retrieved 1 staff modified since {}'.format(since), '\n'.join(logs))
+        self.assertEqual(Profile.objects.get(student_dcid=101).user.first_name, 'Renamed')
+        for watermark in SyncWatermark.objects.all():
+            previous = watermarks[watermark.resource, watermark.school_id]
+            self.assertEqual(watermark.full_sync, previous.full_sync)
+            self.assertGreater(watermark.synced_through, previous.synced_through)
+
+        SyncWatermark.objects.update(full_sync=timezone.now() - pssync.FULL_SYNC_INTERVAL - timedelta(hours=1))
+        self.session.sent.clear()
+        self.sync()
+        self.assertFalse([target for target, data in self.sent('q=')])
+
+    def test_rejected_modified_since_falls_back_to_full_sync(self):
+        self.sync()
+        watermarks = dict(SyncWatermark.objects.values_list('id', 'full_sync'))
+        self.session.reject_modified_since = True
+        self.session.students[0]['name']['first_name'] = 'Renamed'
+        with self.assertLogs(pssync.logger, 'WARNING') as logs:
+            call_command('pssync')
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(Profile.objects.get(student_dcid=101).user.first_name, 'Renamed')
+        for watermark in SyncWatermark.objects.all():
+            self.assertGreater(watermark.full_sync, watermarks[watermark.id])
+            self.assertEqual(watermark.full_sync, watermark.synced_through)
+
+    def test_failed_student_delta_falls_back_for_its_school(self):
+        self.sync()
+        watermarks = dict(SyncWatermark.objects.filter(resource=SyncWatermark.STUDENTS).values_list('school', 'full_sync'))
+        today = timezone.localdate().isoformat()
+        for number in (1, 2, 5, 6):
+            self.session.students[number - 1] = dict(
+                self.student(number, today), name={'first_name': 'Renamed', 'last_name': 'Number{}'.format(number)})
+        since = timezone.localdate(SyncWatermark.objects.get(school=1).synced_through).isoformat()
+        # The first page of the first school's changes is written before the second one fails
+        self.session.fail('q=transaction_date%3Dge%3D{}&page=2'.format(since), 400)
+        with self.assertLogs(pssync.logger, 'WARNING') as logs:
+            call_command('pssync', 'students', chunk_size=1)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Could not fetch students from School 1 modified since {}'.format(since), logs.output[0])
+        self.assertEqual(Profile.objects.filter(user__first_name='Renamed').count(), 4)
+        full_syncs = dict(SyncWatermark.objects.filter(resource=SyncWatermark.STUDENTS).values_list('school', 'full_sync'))
+        self.assertGreater(full_syncs[1], watermarks[1])
+        self.assertEqual(full_syncs[2], watermarks[2])
 
-# Create your tests here.
+    def test_failed_fetch_stops_without_advancing_watermarks(self):
+        self.sync()
+        students = SyncWatermark.objects.filter(resource=SyncWatermark.STUDENTS)
+        watermarks = dict(students.values_list('school', 'synced_through'))
+        self.session.students[0]['name']['first_name'] = 'Renamed'
+        self.session.students[2]['name']['first_name'] = 'Renamed'
+        self.session.fail('school/2/student?', 400)
+        with self.assertRaisesMessage(CommandError, 'Synchronization stopped: Page 1 of'):
+            call_command('pssync', 'students', full=True)
+        # The first school finished before the second one failed
+        self.assertEqual(Profile.objects.get(student_dcid=101).user.first_name, 'Renamed')
+        self.assertEqual(Profile.objects.get(student_dcid=103).user.first_name, 'Student')
+        synced_through = dict(students.values_list('school', 'synced_through'))
+        self.assertGreater(synced_through[1], watermarks[1])
+        self.assertEqual(synced_through[2], watermarks[2])
@@ -18,6 +18,7 @@ urlpatterns = [
 
      # Admin dashboard pages
     path('admin/', views.admin_dashboard, name='admin'),
+    path('admin/feed/', views.admin_dashboard_feed, name='admin-feed'),
     path('admin/class-orders-report/<int:lunch_period_id>/', views.lunch_period_order_report, name='class-orders-report'),
     path('admin/entree-orders-report/', views.entree_orders_report, name='entrees-report'),
     path('admin/homeroom-orders-report/', views.homeroom_orders_report, name='homerooms-report'),
@@ -11,16 +11,16 @@ from typing import Dict, List
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.db.models import Q, Sum
+from django.db.models import Prefetch
 from django.db.models.query import QuerySet
 from django.forms import formset_factory, modelformset_factory
 from django.forms.models import modelform_factory
-from django.http import FileResponse, HttpResponse, HttpRequest
+from django.http import FileResponse, HttpResponse, HttpRequest, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.utils import timezone
 
-from constance import config
+from cafeteria.config_snapshot import config
 
 from reportlab import platypus
 from reportlab.lib import enums
@@ -30,12 +30,14 @@ from reportlab.lib.units import inch
 
 from cafeteria.decorators import admin_access_allowed
 from cafeteria.forms import GeneralForm, SchoolsModelForm, UserOrderForm
-from cafeteria.models import LunchPeriod, School
+from cafeteria.models import School
+from cafeteria import reports
 from cafeteria.operations import end_of_year_process
 from cafeteria.pdfgenerators import entree_report_by_period, lunch_card_for_users, orders_report_by_homeroom
+from menu import cache as menu_cache
 from menu.models import MenuItem
 from profiles.models import Profile
-from transactions.models import MenuLineItem
+from transactions import orders
 from transactions.models import Transaction
 
 
@@ -43,17 +45,6 @@ logger = logging.getLogger(__file__)
 
 
 # Helper functions
-def orders_for_homeroom(staff: Profile):
-    orders = MenuLineItem.objects.filter(
-        Q(transaction__transactee__in=staff.students.all())
-        | Q(transaction__transactee=staff)
-    ).filter(transaction__submitted__date=timezone.localdate(timezone.now()))
-    homeroom_orders = {
-        'teacher': staff,
-        'orders': orders
-    }
-    return homeroom_orders
-
 def todays_transaction(profile: Profile) -> Transaction:
     try:
         transactions = Transaction.objects.filter(
@@ -109,7 +100,7 @@ def home(request):
             logger.exception('An exception occured for user {}: {}'.format(request.user, e))
             return redirect('django_auth_adfs:logout')
         
-        if todays_transaction(request.user.profile):
+        if request.method != 'POST' and todays_transaction(request.user.profile):
             return redirect('todays-order')
 
         context['user'] = request.user
@@ -118,10 +109,15 @@ def home(request):
             context['debt_exceeded'] = True
             context['debt_limit'] = config.DEBT_LIMIT
         context['balance'] = current_balance
+        if request.user.profile.role == Profile.STUDENT:
+            student_grade = request.user.profile.grade
+            menu_items = menu_cache.todays_menu(menu_cache.STUDENT, student_grade.lunch_period_id)
+        else:
+            menu_items = menu_cache.todays_menu(menu_cache.STAFF)
+        OrderFormSet = formset_factory(UserOrderForm)
         if request.method == 'POST':
             if context['orders_open']:
-                OrderFormSet = formset_factory(UserOrderForm)
-                formset = OrderFormSet(request.POST, prefix='order_form')
+                formset = OrderFormSet(request.POST, form_kwargs={'menu_items': menu_items}, prefix='order_form')
                 if formset.is_valid():
                     ordered_items_list = []
                     for item in formset.cleaned_data:
@@ -134,29 +130,13 @@ def home(request):
                         messages.error(request, 'You must select at least one item.')
                         return redirect('home')
                     else:
-                        counted_items = Counter(ordered_items_list)
-                        description = ''
-                        cost = 0
-                        for item in counted_items:
-                            if description:
-                                description = description + ', '
-                            description = description + '({}) {}'.format(counted_items[item], item.name)
-                            cost = cost + (item.cost * counted_items[item])
-                        if todays_transaction(request.user.profile):
-                            messages.warning(request, 'Your have already placed an order today.')
-                            return redirect('todays-order')
                         try:
-                            transaction = Transaction(
-                                amount=cost,
-                                description=description,
-                                transaction_type=Transaction.DEBIT,
-                                transactee=request.user.profile
-                            )
-                            transaction.save()
-                            for item in counted_items:
-                                transaction.menu_items.add(item, through_defaults={'quantity': counted_items[item]})
+                            orders.place_order(request.user.profile, ordered_items_list, menu=menu_items)
                             messages.success(request, 'Your order was successfully submitted.')
                             return redirect('todays-order')
+                        except orders.DuplicateOrderError:
+                            messages.warning(request, 'Your have already placed an order today.')
+                            return redirect('todays-order')
                         except Exception as e:
                             logger.exception('An exception occured when trying to create a transaction: {}'.format(e))
                             messages.error(request, 'There was a problem submitting your order.')
@@ -167,16 +147,8 @@ def home(request):
                 if request.user.profile.students.all():
                     context['homeroom_teacher'] = True
 
-            queryset = MenuItem.objects.filter(days_available__name=timezone.localdate(timezone.now()).strftime("%A")).filter(app_only=False)
-            context['menu_items'] = queryset.count()
-            if request.user.profile.role == Profile.STUDENT:
-                student_grade = request.user.profile.grade
-                lunch_period = student_grade.lunch_period
-                queryset = queryset.filter(lunch_period=lunch_period)
-            else:
-                queryset = queryset.filter(category=MenuItem.ENTREE)
-            OrderFormSet = formset_factory(UserOrderForm)
-            context['formset'] = OrderFormSet(form_kwargs={'queryset': queryset}, prefix='order_form')
+            context['menu_items'] = len(menu_items)
+            context['formset'] = OrderFormSet(form_kwargs={'menu_items': menu_items}, prefix='order_form')
     else:
         context['user'] = None
     return render(request, 'user/new_order.html', context=context)
@@ -186,38 +158,29 @@ def submit_order(request):
     if request.method == 'POST':
         if Transaction.accepting_orders():
             if request.POST.__contains__('itemID'):
-                if not todays_transaction(request.user.profile):
-                    menu_item = MenuItem.objects.get(
-                        id=request.POST.get('itemID'))
-                    if menu_item not in MenuItem.objects.filter(days_available__name=timezone.localdate(timezone.now()).strftime("%A")):
-                        logger.warning('{} attempted to order a {}, which is not available today.'.format(
-                            request.user.profile.name, menu_item))
-                        messages.error(
-                            request, 'The {} is not available today. Please select from the available options.'.format(menu_item))
-                        return redirect('home')
-                    try:
-                        transaction = Transaction(
-                            amount=menu_item.cost,
-                            description=menu_item.name,
-                            transaction_type=Transaction.DEBIT,
-                            transactee=request.user.profile
-                        )
-                        transaction.save()
-                        transaction.menu_items.add(
-                            menu_item, through_defaults={'quantity': 1})
-                        messages.success(
-                            request, 'Your order was successfully submitted.')
-                        return redirect('todays-order')
-                    except Exception as e:
-                        logger.exception(
-                            'An exception occured when trying to create a transaction: {}'.format(e))
-                        messages.error(
-                            request, 'There was a problem submitting your order.')
-                        return redirect('home')
-                else:
+                menu = menu_cache.todays_menu(menu_cache.GUARDIAN)
+                try:
+                    menu_item = orders.resolve_items([int(request.POST.get('itemID'))], menu)[0]
+                    orders.place_order(request.user.profile, [menu_item], menu=menu)
+                    messages.success(
+                        request, 'Your order was successfully submitted.')
+                    return redirect('todays-order')
+                except orders.UnavailableItemError as e:
+                    logger.warning('{} attempted to order a {}, which is not available today.'.format(
+                        request.user.profile.name(), e.item))
+                    messages.error(
+                        request, 'The {} is not available today. Please select from the available options.'.format(e.item))
+                    return redirect('home')
+                except orders.DuplicateOrderError:
                     messages.warning(
                         request, 'You have already submitted an order today.')
                     return redirect('todays-order')
+                except Exception as e:
+                    logger.exception(
+                        'An exception occured when trying to create a transaction: {}'.format(e))
+                    messages.error(
+                        request, 'There was a problem submitting your order.')
+                    return redirect('home')
         else:
             messages.warning(
                 request, 'Sorry, the cafeteria is no longer accepting orders today.')
@@ -230,9 +193,7 @@ def submit_order(request):
 @login_required(login_url=('/oidc' + reverse('oidc_authentication_init', urlconf='mozilla_django_oidc.urls')))
 def guardian_home(request):
     context = {}
-    menu = MenuItem.objects.filter(
-        days_available__name=timezone.localdate(timezone.now()).strftime("%A"))
-    context['menu'] = menu
+    context['menu'] = menu_cache.todays_menu(menu_cache.GUARDIAN)
     context['orders_open'] = Transaction.accepting_orders()
     context['ps_url'] = os.getenv('POWERSCHOOL_URL')
     if request.user.is_authenticated:
@@ -296,17 +257,6 @@ def guardian_submit_order(request):
         return redirect('guardian')
 
 
-def get_item_counts(orders: QuerySet[MenuItem]) -> Dict:
-    count = {}
-    for order in orders:
-        for line_item in order.line_item.all():
-            if line_item.menu_item.category == MenuItem.ENTREE:
-                if line_item.menu_item in count:
-                    count[line_item.menu_item] = count[line_item.menu_item] + line_item.quantity
-                else:
-                    count[line_item.menu_item] = line_item.quantity
-    return count
-
 # Admin dashboard views
 @login_required
 @admin_access_allowed
@@ -315,22 +265,31 @@ def admin_dashboard(request):
     time = timezone.localtime(timezone.now())
     context['time'] = time
     context['user'] = request.user
-    orders = Transaction.objects.filter(submitted__date=time.date())
-    context['total_item_counts'] = get_item_counts(orders)
-    lunch_period_counts = {}
-    for lunch_period in LunchPeriod.objects.all():
-        lunch_period_counts[lunch_period] = get_item_counts(orders.filter(transactee__grade__lunch_period=lunch_period))
-    staff_orders = orders.filter(transactee__grade=None).filter(transactee__role=Profile.STAFF)
-    staff_period = LunchPeriod.objects.get(floating_staff=True)
-    if staff_orders and staff_period:
-        lunch_period_counts[staff_period] = staff_orders
+    counts = reports.entree_counts(time.date())
+    context['total_item_counts'] = counts['total']
+    lunch_period_counts = counts['periods']
+    staff_period = counts['floating_period']
+    if staff_period:
+        staff_orders = Transaction.objects.filter(submitted__date=time.date())\
+            .filter(transactee__grade=None).filter(transactee__role=Profile.STAFF)\
+            .select_related('transactee__user').with_status()
+        if staff_orders:
+            lunch_period_counts[staff_period] = staff_orders
     context['period_item_counts'] = lunch_period_counts
-    context['orders'] = orders
-    context['debtors'] = Profile.objects.filter(active=True).filter(current_balance__lt=0).order_by('current_balance', 'user__last_name')[:5]
-    first_lunch = LunchPeriod.objects.filter(sort_order=0).first()
+    context['debtors'] = Profile.objects.filter(active=True).filter(current_balance__lt=0)\
+        .select_related('user').order_by('current_balance', 'user__last_name')[:5]
+    first_lunch = next((period for period in lunch_period_counts if period.sort_order == 0), None)
     context['first_lunch'] = first_lunch
     return render(request, 'admin/admin.html', context=context)
 
+@login_required
+@admin_access_allowed
+def admin_dashboard_feed(request):
+    """ The dashboard's current counts, polled by an open admin dashboard """
+    response = JsonResponse(reports.dashboard_snapshot(timezone.localdate()))
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 @login_required
 @admin_access_allowed
 def general_settings(request):
@@ -381,6 +340,8 @@ def schools_settings(request):
 def students_grouped_by_homeroom(staff: QuerySet[Profile], above_grade: int = -1):
     grouped = []
     no_homeroom = []
+    staff = staff.select_related('user', 'grade')\
+        .prefetch_related(Prefetch('students', queryset=Profile.objects.select_related('user')))
     for teacher in staff:
         if not teacher.grade:
             no_homeroom.append(teacher)
@@ -403,9 +364,10 @@ def operations(request):
             staff = Profile.objects.filter(role=Profile.STAFF).filter(active=True)
             if request.POST['group'] == 'NEW':  # No lunch card previously printed
                 profiles = Profile.objects.filter(active=True)\
-                    .exclude(pending=True).filter(cards_printed=0).filter(grade__value__gt=2)
+                    .exclude(pending=True).filter(cards_printed=0).filter(grade__value__gt=2)\
+                    .select_related('user')
             elif request.POST['group'] == 'STAFF':  # Staff without a Homeroom
-                profiles = staff.filter(grade=None)
+                profiles = staff.filter(grade=None).select_related('user')
             elif request.POST['group'] == 'ALL':  # All Students & Staff
                 profiles = students_grouped_by_homeroom(staff, 2)
             else:
@@ -426,11 +388,8 @@ def operations(request):
 @login_required
 @admin_access_allowed
 def homeroom_orders_report(request):
-    todays_orders = []
-    for staff in Profile.objects.filter(role=Profile.STAFF).order_by('grade', 'user__last_name'):
-        homeroom_order = orders_for_homeroom(staff)
-        if homeroom_order:
-            todays_orders.append(homeroom_order)
+    teachers = Profile.objects.filter(role=Profile.STAFF).order_by('grade', 'user__last_name')
+    todays_orders = reports.homeroom_orders(teachers, timezone.localdate())
     if todays_orders:
         buffer = io.BytesIO()
         styles = getSampleStyleSheet()
@@ -475,18 +434,16 @@ def homeroom_orders_report(request):
                 grade_level = teacher.grade.display_name
             data.append(platypus.Paragraph(grade_level, grade_style))
             data.append(platypus.FrameBreak())
-            order_groups = orders['orders'].values(
-                'menu_item__short_name').annotate(sum=Sum('quantity'))
-            for group in order_groups:
+            for menu_item, line_items in orders['items'].items():
                 data.append(platypus.Paragraph(
-                    group['menu_item__short_name'], group_title_style))
+                    menu_item.short_name, group_title_style))
                 data.append(platypus.Paragraph(
-                    str(group['sum']), group_count_style))
-                for student in orders['orders'].filter(menu_item__short_name=group['menu_item__short_name']):
-                    name = student.transaction.transactee.name()
+                    str(sum(line_item.quantity for line_item in line_items)), group_count_style))
+                for line_item in line_items:
+                    name = line_item.transaction.transactee.name()
                     data.append(platypus.Paragraph(name, normal_style))
                 data.append(platypus.FrameBreak())
-            if len(order_groups) < 2:
+            if len(orders['items']) < 2:
                 data.append(platypus.FrameBreak())
         document.build(data)
         buffer.seek(0)
@@ -500,16 +457,9 @@ def homeroom_orders_report(request):
 @admin_access_allowed
 def entree_orders_report(request):
     time = timezone.localtime(timezone.now())
-    orders = Transaction.objects.filter(submitted__date=time.date())
-    lunch_period_counts = {}
-    for lunch_period in LunchPeriod.objects.all():
-        lunch_period_counts[lunch_period] = get_item_counts(orders.filter(transactee__grade__lunch_period=lunch_period))
-    staff_orders = orders.filter(transactee__grade=None).filter(transactee__role=Profile.STAFF)
-    staff_period = LunchPeriod.objects.get(floating_staff=True)
-    if staff_orders and staff_period:
-        lunch_period_counts[staff_period] = staff_orders
-    if lunch_period_counts:
-        return entree_report_by_period(lunch_period_counts)
+    counts = reports.entree_counts(time.date())
+    if counts['total'] or counts['floating_staff']:
+        return entree_report_by_period(counts)
     else:
         messages.warning(request, 'No orders were found for today.')
         return redirect('admin')
@@ -518,12 +468,8 @@ def entree_orders_report(request):
 @login_required
 @admin_access_allowed
 def lunch_period_order_report(request, lunch_period_id):
-    todays_orders = []
-    lunch_period = LunchPeriod.objects.get(id=lunch_period_id)
-    for staff in Profile.objects.filter(role=Profile.STAFF).filter(grade__lunch_period=lunch_period):
-        class_order = orders_for_homeroom(staff)
-        if class_order:
-            todays_orders.append(class_order)
+    teachers = Profile.objects.filter(role=Profile.STAFF).filter(grade__lunch_period=lunch_period_id)
+    todays_orders = reports.homeroom_orders(teachers, timezone.localdate())
     if todays_orders:
         return orders_report_by_homeroom(todays_orders)
     else:
@@ -145,6 +145,9 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS')
 SERVER_EMAIL = os.getenv('SERVER_EMAIL')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 
+# Processes used to render large lunch card runs; 0 or 1 renders in the request
+LUNCH_CARD_WORKERS = int(os.getenv('LUNCH_CARD_WORKERS', 0))
+
 LOGIN_URL = 'django_auth_adfs:login'
 LOGIN_REDIRECT_URL = '/'
 
@@ -166,6 +169,17 @@ STATIC_URL = '/static/'
 # MEDIA_ROOT = BASE_DIR / 'resources/'
 MEDIA_URL = '/resources/'
 
+# Cache Configuration
+# https://docs.djangoproject.com/en/dev/topics/cache/
+# The menu cache (menu/cache.py) lives here; each worker keeps its own copy,
+# and the version that invalidates it is shared through the constance table.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lunchmanager',
+    }
+}
+
 # Django REST Framework Settings
 # https://www.django-rest-framework.org/api-guide/settings/
 REST_FRAMEWORK = {
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MenuConfig(AppConfig):
     name = 'menu'
     verbose_name = 'Menu Management'
+
+    def ready(self):
+        import menu.signals  # noqa
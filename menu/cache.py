@@ -0,0 +1,65 @@
+import time
+
+from datetime import date
+from typing import List
+
+from constance import settings as constance_settings
+from constance.backends.database.models import Constance
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from menu.models import MenuItem
+
+
+# Roles a menu can be rendered for
+GUARDIAN = 'guardian'
+KIOSK = 'kiosk'
+STAFF = 'staff'
+STUDENT = 'student'
+
+# Seconds a worker keeps a rendered menu for one version
+MENU_CACHE_TIMEOUT = 60
+# The version lives in the constance table rather than the per-worker
+# cache, so a menu edit reaches every worker on its next request
+VERSION_KEY = constance_settings.DATABASE_PREFIX + 'MENU_VERSION'
+
+
+def menu_version() -> int:
+    """ Return the current menu version, starting a new one if needed """
+    version = Constance.objects.filter(key=VERSION_KEY).values_list('value', flat=True).first()
+    if version is None:
+        version = Constance.objects.get_or_create(key=VERSION_KEY, defaults={'value': time.time_ns()})[0].value
+    return version
+
+
+def invalidate_menu():
+    """ Bump the menu version so every cached menu is rebuilt on next use """
+    Constance.objects.update_or_create(key=VERSION_KEY, defaults={'value': time.time_ns()})
+
+
+def menu_queryset(role: str, day: date, lunch_period_id: int = None):
+    queryset = MenuItem.objects.filter(days_available__name=day.strftime('%A'))
+    if role == STUDENT:
+        queryset = queryset.filter(app_only=False).filter(lunch_period=lunch_period_id)
+    elif role == STAFF:
+        queryset = queryset.filter(app_only=False).filter(category=MenuItem.ENTREE)
+    elif role == KIOSK:
+        queryset = queryset.filter(Q(category=MenuItem.ENTREE) | Q(app_only=True))
+    return queryset
+
+
+def todays_menu(role: str, lunch_period_id: int = None, day: date = None) -> List[MenuItem]:
+    """
+    Return the menu items available to the given role, ready to render.
+    Lists are cached by (version, date, lunch period, role) and the version
+    is bumped by the signals in menu/signals.py whenever the menu changes.
+    """
+    if day is None:
+        day = timezone.localdate(timezone.now())
+    key = 'menu:{}:{}:{}:{}'.format(menu_version(), day.isoformat(), lunch_period_id, role)
+    menu_items = cache.get(key)
+    if menu_items is None:
+        menu_items = list(menu_queryset(role, day, lunch_period_id))
+        cache.set(key, menu_items, MENU_CACHE_TIMEOUT)
+    return menu_items
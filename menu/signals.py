@@ -0,0 +1,23 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from cafeteria.models import LunchPeriod, Weekday
+from menu.cache import invalidate_menu
+from menu.models import MenuItem
+
+
+@receiver(post_delete, sender=LunchPeriod)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_delete, sender=Weekday)
+@receiver(post_save, sender=LunchPeriod)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_save, sender=Weekday)
+def menu_changed(sender, **kwargs):
+    invalidate_menu()
+
+
+@receiver(m2m_changed, sender=MenuItem.days_available.through)
+@receiver(m2m_changed, sender=MenuItem.lunch_period.through)
+def menu_availability_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_menu()
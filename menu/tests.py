@@ -1,3 +1,37 @@
+from decimal import Decimal
+
+from constance.backends.database.models import Constance
 from django.test import TestCase
+from django.utils import timezone
+
+from cafeteria.models import Weekday
+from menu import cache as menu_cache
+from menu.models import MenuItem
+
+
+class MenuCacheTests(TestCase):
+
+    def setUp(self):
+        today = timezone.localdate()
+        self.weekday = Weekday.objects.create(name=today.strftime('%A'), abbreviation=today.strftime('%a'))
+        self.pizza = self.create_item('Pizza')
+
+    def create_item(self, name: str) -> MenuItem:
+        item = MenuItem.objects.create(name=name, short_name=name[:8], cost=Decimal('3.00'),
+                                       category=MenuItem.ENTREE, sequence=1)
+        item.days_available.add(self.weekday)
+        return item
+
+    def test_cached_until_the_menu_changes(self):
+        self.assertEqual(menu_cache.todays_menu(menu_cache.KIOSK), [self.pizza])
+        with self.assertNumQueries(1):
+            menu_cache.todays_menu(menu_cache.KIOSK)
+        salad = self.create_item('Salad')
+        self.assertCountEqual(menu_cache.todays_menu(menu_cache.KIOSK), [self.pizza, salad])
 
-# Create your tests here.
+    def test_version_is_shared_between_workers(self):
+        menu_cache.todays_menu(menu_cache.KIOSK)
+        # Another worker's edit only reaches this one through the database
+        MenuItem.objects.filter(id=self.pizza.id).update(cost=Decimal('4.00'))
+        Constance.objects.filter(key=menu_cache.VERSION_KEY).update(value=1)
+        self.assertEqual(menu_cache.todays_menu(menu_cache.KIOSK)[0].cost, Decimal('4.00'))
@@ -1,11 +1,18 @@
 import base64
 import datetime
 import json
+import math
 import os
+import random
 import sys
+import threading
 import time
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 
 
 #
@@ -13,19 +20,106 @@ import requests
 #
 requests.packages.urllib3.disable_warnings()
 
+# Seconds a batch client (pssync, the transaction export) waits for a
+# connection, and then for each read
+CONNECT_TIMEOUT = float(os.getenv('POWERSCHOOL_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('POWERSCHOOL_READ_TIMEOUT', '30'))
+# Keep-alive connections each process holds open to PowerSchool
+POOL_SIZE = int(os.getenv('POWERSCHOOL_POOL_SIZE', '10'))
+# Retries after a 429 or 5xx response or a failed connection, each waiting
+# a random time up to BACKOFF_BASE * 2^attempt seconds
+MAX_RETRIES = int(os.getenv('POWERSCHOOL_MAX_RETRIES', '3'))
+# Clients used while serving a web request, such as a guardian login, have
+# shorter timeouts, fewer retries and one deadline for all their calls, so
+# they finish well inside gunicorn's 30 second worker timeout
+REQUEST_CONNECT_TIMEOUT = float(os.getenv('POWERSCHOOL_REQUEST_CONNECT_TIMEOUT', '3'))
+REQUEST_READ_TIMEOUT = float(os.getenv('POWERSCHOOL_REQUEST_READ_TIMEOUT', '8'))
+REQUEST_MAX_RETRIES = int(os.getenv('POWERSCHOOL_REQUEST_MAX_RETRIES', '1'))
+REQUEST_DEADLINE = float(os.getenv('POWERSCHOOL_REQUEST_DEADLINE', '20'))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# Records requested per page, and how many pages of a resource are
+# fetched at once
+PAGE_SIZE = int(os.getenv('POWERSCHOOL_PAGE_SIZE', '100'))
+CONCURRENCY = int(os.getenv('POWERSCHOOL_CONCURRENCY', '4'))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def shared_session() -> requests.Session:
+    """ The session every client in the process shares, with its connection pool """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'
+            })
+            session.verify = False
+            _session = session
+        return _session
+
+
+def backoff(attempt: int, retry_after: str = None) -> float:
+    """ Seconds to wait before a retry, honouring a Retry-After header """
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class PowerschoolError(Exception):
+    """ A PowerSchool resource could not be retrieved in full """
+
+
+class CallStats:
+    """ Latency counters for one kind of PowerSchool call """
 
-class Powerschool:
     def __init__(self):
-        """ Initialize a Powerschool object """
-        self.base_url = os.getenv('POWERSCHOOL_URL')
-        self.client_id = os.getenv('POWERSCHOOL_CLIENT_ID').encode('UTF-8')
-        self.client_secret = os.getenv('POWERSCHOOL_CLIENT_SECRET').encode('UTF-8')
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+
+    def __str__(self):
+        average = self.seconds / self.calls if self.calls else 0
+        return '{} calls, {} retries, {} errors, {:.3f}s average, {:.3f}s slowest'.format(
+            self.calls, self.retries, self.errors, average, self.slowest)
+
+
+class Powerschool:
+    def __init__(self, base_url=None, client_id=None, client_secret=None, batch=False):
+        """
+        Initialize a Powerschool object, with the server from the environment
+        by default. Clients for web requests get the REQUEST_* timeouts and a
+        deadline; batch clients get the longer timeouts and no deadline.
+        """
+        if batch:
+            self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+            self.max_retries = MAX_RETRIES
+            self.deadline = None
+        else:
+            self.timeout = (REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT)
+            self.max_retries = REQUEST_MAX_RETRIES
+            self.deadline = time.monotonic() + REQUEST_DEADLINE
+        self.base_url = base_url or os.getenv('POWERSCHOOL_URL')
+        self.client_id = (client_id or os.getenv('POWERSCHOOL_CLIENT_ID')).encode('UTF-8')
+        self.client_secret = (client_secret or os.getenv('POWERSCHOOL_CLIENT_SECRET')).encode('UTF-8')
+        self.session = shared_session()
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.token_lock = threading.Lock()
         try:
-            self.headers = {
-                'Accept': 'application/json',
-                'Content-Type': 'application/json',
-                'Authorization': self.access_token()
-            }
+            self.access_token()
         except requests.exceptions.SSLError as e:
             sys.stderr.write('An ssl related error occured: %s\n' % e)
         except requests.exceptions.ConnectionError as e:
@@ -35,7 +129,11 @@ class Powerschool:
                 'An unknown error occured trying to connect to PowerSchool.\nError: %s\n' % e)
 
     def access_token(self):
-        """ Retrieve an access token """
+        """ Retrieve an access token, once for all the threads fetching pages """
+        with self.token_lock:
+            return self.fetch_access_token()
+
+    def fetch_access_token(self):
         if(hasattr(self, 'access_token_response')):
             if(self.access_token_response['expiration_datetime'] > datetime.datetime.now()):
                 return "Bearer " + self.access_token_response['access_token']
@@ -48,13 +146,86 @@ class Powerschool:
             'Authorization': auth_string
         }
         data = "grant_type=client_credentials"
-        r = requests.post(token_url, data, headers=headers, verify=False)
+        r = self.request('access_token', 'POST', token_url, data=data, headers=headers)
         response = r.json()
         response['expiration_datetime'] = datetime.datetime.now(
         ) + datetime.timedelta(seconds=int(response['expires_in']))
         self.access_token_response = response
         return "Bearer " + response['access_token']
 
+    def auth_headers(self):
+        """ The Authorization header, sent along with the session's JSON headers """
+        return {'Authorization': self.access_token()}
+
+    def time_left(self):
+        """ Seconds before the client's deadline, or None for a batch client """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def give_up(self, attempt, wait):
+        """ Whether a failed attempt is final, because of the retry count or the deadline """
+        time_left = self.time_left()
+        return attempt >= self.max_retries or (time_left is not None and wait >= time_left)
+
+    def request(self, name, method, url, retry=True, **kwargs):
+        """
+        Send a request through the shared session with the client's connect
+        and read timeouts, cut short to fit its deadline, and record its
+        latency under name. 429 and 5xx responses, failed connections and
+        read timeouts are retried with jittered backoff. With retry=False,
+        for requests that are not safe to repeat, only 429 responses and
+        connect timeouts are retried.
+        """
+        retryable_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout) if retry \
+            else (requests.exceptions.ConnectTimeout,)
+        attempt = 0
+        failed = False
+        started = time.perf_counter()
+        try:
+            while True:
+                time_left = self.time_left()
+                if time_left is None:
+                    timeout = self.timeout
+                elif time_left > 0:
+                    timeout = tuple(min(seconds, time_left) for seconds in self.timeout)
+                else:
+                    raise requests.exceptions.Timeout('The PowerSchool deadline for this request has passed.')
+                try:
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+                except retryable_errors:
+                    wait = backoff(attempt)
+                    if self.give_up(attempt, wait):
+                        raise
+                else:
+                    repeatable = response.status_code in RETRY_STATUSES and (retry or response.status_code == 429)
+                    wait = backoff(attempt, response.headers.get('Retry-After')) if repeatable else 0
+                    if not repeatable or self.give_up(attempt, wait):
+                        failed = response.status_code >= 400
+                        return response
+                    response.close()
+                attempt += 1
+                time.sleep(wait)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, attempt, failed)
+
+    def record(self, name, seconds, retries, failed):
+        with self.stats_lock:
+            stats = self.stats.setdefault(name, CallStats())
+            stats.calls += 1
+            stats.errors += int(failed)
+            stats.retries += retries
+            stats.seconds += seconds
+            stats.slowest = max(stats.slowest, seconds)
+
+    def latency_report(self):
+        """ One line of latency counters for each kind of call made """
+        with self.stats_lock:
+            return ['{}: {}'.format(name, stats) for name, stats in sorted(self.stats.items())]
+
     # Non-paging endpoints
     def staffInDistrict(self):
         schools = self.schools()
@@ -70,84 +241,96 @@ class Powerschool:
 
     def student_for_dcid(self, student_dcid):
         """ Retrieve the student with a given dcid """
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': self.access_token()
-        }
         resource_endpoint = self.base_url + \
             "ws/v1/student/{}".format(student_dcid)
-        student_response = requests.get(
-            resource_endpoint, headers=headers, verify=False)
+        student_response = self.request(
+            'student_for_dcid', 'GET', resource_endpoint, headers=self.auth_headers())
         return student_response.json()['student']
 
     def teacherWithDCID(self, teacher_dcid):
         """ Retrieve the teacher with a given dcid """
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': self.access_token()
-        }
         resource_endpoint = self.base_url + \
             "ws/v1/staff/{}".format(teacher_dcid)
-        teacher_response = requests.get(
-            resource_endpoint, headers=headers, verify=False)
+        teacher_response = self.request(
+            'teacherWithDCID', 'GET', resource_endpoint, headers=self.auth_headers())
         return teacher_response.json()
 
     # Paging endpoints
-    def resource(self, resource_endpoint, expansions=None, extensions=None, query=None):
-        """ Retrieve the resource at the given resource_url """
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': self.access_token()
-        }
+    def resource(self, resource_endpoint, expansions=None, extensions=None, query=None, concurrency=None):
+        """
+        Retrieve the resource at the given resource_url. Its pages are
+        fetched through a pool of up to concurrency threads and returned in
+        order. Raises PowerschoolError if any page cannot be retrieved.
+        """
+        return list(self.iter_resource(resource_endpoint, expansions, extensions, query, concurrency))
+
+    def iter_resource(self, resource_endpoint, expansions=None, extensions=None, query=None, concurrency=None):
+        """
+        Yield the records of the resource at the given resource_url page by
+        page. Up to concurrency pages are fetched ahead while the caller
+        works through the current one, so only those pages are held in
+        memory. Raises PowerschoolError if the count or any page cannot be
+        retrieved, or if a page before the last one comes back short, as it
+        would if the server capped pagesize below PAGE_SIZE.
+        """
         resource_name = resource_endpoint[resource_endpoint.rfind('/') + 1:]
-        key_1 = resource_name + 's'
-        key_2 = resource_name
         resource_url = self.base_url + resource_endpoint
-        resource_count = self.resource_count(resource_url)
-        params = {}
+        resource_count = self.resource_count(resource_url, query)
+        params = {'pagesize': str(PAGE_SIZE)}
         if expansions:
             params['expansions'] = expansions
         if extensions:
             params['extensions'] = extensions
         if query:
             params['q'] = query
-        data = []
-        page_number = 1
-        while len(data) < resource_count:
-            params['page'] = str(page_number)
+        last_page = math.ceil(resource_count / PAGE_SIZE)
+        pages = iter(range(1, last_page + 1))
+        workers = concurrency or CONCURRENCY
+        if workers <= 1:
+            for page in pages:
+                yield from self.resource_page(resource_url, resource_name, params, page, page < last_page)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            in_flight = deque()
             try:
-                requested_resource_response = requests.get(
-                    resource_url, headers=headers, params=params, verify=False)
-                requested_resources = requested_resource_response.json()[
-                    key_1][key_2]
-                if isinstance(requested_resources, list):
-                    data.extend(requested_resources)
-                else:
-                    resource_dict = [requested_resources]
-                    data.extend(resource_dict)
-            except:
-                return []
-            page_number += 1
-        return data
-
-    def resource_count(self, resource_url):
+                for page in pages:
+                    in_flight.append(pool.submit(
+                        self.resource_page, resource_url, resource_name, params, page, page < last_page))
+                    if len(in_flight) == workers:
+                        yield from in_flight.popleft().result()
+                while in_flight:
+                    yield from in_flight.popleft().result()
+            finally:
+                # Stop fetching pages nobody will read
+                for future in in_flight:
+                    future.cancel()
+
+    def resource_page(self, resource_url, resource_name, params, page_number, full=False):
+        """ Retrieve one page of a resource's records, which must hold PAGE_SIZE of them if full """
+        try:
+            response = self.request(
+                'resource', 'GET', resource_url, headers=self.auth_headers(), params=dict(params, page=str(page_number)))
+            response.raise_for_status()
+            requested_resources = response.json()[resource_name + 's'][resource_name]
+        except Exception as e:
+            raise PowerschoolError('Page {} of {} could not be retrieved: {}'.format(page_number, resource_url, e)) from e
+        if not isinstance(requested_resources, list):
+            requested_resources = [requested_resources]
+        if full and len(requested_resources) < PAGE_SIZE:
+            raise PowerschoolError('Page {} of {} held {} records rather than {}; check the server\'s page size limit.'.format(
+                page_number, resource_url, len(requested_resources), PAGE_SIZE))
+        return requested_resources
+
+    def resource_count(self, resource_url, query=None):
         """ Retrieve the count of the requested resource """
         resource_count_url = resource_url + "/count"
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': self.access_token()
-        }
         try:
-            data = requests.get(resource_count_url,
-                                headers=headers, verify=False)
-            resource_count = data.json()["resource"]["count"]
-            return resource_count
-        except:
-            return 0
+            response = self.request('resource_count', 'GET', resource_count_url, headers=self.auth_headers(),
+                                    params={'q': query} if query else None)
+            response.raise_for_status()
+            return response.json()["resource"]["count"]
+        except Exception as e:
+            raise PowerschoolError('The count of {} could not be retrieved: {}'.format(resource_url, e)) from e
 
     def schools(self):
         """ Retrieve all of the schools """
@@ -157,7 +340,12 @@ class Powerschool:
     def studentsForSchool(self, school_id, expansions=None, extensions=None, query=None):
         """ Retrieve all of the students in a given school """
         resource_endpoint = "ws/v1/school/{}/student".format(school_id)
-        return self.resource(resource_endpoint, expansions)
+        return self.resource(resource_endpoint, expansions, extensions, query)
+
+    def iter_students_for_school(self, school_id, expansions=None, extensions=None, query=None):
+        """ Yield the students in a given school page by page """
+        resource_endpoint = "ws/v1/school/{}/student".format(school_id)
+        return self.iter_resource(resource_endpoint, expansions, extensions, query)
 
     def studentsInDistrict(self):
         resource_endpoint = "ws/v1/district/student"
@@ -175,31 +363,82 @@ class Powerschool:
 
     # PowerQuery endpoints
     def powerquery_resource(self, resource_endpoint, params=None):
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': self.access_token()
-        }
+        """
+        Retrieve the records of a PowerQuery, which has none when the
+        response holds no record. Raises PowerschoolError if it cannot be
+        retrieved, so a failure is not taken for an empty result.
+        """
         resource_url = self.base_url + resource_endpoint
         data = json.dumps(params) if params else '{}'
         try:
-            response = requests.post(
-                resource_url, data=data, headers=headers, verify=False)
-            return response.json()['record']
-        except:
-            return []
+            # PowerQueries only read, so they are safe to retry
+            response = self.request(
+                'powerquery_resource', 'POST', resource_url, data=data, headers=self.auth_headers())
+            response.raise_for_status()
+            return response.json().get('record', [])
+        except Exception as e:
+            raise PowerschoolError('{} could not be retrieved: {}'.format(resource_url, e)) from e
+
+    def iter_powerquery(self, resource_endpoint, params=None):
+        """
+        Yield the records of a PowerQuery page by page, fetching the next
+        page while the caller works through the current one. A short page
+        is only taken as the last one once the page after it comes back
+        empty. Raises PowerschoolError if any page cannot be retrieved, or
+        if a short page is followed by more records, as it would be if the
+        server capped pagesize below PAGE_SIZE.
+        """
+        resource_url = self.base_url + resource_endpoint
+        data = json.dumps(params) if params else '{}'
+
+        def fetch(page_number):
+            try:
+                response = self.request(
+                    'powerquery_page', 'POST', resource_url, data=data, headers=self.auth_headers(),
+                    params={'page': str(page_number), 'pagesize': str(PAGE_SIZE)})
+                response.raise_for_status()
+                return response.json().get('record', [])
+            except Exception as e:
+                raise PowerschoolError('Page {} of {} could not be retrieved: {}'.format(page_number, resource_url, e)) from e
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            page_number = 1
+            upcoming = pool.submit(fetch, page_number)
+            try:
+                while upcoming:
+                    records = upcoming.result()
+                    page_number += 1
+                    upcoming = pool.submit(fetch, page_number) if records else None
+                    if upcoming and len(records) < PAGE_SIZE:
+                        if upcoming.result():
+                            raise PowerschoolError('Page {} of {} held {} records rather than {}; check the server\'s page size limit.'.format(
+                                page_number - 1, resource_url, len(records), PAGE_SIZE))
+                        upcoming = None
+                    yield from records
+            finally:
+                if upcoming:
+                    upcoming.cancel()
 
     def active_staff(self):
         resource_endpoint = "ws/schema/query/com.nrcaknights.knightslunch.teachers.active_staff?pagesize=0"
         return self.powerquery_resource(resource_endpoint)
 
+    def iter_active_staff(self, modified_since=None):
+        """ Yield the active staff, only those modified on or after a date if given """
+        resource_endpoint = "ws/schema/query/com.nrcaknights.knightslunch.teachers.active_staff"
+        params = {'modified_since': modified_since.isoformat()} if modified_since else None
+        return self.iter_powerquery(resource_endpoint, params)
+
     def homeroom_roster_for_teacher(self, teacher_dcid):
         resource_endpoint = "ws/schema/query/com.nrcaknights.knightslunch.students.homeroom_roster"
         return self.powerquery_resource(resource_endpoint, {'teacher_dcid': teacher_dcid})
 
     def students_for_guardian(self, guardian_id):
         resource_endpoint = "ws/schema/query/com.pearson.core.guardian.student_guardian_detail"
-        result = self.powerquery_resource(resource_endpoint, {'guardian_id': [guardian_id]})
+        try:
+            result = self.powerquery_resource(resource_endpoint, {'guardian_id': [guardian_id]})
+        except PowerschoolError:
+            return []
         students = []
         for student in result:
             students.append(student['id'])
@@ -209,11 +448,14 @@ class Powerschool:
     def new_lunch_transaction(self, transaction_info):
         transaction_data = { "tables": { "U_LUNCH_TRANSACTIONS": transaction_info }}
         try:
-            response = requests.post(
+            # A retried insert could be recorded twice
+            response = self.request(
+                'new_lunch_transaction',
+                'POST',
                 self.base_url + "ws/schema/table/U_LUNCH_TRANSACTIONS/",
+                retry=False,
                 data=json.dumps(transaction_data),
-                headers=self.headers,
-                verify=False
+                headers=self.auth_headers()
             )
             response = response.json()
             if response['insert_count'] == 1 and response['result'][0]['status'] == 'SUCCESS':
@@ -0,0 +1,210 @@
+from unittest import mock
+from urllib.parse import urlencode, urlparse
+
+import json
+import os
+import re
+import threading
+
+import requests
+
+from django.test import SimpleTestCase
+
+from powerschool import powerschool
+from powerschool.powerschool import Powerschool, PowerschoolError
+
+
+class FakePowerschoolSession:
+    """
+    Answers the requests a Powerschool client sends through the shared
+    session from in-memory schools, students, staff and homeroom rosters. Records
+    carry a modified date for the modified-since filters. Failures are
+    answered first, once each, to requests whose URL and parameters
+    contain their fragment.
+    """
+
+    def __init__(self):
+        self.schools = []
+        self.students = []
+        self.staff = []
+        self.rosters = {}
+        self.failures = []
+        self.page_cap = None
+        self.reject_modified_since = False
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def fail(self, fragment: str, *statuses: int, retry_after: str = None):
+        self.failures.extend((fragment, status, retry_after) for status in statuses)
+
+    def respond(self, body: dict, status: int = 200, retry_after: str = None) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode('UTF-8')
+        response._content_consumed = True
+        if retry_after:
+            response.headers['Retry-After'] = retry_after
+        return response
+
+    def page(self, records: list, params: dict) -> list:
+        size = int(params['pagesize'])
+        first = (int(params['page']) - 1) * size
+        return records[first:first + min(size, self.page_cap or size)]
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        target = url + ('?' + urlencode(params) if params else '')
+        with self.lock:
+            self.sent.append((method, target, data))
+            for failure in self.failures:
+                if failure[0] in target:
+                    self.failures.remove(failure)
+                    return self.respond({'message': 'failed'}, failure[1], failure[2])
+        path = urlparse(url).path
+        if path.endswith('/oauth/access_token'):
+            return self.respond({'access_token': 'test', 'expires_in': 3600})
+        if path.endswith('.active_staff'):
+            since = json.loads(data).get('modified_since')
+            if since and self.reject_modified_since:
+                return self.respond({'message': 'Unknown argument modified_since'}, 400)
+            staff = self.page([member for member in self.staff if not since or member['modified'] >= since], params)
+            return self.respond({'record': staff} if staff else {})
+        if path.endswith('.homeroom_roster'):
+            roster = self.rosters.get(json.loads(data)['teacher_dcid'], [])
+            return self.respond({'record': roster} if roster else {})
+        match = re.search(r'ws/v1/(?:district|school/(\d+))/(school|student)(/count)?$', path)
+        if match.group(2) == 'school':
+            records = self.schools
+        else:
+            records = [student for student in self.students
+                       if student['school_enrollment']['school_id'] == int(match.group(1))]
+        query = (params or {}).get('q')
+        if query:
+            if self.reject_modified_since:
+                return self.respond({'message': 'Unknown field transaction_date'}, 400)
+            since = query.split('=ge=')[1]
+            records = [record for record in records if record['modified'] >= since]
+        if match.group(3):
+            return self.respond({'resource': {'count': len(records)}})
+        return self.respond({match.group(2) + 's': {match.group(2): self.page(records, params)}})
+
+
+class FakePowerschoolMixin:
+    """
+    Sends a test's PowerSchool requests to a FakePowerschoolSession, with
+    three records a page and no waits between retries
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.session = FakePowerschoolSession()
+        for target, value in [
+                ('powerschool.powerschool.shared_session', mock.Mock(return_value=self.session)),
+                ('powerschool.powerschool.backoff', mock.Mock(return_value=0)),
+                ('powerschool.powerschool.PAGE_SIZE', 3)]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(os.environ, {
+            'POWERSCHOOL_URL': 'https://powerschool.test/',
+            'POWERSCHOOL_CLIENT_ID': 'id',
+            'POWERSCHOOL_CLIENT_SECRET': 'secret',
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent(self, fragment: str) -> list:
+        return [(target, data) for method, target, data in self.session.sent if fragment in target]
+
+
+class PowerschoolClientTests(FakePowerschoolMixin, SimpleTestCase):
+    """ The client's retry and deadline policies and its paging """
+
+    def setUp(self):
+        super().setUp()
+        self.session.schools = [{'id': 1, 'name': 'School 1'}, {'id': 2, 'name': 'School 2'}]
+        self.session.students = [
+            {'id': number, 'school_enrollment': {'school_id': 1}, 'modified': '2020-01-01'} for number in range(1, 9)
+        ]
+
+    def test_requests_are_retried_with_backoff(self):
+        client = Powerschool(batch=True)
+        self.session.fail('district/school/count', 429, retry_after='2')
+        self.session.fail('district/school/count', 503)
+        self.assertEqual(len(client.schools()), 2)
+        self.assertEqual(powerschool.backoff.call_args_list, [mock.call(0, '2'), mock.call(1, None)])
+        self.assertEqual((client.stats['resource_count'].calls, client.stats['resource_count'].retries), (1, 2))
+
+        self.session.fail('district/school/count', *[500] * (powerschool.MAX_RETRIES + 1))
+        self.session.sent.clear()
+        response = client.request('resource_count', 'GET', client.base_url + 'ws/v1/district/school/count')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(self.session.sent), powerschool.MAX_RETRIES + 1)
+        self.assertEqual(client.stats['resource_count'].errors, 1)
+
+    def test_inserts_are_not_retried(self):
+        client = Powerschool(batch=True)
+        self.session.fail('U_LUNCH_TRANSACTIONS', 500, 500)
+        with mock.patch('builtins.print'):
+            self.assertIsNone(client.new_lunch_transaction({'amount': '1.00'}))
+        self.assertEqual(len(self.sent('U_LUNCH_TRANSACTIONS')), 1)
+
+    def test_web_request_retries(self):
+        client = Powerschool()
+        self.session.fail('district/school/count', *[503] * (powerschool.REQUEST_MAX_RETRIES + 1))
+        self.session.sent.clear()
+        response = client.request('resource_count', 'GET', client.base_url + 'ws/v1/district/school/count')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.session.sent), powerschool.REQUEST_MAX_RETRIES + 1)
+
+        # A wait that would run past the deadline is not taken
+        powerschool.backoff.return_value = powerschool.REQUEST_DEADLINE
+        self.session.fail('district/school/count', 503)
+        self.assertEqual(client.request('resource_count', 'GET', client.base_url + 'ws/v1/district/school/count').status_code, 503)
+
+    def test_request_deadline(self):
+        client = Powerschool()
+        self.assertEqual(client.max_retries, powerschool.REQUEST_MAX_RETRIES)
+        client.deadline -= powerschool.REQUEST_DEADLINE + 1
+        self.session.sent.clear()
+        with self.assertRaises(requests.exceptions.Timeout):
+            client.request('resource', 'GET', client.base_url + 'ws/v1/district/school')
+        self.assertFalse(self.session.sent)
+
+    def test_iter_resource_yields_pages_in_order(self):
+        client = Powerschool(batch=True)
+        for concurrency in (1, 3):
+            students = client.iter_resource('ws/v1/school/1/student', concurrency=concurrency)
+            self.assertEqual([student['id'] for student in students], list(range(1, 9)))
+        self.assertEqual(len(self.sent('school/1/student?')), 6)
+
+    def test_iter_resource_raises_for_a_failed_page(self):
+        client = Powerschool(batch=True)
+        self.session.fail('&page=2', 404)
+        with self.assertRaisesMessage(PowerschoolError, 'Page 2 of'):
+            list(client.iter_resource('ws/v1/school/1/student', concurrency=3))
+
+    def test_iter_resource_raises_for_a_failed_count(self):
+        client = Powerschool(batch=True)
+        self.session.fail('school/1/student/count', 401)
+        with self.assertRaisesMessage(PowerschoolError, 'The count of'):
+            list(client.iter_resource('ws/v1/school/1/student'))
+        self.assertFalse(self.sent('school/1/student?'))
+
+    def test_iter_resource_raises_for_a_short_page(self):
+        self.session.page_cap = 2
+        client = Powerschool(batch=True)
+        with self.assertRaisesMessage(PowerschoolError, 'Page 1 of'):
+            list(client.iter_resource('ws/v1/school/1/student'))
+
+    def test_iter_powerquery_reads_until_an_empty_page(self):
+        self.session.staff = [{'dcid': str(number), 'modified': '2020-01-01'} for number in range(1, 8)]
+        client = Powerschool(batch=True)
+        self.assertEqual([member['dcid'] for member in client.iter_active_staff()], [str(number) for number in range(1, 8)])
+        self.assertEqual(len(self.sent('.active_staff')), 4)
+
+    def test_iter_powerquery_raises_for_a_short_page(self):
+        self.session.staff = [{'dcid': str(number), 'modified': '2020-01-01'} for number in range(1, 8)]
+        self.session.page_cap = 2
+        client = Powerschool(batch=True)
+        with self.assertRaisesMessage(PowerschoolError, 'Page 1 of'):
+            list(client.iter_active_staff())
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.13 on 2026-10-17 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0018_alter_profile_cards_printed'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['role', 'active'], name='role_active'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(('current_balance__lt', 0)), fields=['current_balance'], name='negative_balance'),
+        ),
+    ]
@@ -48,6 +48,14 @@ class Profile(models.Model):
     user_number = models.IntegerField(blank=True, null=True)
 
     class Meta:
+        indexes = [
+            models.Index(fields=['role', 'active'], name='role_active'),
+            models.Index(
+                fields=['current_balance'],
+                condition=models.Q(current_balance__lt=0),
+                name='negative_balance'
+            ),
+        ]
         ordering = ['user__last_name', 'user__first_name']
 
     def __str__(self):
@@ -1,3 +1,15 @@
-from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from cafeteria.tests import SeededSchoolTestCase
+
+
+class ProfileViewQueryTests(SeededSchoolTestCase):
+
+    def test_homeroom_teacher_detail(self):
+        self.assertQueryBudget(5, reverse('profile-detail', args=[self.teacher.id]))
+
+    def test_detail_with_archived_history(self):
+        self.assertQueryBudget(6, reverse('profile-detail', args=[self.student.id]) + '?archived=1')
+
+    def test_debtors(self):
+        self.assertQueryBudget(3, reverse('profile-debt-list'))
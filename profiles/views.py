@@ -14,13 +14,13 @@ from django.shortcuts import redirect, render
 from django.urls import resolve, reverse_lazy
 from django.views.generic import DetailView, ListView
 
-from constance import config
+from cafeteria.config_snapshot import config
 
 from cafeteria.decorators import admin_access_allowed
 from cafeteria.pdfgenerators import lunch_card_for_users
 from profiles.models import Profile
 from transactions import helpers
-from transactions.models import Transaction
+from transactions.models import ArchivedTransaction, Transaction
 
 logger = logging.getLogger(__file__)
 
@@ -64,19 +64,25 @@ class ProfileMixin:
         if not self.ascending:
             sorting = '-' + sorting
         self.ascending = not self.ascending
-        return queryset.order_by(sorting)
+        return queryset.select_related('user', 'grade').order_by(sorting)
 
 
 class ProfileDetailView(LoginRequiredMixin, DetailView):
     model = Profile
+    queryset = Profile.objects.select_related('user', 'grade', 'homeroom_teacher__user')
     template_name = 'admin/profile_detail.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         profile = kwargs['object']
         context['transactions'] = Transaction.objects.filter(
-            transactee=profile).order_by('-submitted')
-        context['students'] = profile.students.all()
+            transactee=profile).select_related('transactee__user').with_status().order_by('-submitted')
+        # Closed school years are only read when asked for
+        context['include_archived'] = self.request.GET.get('archived') == '1'
+        if context['include_archived']:
+            context['archived_transactions'] = ArchivedTransaction.objects.filter(
+                transactee=profile).order_by('-submitted')
+        context['students'] = profile.students.select_related('user', 'grade')
         return context
 
 
@@ -145,7 +151,7 @@ def make_inactive(request, pk):
         profile.lunch_uuid = uuid.uuid4()
         profile.cards_printed = 0
         profile.active = False
-        profile.save()
+        profile.save(update_fields=['active', 'cards_printed', 'lunch_uuid'])
         profile.user.is_active = False
         profile.user.save()
         messages.info(request, 'Successfully set {} as inactive.'.format(profile.name()))
@@ -175,7 +181,7 @@ def new_individual_card(request, pk):
             transaction.save()
             helpers.process_transaction(transaction)
             profile.lunch_uuid = uuid.uuid4()
-            profile.save()
+            profile.save(update_fields=['lunch_uuid'])
             return lunch_card_for_users([profile])
         except Exception as e:
             if transaction:
@@ -0,0 +1,120 @@
+// Milliseconds between polls of the dashboard counts. Each poll is a short
+// request of a few queries, so an open kitchen screen never holds a worker.
+const POLL_INTERVAL = 5000;
+const STATUS_CLASSES = {
+  Complete: ["bg-green-100", "text-green-800"],
+  Processing: ["bg-yellow-100", "text-yellow-800"],
+  Submitted: ["bg-indigo-100", "text-indigo-800"],
+};
+const ALL_STATUS_CLASSES = [
+  "bg-green-100", "text-green-800",
+  "bg-yellow-100", "text-yellow-800",
+  "bg-indigo-100", "text-indigo-800",
+  "bg-gray-100", "text-gray-800",
+];
+
+// The entries of current that differ from previous, with null for removed keys
+function changes(previous, current) {
+  const changed = {};
+  for (const [key, value] of Object.entries(current)) {
+    if (previous[key] !== value) {
+      changed[key] = value;
+    }
+  }
+  for (const key of Object.keys(previous)) {
+    if (!(key in current)) {
+      changed[key] = null;
+    }
+  }
+  return changed;
+}
+
+function plural(count, word) {
+  return count + " " + word + (count === 1 ? "" : "s");
+}
+
+function setCount(card, count) {
+  const slicesPer = parseInt(card.dataset.slicesPer, 10);
+  if (slicesPer) {
+    card.querySelector("[data-pizzas]").textContent = plural(Math.ceil(count / slicesPer), "Pizza");
+    card.querySelector("[data-slices]").textContent = plural(count, "Slice");
+  } else {
+    card.querySelector("[data-value]").textContent = count;
+  }
+}
+
+function setStatus(badge, status) {
+  badge.classList.remove(...ALL_STATUS_CLASSES);
+  badge.classList.add(...(STATUS_CLASSES[status] || ["bg-gray-100", "text-gray-800"]));
+  badge.textContent = status;
+}
+
+// Patch the dashboard in place. Returns false when the change needs markup
+// the page does not have yet, such as a new menu item card or order row.
+function applyCounts(counts, isDelta) {
+  for (const [key, count] of Object.entries(counts)) {
+    const card = document.querySelector('[data-count="' + key + '"]');
+    if (card) {
+      setCount(card, count || 0);
+    } else if (isDelta && count) {
+      return false;
+    }
+  }
+  return true;
+}
+
+function applyOrders(orders, isDelta) {
+  const table = document.querySelector("[data-staff-orders]");
+  if (!table) {
+    return true;
+  }
+  for (const [id, status] of Object.entries(orders)) {
+    const badge = table.querySelector('[data-order="' + id + '"]');
+    if (badge && status) {
+      setStatus(badge, status);
+    } else if (isDelta) {
+      return false;
+    }
+  }
+  return true;
+}
+
+async function pollDashboard(url, snapshot) {
+  const response = await fetch(url, {
+    credentials: "same-origin",
+    headers: { Accept: "application/json" },
+  });
+  if (!response.ok) {
+    return snapshot;
+  }
+  const current = await response.json();
+  if (snapshot === null) {
+    applyCounts(current.counts, false);
+    applyOrders(current.orders, false);
+  } else if (
+    !applyCounts(changes(snapshot.counts, current.counts), true) ||
+    !applyOrders(changes(snapshot.orders, current.orders), true)
+  ) {
+    window.location.reload();
+  }
+  return current;
+}
+
+function dashboardFeed(url) {
+  if (!window.fetch) {
+    return;
+  }
+  let snapshot = null;
+  const poll = async () => {
+    // Hidden tabs skip their polls
+    if (!document.hidden) {
+      try {
+        snapshot = await pollDashboard(url, snapshot);
+      } catch (error) {
+        // Try again on the next poll
+      }
+    }
+    window.setTimeout(poll, POLL_INTERVAL);
+  };
+  poll();
+}
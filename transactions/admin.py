@@ -1,5 +1,10 @@
 from django.contrib import admin
 
+from transactions import ledger
+from transactions.models import ArchivedMenuLineItem
+from transactions.models import ArchivedTransaction
+from transactions.models import BalanceCheckpoint
+from transactions.models import DailyItemTally
 from transactions.models import MenuLineItem
 from transactions.models import Transaction
 
@@ -20,3 +25,44 @@ class TransactionAdmin(admin.ModelAdmin):
     readonly_fields = ['beginning_balance', 'ending_balance', 'ps_transaction_id', 'submitted']
     search_fields = ['description', 'transactee__user__first_name',
                      'transactee__user__last_name']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_status()
+
+    @admin.display(ordering='status')
+    def status(self, obj):
+        return obj.status
+
+    def delete_queryset(self, request, queryset):
+        # Rebase balances and tallies once for the whole selection
+        ledger.delete_transactions(queryset)
+
+
+@admin.register(DailyItemTally)
+class DailyItemTallyAdmin(admin.ModelAdmin):
+    list_display = ('business_date', 'lunch_period', 'menu_item', 'quantity')
+    list_filter = ['business_date', 'lunch_period']
+    ordering = ['-business_date', 'lunch_period', 'menu_item__sequence']
+
+
+@admin.register(BalanceCheckpoint)
+class BalanceCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('profile', 'balance', 'created')
+    ordering = ['profile__user__last_name', 'profile__user__first_name']
+    raw_id_fields = ['profile', 'transaction']
+    search_fields = ['profile__user__first_name', 'profile__user__last_name']
+
+
+class ArchivedLineItemInline(admin.TabularInline):
+    model = ArchivedMenuLineItem
+
+
+@admin.register(ArchivedTransaction)
+class ArchivedTransactionAdmin(admin.ModelAdmin):
+    inlines = [ArchivedLineItemInline, ]
+    list_display = ('transactee', 'transaction_type', 'amount', 'submitted', 'school_year')
+    list_filter = ['school_year']
+    ordering = ['submitted']
+    raw_id_fields = ['transactee']
+    search_fields = ['description', 'transactee__user__first_name',
+                     'transactee__user__last_name']
@@ -0,0 +1,71 @@
+from itertools import islice
+
+from django.db import connections, transaction as db_transaction
+from django.db.models.query import QuerySet
+
+from transactions.models import ArchivedMenuLineItem, ArchivedTransaction, BalanceCheckpoint, MenuLineItem, Transaction
+
+
+# Rows copied into the archive tables with each INSERT, and removed from
+# the originals with each DELETE
+BATCH_SIZE = 1000
+
+TRANSACTION_FIELDS = [
+    'id', 'amount', 'beginning_balance', 'business_date', 'completed', 'description',
+    'ending_balance', 'ps_transaction_id', 'submitted', 'transaction_type', 'transactee_id',
+]
+
+
+def copy_rows(rows: QuerySet, model, **extra) -> int:
+    """ Bulk create a model instance from each row of a values() queryset """
+    rows = rows.iterator(chunk_size=BATCH_SIZE)
+    copied = 0
+    while True:
+        batch = [model(**row, **extra) for row in islice(rows, BATCH_SIZE)]
+        if not batch:
+            return copied
+        model.objects.bulk_create(batch)
+        copied += len(batch)
+
+
+def delete_rows(rows: QuerySet) -> int:
+    """
+    Delete the rows with plain DELETE statements on BATCH_SIZE primary keys
+    at a time. Unlike QuerySet.delete(), no model instances are loaded, no
+    delete signals are sent and nothing is cascaded, so the caller deletes
+    whatever references the rows first. Returns the number of rows deleted.
+    """
+    connection = connections[rows.db]
+    table = connection.ops.quote_name(rows.model._meta.db_table)
+    column = connection.ops.quote_name(rows.model._meta.pk.column)
+    keys = rows.order_by('pk').values_list('pk', flat=True)
+    deleted = 0
+    last = None
+    with connection.cursor() as cursor:
+        while True:
+            batch = list((keys if last is None else keys.filter(pk__gt=last))[:BATCH_SIZE])
+            if not batch:
+                return deleted
+            cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(table, column, ', '.join(['%s'] * len(batch))), batch)
+            deleted += cursor.rowcount
+            last = batch[-1]
+
+
+def archive_transactions(transactions: QuerySet, school_year: str) -> int:
+    """
+    Move transactions and their line items into the archive tables for a
+    closed school year. The originals, and any balance checkpoints taken
+    at them, are removed with delete_rows, so balances are not rebased and
+    the tallies, which still count archived orders, keep the line items.
+    Returns the number of transactions archived.
+    """
+    line_items = MenuLineItem.objects.filter(transaction__in=transactions)
+    checkpoints = BalanceCheckpoint.objects.filter(transaction__in=transactions)
+    with db_transaction.atomic():
+        archived = copy_rows(transactions.order_by('id').values(*TRANSACTION_FIELDS),
+                             ArchivedTransaction, school_year=school_year)
+        copy_rows(line_items.order_by('id').values('menu_item_id', 'quantity', 'transaction_id'),
+                  ArchivedMenuLineItem)
+        for rows in (checkpoints, line_items, transactions):
+            delete_rows(rows)
+    return archived
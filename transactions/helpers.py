@@ -1,11 +1,10 @@
-from collections import Counter
-
 from django.utils import timezone
 
-from menu.models import MenuItem
+from menu import cache as menu_cache
 from profiles.models import Profile
+from transactions import ledger, orders
 from transactions.forms import TransactionDepositForm
-from transactions.models import MenuLineItem, Transaction
+from transactions.models import Transaction
 
 
 def create_deposit(deposit: dict) -> Transaction:
@@ -41,53 +40,16 @@ def create_deposit(deposit: dict) -> Transaction:
 def create_order(order: dict) -> Transaction:
     try:
         profile = Profile.objects.get(id=order['transactee'])
-        new_order = Transaction(
-            submitted=timezone.now(),
-            transactee=profile,
-            transaction_type=Transaction.DEBIT
-        )
-        new_order.save()
-        description = ''
-        cost = 0
-        item_counts = Counter(order['items'])
-        for menu_item in item_counts:
-            item = MenuItem.objects.get(id=menu_item)
-            quantity = item_counts[menu_item]
-            if description:
-                description = description + ', '
-            description = description + '({}) {}'.format(quantity, item.name)
-            cost = cost + (item.cost * quantity)
-            menu_line_item = MenuLineItem.objects.create(
-                menu_item=item, transaction=new_order, quantity=quantity)
-            menu_line_item.save()
-        new_order.description = description
-        new_order.amount = cost
-        new_order.save()
-
-        if 'temp_trans' in order:
-            try:
-                old_order = Transaction.objects.get(id=order['temp_trans'])
-                old_order.delete()
-            except:
-                # A previous transaction matching this ID was not found.
-                # Why would we recevie a transaction ID for an order that doesn't exist?
-                pass
-        return new_order
+        menu = menu_cache.todays_menu(menu_cache.GUARDIAN)
+        items = orders.resolve_items(order['items'], menu)
+        # Kiosk purchases are not limited to the one pre-order per day
+        return orders.place_order(profile, items, one_per_day=False, replaces=order.get('temp_trans'))
     except:
         raise Exception
  
 
 def process_transaction(transaction: Transaction):
     try:
-        transactee = transaction.transactee
-        transaction.beginning_balance = transactee.current_balance
-        if transaction.transaction_type == Transaction.CREDIT:
-            transaction.ending_balance = transactee.current_balance + transaction.amount
-        else:
-            transaction.ending_balance = transactee.current_balance - abs(transaction.amount)
-        transaction.completed = timezone.now()
-        transaction.save()
-        transactee.current_balance = transaction.ending_balance
-        transactee.save()
+        ledger.post(transaction)
     except:
-        raise Exception
\ No newline at end of file
+        raise Exception
@@ -0,0 +1,240 @@
+from contextvars import ContextVar
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When, Window
+from django.db.models.functions import Abs
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from profiles.models import Profile
+from transactions import tallies
+from transactions.models import BalanceCheckpoint, MenuLineItem, Transaction
+
+
+# Cleared by delete_transactions, which rebases balances itself, so the
+# pre_delete receiver in transactions/signals.py leaves them alone
+rebase_on_delete = ContextVar('rebase_on_delete', default=True)
+
+
+def balance_change(transaction: Transaction) -> Decimal:
+    """ The amount a transaction adds to its transactee's balance """
+    if transaction.transaction_type == Transaction.CREDIT:
+        return transaction.amount
+    return -abs(transaction.amount)
+
+
+def signed_amount():
+    """ SQL expression for the amount a transaction adds to its transactee's balance """
+    return Case(
+        When(transaction_type=Transaction.CREDIT, then=F('amount')),
+        default=Abs('amount') * Value(-1),
+        output_field=DecimalField(max_digits=6, decimal_places=2)
+    )
+
+
+def running_balances(transactions: QuerySet) -> QuerySet:
+    """
+    Annotate each transaction with the balances it would have if its
+    transactee's transactions in the queryset were replayed from zero, in
+    completed, submitted and ID order, using a window function.
+    """
+    return transactions.annotate(
+        change=signed_amount(),
+        running_balance=Window(
+            expression=Sum(signed_amount()),
+            partition_by=[F('transactee_id')],
+            order_by=[F('completed').asc(), F('submitted').asc(), F('id').asc()]
+        )
+    ).order_by('transactee_id', 'completed', 'submitted', 'id')
+
+
+def after_checkpoint(transaction_path: str = '', checkpoint_path: str = 'transactee__balance_checkpoint') -> Q:
+    """
+    Matches transactions ordered after their transactee's balance checkpoint
+    in completed, submitted and ID order, or every transaction of a profile
+    without one. The paths lead from the queried model to the Transaction
+    and to the BalanceCheckpoint.
+    """
+    completed = F(checkpoint_path + '__transaction__completed')
+    submitted = F(checkpoint_path + '__transaction__submitted')
+    as_of = F(checkpoint_path + '__transaction_id')
+    return (
+        Q(**{checkpoint_path + '__isnull': True})
+        | Q(**{transaction_path + 'completed__gt': completed})
+        | Q(**{transaction_path + 'completed': completed, transaction_path + 'submitted__gt': submitted})
+        | Q(**{transaction_path + 'completed': completed, transaction_path + 'submitted': submitted, transaction_path + 'id__gt': as_of})
+    )
+
+
+def latest_completed() -> Subquery:
+    """ The ID of a profile's latest completed transaction, for annotating profiles """
+    return Subquery(Transaction.objects.filter(transactee=OuterRef('pk'), completed__isnull=False)
+                    .order_by('-completed', '-submitted', '-id').values('id')[:1])
+
+
+def checkpoint(profiles: QuerySet) -> int:
+    """
+    Record each profile's current balance as of its latest completed
+    transaction. Only call this for profiles whose balances were just
+    verified. Returns the number of checkpoints written.
+    """
+    stale = profiles.annotate(latest_transaction=latest_completed())\
+        .filter(latest_transaction__isnull=False)\
+        .exclude(balance_checkpoint__transaction=F('latest_transaction'))\
+        .values_list('id', 'latest_transaction', 'current_balance')
+    return record_checkpoints(stale)
+
+
+def record_checkpoints(balances) -> int:
+    """
+    Record (profile ID, transaction ID, balance) rows as checkpoints,
+    replacing the profiles' old ones. Each balance must have been verified
+    as of that transaction. Returns the number of checkpoints written.
+    """
+    with db_transaction.atomic():
+        checkpoints = [
+            BalanceCheckpoint(profile_id=profile_id, transaction_id=transaction_id, balance=balance)
+            for profile_id, transaction_id, balance in balances
+        ]
+        BalanceCheckpoint.objects.filter(profile__in=[checkpoint.profile_id for checkpoint in checkpoints]).delete()
+        BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=500)
+    return len(checkpoints)
+
+
+def invalidate_checkpoints(transactions: List[Transaction]):
+    """
+    Drop the checkpoints that include any of these transactions, because
+    deleting them changes the balance the checkpoint recorded.
+    """
+    earliest = {}
+    for transaction in transactions:
+        if transaction.completed:
+            key = (transaction.completed, transaction.submitted, transaction.id)
+            if transaction.transactee_id not in earliest or key < earliest[transaction.transactee_id]:
+                earliest[transaction.transactee_id] = key
+    includes = Q()
+    for profile_id, (completed, submitted, transaction_id) in earliest.items():
+        includes |= Q(profile_id=profile_id) & (
+            Q(transaction__completed__gt=completed)
+            | Q(transaction__completed=completed, transaction__submitted__gt=submitted)
+            | Q(transaction__completed=completed, transaction__submitted=submitted, transaction_id__gte=transaction_id)
+        )
+    if includes:
+        BalanceCheckpoint.objects.filter(includes).delete()
+
+
+def post(transaction: Transaction, completed: datetime = None) -> Transaction:
+    """
+    Complete a transaction against its transactee's balance. The profile
+    row is locked while the beginning balance is read and the new balance
+    is written, so concurrent postings to one profile are applied one after
+    another instead of overwriting each other. The completed time is taken
+    once the lock is held, so postings to a profile are stamped in the order
+    their balances chain.
+    """
+    change = balance_change(transaction)
+    with db_transaction.atomic():
+        beginning_balance = Profile.objects.select_for_update()\
+            .filter(id=transaction.transactee_id)\
+            .values_list('current_balance', flat=True).get()
+        if completed is None:
+            completed = timezone.now()
+        transaction.beginning_balance = beginning_balance
+        transaction.ending_balance = beginning_balance + change
+        transaction.completed = completed
+        transaction.save()
+        Profile.objects.filter(id=transaction.transactee_id)\
+            .update(current_balance=F('current_balance') + change)
+    # Keep an already loaded transactee in step, so a later save of it
+    # does not write back the old balance
+    if Transaction.transactee.is_cached(transaction):
+        transaction.transactee.current_balance = transaction.ending_balance
+    return transaction
+
+
+def lock_profiles(profile_ids):
+    """ Lock the profiles' rows, in ID order so concurrent callers cannot deadlock """
+    list(Profile.objects.select_for_update().filter(id__in=profile_ids).order_by('id').values_list('id', flat=True))
+
+
+def completed_after(transaction: Transaction) -> Q:
+    """
+    Matches the transactee's transactions completed after this one. Ties on
+    completed are broken by the lower beginning balance coming later.
+    """
+    after = Q(completed__gt=transaction.completed)
+    if transaction.beginning_balance is not None:
+        after |= Q(completed=transaction.completed, beginning_balance__lt=transaction.beginning_balance)
+    return after
+
+
+def shift_balances(transactions: QuerySet, change: Decimal) -> int:
+    """ Add change to the beginning and ending balances in a single UPDATE """
+    return transactions.update(
+        beginning_balance=F('beginning_balance') + change,
+        ending_balance=F('ending_balance') + change
+    )
+
+
+def rebase_deleted(transaction: Transaction):
+    """
+    Take a completed transaction that is being deleted out of its
+    transactee's later balances and current balance, with one UPDATE each.
+    """
+    change = -balance_change(transaction)
+    with db_transaction.atomic():
+        lock_profiles([transaction.transactee_id])
+        later = Transaction.objects.filter(transactee_id=transaction.transactee_id)\
+            .filter(completed_after(transaction)).exclude(id=transaction.id)
+        shift_balances(later, change)
+        invalidate_checkpoints([transaction])
+        Profile.objects.filter(id=transaction.transactee_id)\
+            .update(current_balance=F('current_balance') + change)
+    if Transaction.transactee.is_cached(transaction):
+        transaction.transactee.current_balance = transaction.transactee.current_balance + change
+
+
+def delete_transactions(transactions: QuerySet, rebase: bool = True) -> int:
+    """
+    Delete many transactions, rebasing the remaining balances with one
+    UPDATE per profile rather than one per deleted transaction. Each later
+    transaction is shifted by the running total of the deletions before it.
+    With rebase=False the balances are left as they are. The line items'
+    tallies are reduced with one UPDATE rather than one per line item.
+    Returns the number of transactions deleted.
+    """
+    with db_transaction.atomic():
+        if rebase:
+            deletions = {}
+            completed = transactions.filter(completed__isnull=False)\
+                .order_by('transactee_id', 'completed', '-beginning_balance')\
+                .only('id', 'amount', 'beginning_balance', 'completed', 'submitted', 'transactee_id', 'transaction_type')
+            for transaction in completed:
+                deletions.setdefault(transaction.transactee_id, []).append(transaction)
+            lock_profiles(deletions.keys())
+            for profile_id, profile_deletions in deletions.items():
+                # Every When is checked against the balances as they were
+                # before the UPDATE, latest deletion first
+                change = 0
+                shifts = []
+                for transaction in profile_deletions:
+                    change = change - balance_change(transaction)
+                    shifts.insert(0, When(completed_after(transaction), then=Value(change)))
+                shift = Case(*shifts, default=Value(0), output_field=DecimalField(max_digits=6, decimal_places=2))
+                Transaction.objects.filter(transactee_id=profile_id)\
+                    .filter(completed_after(profile_deletions[0]))\
+                    .exclude(id__in=[transaction.id for transaction in profile_deletions])\
+                    .update(beginning_balance=F('beginning_balance') + shift, ending_balance=F('ending_balance') + shift)
+                Profile.objects.filter(id=profile_id).update(current_balance=F('current_balance') + change)
+            invalidate_checkpoints(completed)
+        tallies.subtract(MenuLineItem.objects.filter(transaction__in=transactions))
+        token = rebase_on_delete.set(False)
+        try:
+            with tallies.untallied_deletes():
+                _, deleted = transactions.delete()
+        finally:
+            rebase_on_delete.reset(token)
+    return deleted.get(Transaction._meta.label, 0)
@@ -0,0 +1,121 @@
+#
+# benchmark_ledger.py
+#
+# Copyright (c) 2022 Doug Penny
+# Licensed under MIT
+#
+# See LICENSE.md for license information
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from profiles.models import Profile
+from transactions import ledger
+from transactions.models import Transaction
+
+
+def unlocked_post(transaction: Transaction):
+    """ The read, compute and save that ledger.post replaced """
+    transactee = Profile.objects.get(id=transaction.transactee_id)
+    transaction.beginning_balance = transactee.current_balance
+    transaction.ending_balance = transactee.current_balance + ledger.balance_change(transaction)
+    transaction.completed = timezone.now()
+    transaction.save()
+    transactee.current_balance = transaction.ending_balance
+    transactee.save()
+
+
+class Command(BaseCommand):
+    help = 'Post deposits to one throwaway profile from many threads at once and report lost updates and throughput for ledger.post and for the old unlocked read-modify-write. Run it against a database that supports row locks, such as PostgreSQL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t',
+            '--threads',
+            default=8,
+            help='Threads posting at the same time.',
+            type=int
+        )
+        parser.add_argument(
+            '-p',
+            '--postings',
+            default=100,
+            help='Deposits posted by each thread.',
+            type=int
+        )
+        parser.add_argument(
+            '--skip-unlocked',
+            action='store_true',
+            help='Only benchmark ledger.post.'
+        )
+
+    def hammer(self, profile: Profile, post, threads: int, postings: int) -> (float, int):
+        def worker():
+            errors = 0
+            try:
+                for _ in range(postings):
+                    deposit = Transaction(
+                        amount=Decimal('1.00'),
+                        description='Ledger benchmark',
+                        submitted=timezone.now(),
+                        transaction_type=Transaction.CREDIT,
+                        transactee=profile
+                    )
+                    try:
+                        deposit.save()
+                        post(deposit)
+                    except Exception:
+                        errors += 1
+            finally:
+                connection.close()
+            return errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(worker) for _ in range(threads)]
+            errors = sum(future.result() for future in futures)
+        return time.perf_counter() - started, errors
+
+    def run(self, name: str, post, threads: int, postings: int):
+        user = User.objects.create(username='ledger-benchmark-{}'.format(uuid.uuid4().hex[:12]))
+        profile = Profile.objects.create(user=user, role=Profile.STAFF, last_sync=timezone.now())
+        try:
+            elapsed, errors = self.hammer(profile, post, threads, postings)
+            posted = Transaction.objects.filter(transactee=profile, completed__isnull=False).count()
+            balance = Profile.objects.values_list('current_balance', flat=True).get(id=profile.id)
+            lost = posted - int(balance)
+            self.stdout.write('{:<9} {:>7} {:>7} {:>9} {:>6} {:>8.2f}s {:>10.1f}/s'.format(
+                name, posted, errors, str(balance), lost, elapsed, posted / elapsed))
+        finally:
+            # The profile is deleted along with its transactions, so skip
+            # rebasing balances for each of them
+            token = ledger.rebase_on_delete.set(False)
+            try:
+                user.delete()
+            finally:
+                ledger.rebase_on_delete.reset(token)
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        postings = options['postings']
+        if threads * postings >= 10000:
+            raise CommandError('threads x postings must stay below 10,000 to fit in a balance.')
+        if connection.vendor == 'sqlite':
+            self.stderr.write('SQLite ignores select_for_update, so these results say little about production.')
+        self.stdout.write('{:<9} {:>7} {:>7} {:>9} {:>6} {:>9} {:>12}'.format(
+            'Mode', 'Posted', 'Errors', 'Balance', 'Lost', 'Time', 'Throughput'))
+        self.run('locked', ledger.post, threads, postings)
+        if not options['skip_unlocked']:
+            self.run('unlocked', unlocked_post, threads, postings)
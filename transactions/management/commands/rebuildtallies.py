@@ -0,0 +1,52 @@
+#
+# rebuildtallies.py
+#
+# Copyright (c) 2022 Doug Penny
+# Licensed under MIT
+#
+# See LICENSE.md for license information
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+import logging
+
+from transactions import tallies
+
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily item tallies from the ordered line items. By default, only today\'s tallies are rebuilt. Use --date to rebuild a single day or --all to rebuild every day.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-d',
+            '--date',
+            help='Rebuild the tallies for a single day, formatted YYYY-MM-DD.'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild the tallies for every day.'
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            days = None
+        elif options['date']:
+            try:
+                days = [datetime.strptime(options['date'], '%Y-%m-%d').date()]
+            except ValueError:
+                raise CommandError('Dates must be formatted YYYY-MM-DD.')
+        else:
+            days = [timezone.localdate()]
+        count = tallies.rebuild(days)
+        logger.info('Rebuilt {} daily item tallies.'.format(count))
+        self.stdout.write('Rebuilt {} daily item tallies.'.format(count))
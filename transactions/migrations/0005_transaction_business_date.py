@@ -0,0 +1,22 @@
+# Generated by Django 3.2.13 on 2026-10-17 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_auto_20201110_0707'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='business_date',
+            field=models.DateField(blank=True, default=None, help_text='School day a menu order counts against; limited to one order per day.', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('business_date__isnull', False), ('transaction_type', 'DB')), fields=('transactee', 'business_date'), name='one_order_per_day'),
+        ),
+    ]
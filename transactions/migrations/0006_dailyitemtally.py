@@ -0,0 +1,58 @@
+# Generated by Django 3.2.13 on 2026-10-17 00:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def backfill_tallies(apps, schema_editor):
+    DailyItemTally = apps.get_model('transactions', 'DailyItemTally')
+    MenuLineItem = apps.get_model('transactions', 'MenuLineItem')
+    grouped = MenuLineItem.objects.values(
+        'transaction__submitted__date',
+        'transaction__transactee__grade__lunch_period',
+        'menu_item'
+    ).annotate(total=Sum('quantity')).order_by()
+    DailyItemTally.objects.bulk_create([
+        DailyItemTally(
+            business_date=group['transaction__submitted__date'],
+            lunch_period_id=group['transaction__transactee__grade__lunch_period'],
+            menu_item_id=group['menu_item'],
+            quantity=group['total']
+        )
+        for group in grouped
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0007_auto_20210826_1531'),
+        ('cafeteria', '0017_lunchperiod_floating_staff'),
+        ('transactions', '0005_transaction_business_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyItemTally',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('business_date', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('lunch_period', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='cafeteria.lunchperiod')),
+                ('menu_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='menu.menuitem')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Item Tallies',
+                'ordering': ['business_date', 'menu_item__sequence'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyitemtally',
+            constraint=models.UniqueConstraint(fields=('business_date', 'lunch_period', 'menu_item'), name='unique_daily_item_tally'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyitemtally',
+            constraint=models.UniqueConstraint(condition=models.Q(('lunch_period__isnull', True)), fields=('business_date', 'menu_item'), name='unique_daily_item_tally_no_period'),
+        ),
+        migrations.RunPython(backfill_tallies, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.13 on 2026-10-17 00:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0018_alter_profile_cards_printed'),
+        ('transactions', '0006_dailyitemtally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoint', to='profiles.profile')),
+                ('transaction', models.ForeignKey(help_text='Last completed transaction included in the balance.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transactions.transaction')),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.13 on 2026-10-17 01:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('menu', '0007_auto_20210826_1531'),
+        ('profiles', '0018_alter_profile_cards_printed'),
+        ('transactions', '0007_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.IntegerField(help_text='ID the transaction had before it was archived.', primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('beginning_balance', models.DecimalField(decimal_places=2, max_digits=6, null=True)),
+                ('business_date', models.DateField(blank=True, default=None, null=True)),
+                ('completed', models.DateTimeField(blank=True, default=None, null=True)),
+                ('description', models.TextField(blank=True, default='')),
+                ('ending_balance', models.DecimalField(decimal_places=2, max_digits=6, null=True)),
+                ('ps_transaction_id', models.IntegerField(blank=True, default=None, null=True)),
+                ('school_year', models.CharField(help_text='School year the transaction was archived at the end of.', max_length=20)),
+                ('submitted', models.DateTimeField()),
+                ('transaction_type', models.CharField(choices=[('DB', 'Debit'), ('CR', 'Credit')], default='DB', max_length=2)),
+                ('transactee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='profiles.profile')),
+            ],
+            options={
+                'ordering': ['submitted'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedMenuLineItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.SmallIntegerField()),
+                ('menu_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_line_items', to='menu.menuitem')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_item', to='transactions.archivedtransaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['transactee', 'submitted'], name='archived_transactee_submitted'),
+        ),
+    ]
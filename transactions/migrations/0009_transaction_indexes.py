@@ -0,0 +1,27 @@
+# Generated by Django 3.2.13 on 2026-10-17 01:02
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_archivedtransaction'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transactee', 'submitted'], name='transactee_submitted'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(django.db.models.expressions.F('transaction_type'), django.db.models.functions.datetime.TruncDate('submitted'), condition=models.Q(('completed__isnull', True)), name='pending_type_submitted_date'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('ps_transaction_id__isnull', True)), fields=['completed'], name='unexported_completed'),
+        ),
+    ]
@@ -1,12 +1,42 @@
 import os
 
 from datetime import date, datetime, time
+from functools import lru_cache
 
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import TruncDate
 from django.urls import reverse
 from django.utils import timezone
 
-from constance import config
+from cafeteria.config_snapshot import config
+
+
+class DailyItemTally(models.Model):
+    business_date = models.DateField()
+    lunch_period = models.ForeignKey(
+        'cafeteria.LunchPeriod', blank=True, null=True, on_delete=models.CASCADE, related_name='tallies')
+    menu_item = models.ForeignKey(
+        'menu.MenuItem', on_delete=models.CASCADE, related_name='tallies')
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['business_date', 'lunch_period', 'menu_item'],
+                name='unique_daily_item_tally'
+            ),
+            models.UniqueConstraint(
+                condition=models.Q(lunch_period__isnull=True),
+                fields=['business_date', 'menu_item'],
+                name='unique_daily_item_tally_no_period'
+            ),
+        ]
+        ordering = ['business_date', 'menu_item__sequence']
+        verbose_name_plural = 'Daily Item Tallies'
+
+    def __str__(self):
+        return '{} - {} {}'.format(self.business_date, self.quantity, self.menu_item.name)
 
 
 class MenuLineItem(models.Model):
@@ -20,6 +50,31 @@ class MenuLineItem(models.Model):
         return str(self.quantity) + ' - ' + self.menu_item.name
 
 
+@lru_cache(maxsize=None)
+def order_cutoff() -> time:
+    """ The ORDER_CUTOFF time, parsed once per process """
+    return datetime.strptime(os.getenv('ORDER_CUTOFF'), '%H:%M').time()
+
+
+class TransactionQuerySet(models.QuerySet):
+    COMPLETE = 'Complete'
+    PROCESSING = 'Processing'
+    SUBMITTED = 'Submitted'
+    STATUS_CHOICES = [COMPLETE, PROCESSING, SUBMITTED]
+
+    def with_status(self):
+        """ Annotate each transaction's status, computed by the database """
+        now = timezone.now()
+        today = timezone.localdate(now)
+        midnight_today = timezone.make_aware(datetime.combine(today, time(0, 0)))
+        cutoff_today = timezone.make_aware(datetime.combine(today, order_cutoff()))
+        whens = [models.When(completed__isnull=False, then=models.Value(self.COMPLETE))]
+        if now < cutoff_today:
+            whens.append(models.When(submitted__gt=midnight_today, then=models.Value(self.SUBMITTED)))
+        return self.annotate(status=models.Case(
+            *whens, default=models.Value(self.PROCESSING), output_field=models.CharField()))
+
+
 class Transaction(models.Model):
     DEBIT = 'DB'
     CREDIT = 'CR'
@@ -30,6 +85,8 @@ class Transaction(models.Model):
     amount = models.DecimalField(decimal_places=2, default=0, max_digits=6)
     beginning_balance = models.DecimalField(
         decimal_places=2, max_digits=6, null=True)
+    business_date = models.DateField(
+        blank=True, default=None, null=True, help_text='School day a menu order counts against; limited to one order per day.')
     completed = models.DateTimeField(blank=True, default=None, null=True)
     description = models.TextField(blank=True, default='')
     menu_items = models.ManyToManyField(
@@ -43,7 +100,30 @@ class Transaction(models.Model):
     transactee = models.ForeignKey(
         'profiles.Profile', on_delete=models.CASCADE)
 
+    objects = TransactionQuerySet.as_manager()
+
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                condition=models.Q(business_date__isnull=False, transaction_type='DB'),
+                fields=['transactee', 'business_date'],
+                name='one_order_per_day'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['transactee', 'submitted'], name='transactee_submitted'),
+            # Matches submitted__date lookups in the project time zone
+            models.Index(
+                F('transaction_type'), TruncDate('submitted'),
+                condition=models.Q(completed__isnull=True),
+                name='pending_type_submitted_date'
+            ),
+            models.Index(
+                fields=['completed'],
+                condition=models.Q(ps_transaction_id__isnull=True),
+                name='unexported_completed'
+            ),
+        ]
         ordering = ['submitted']
 
     def get_absolute_url(self):
@@ -51,19 +131,78 @@ class Transaction(models.Model):
 
     @property
     def status(self):
+        if '_status' in self.__dict__:
+            return self._status
         midnight_today = timezone.make_aware(
-            datetime.combine(date.today(), time(0, 0)))
-        cutoff_time = datetime.time(datetime.strptime(
-            os.getenv('ORDER_CUTOFF'), '%H:%M'))
+            datetime.combine(timezone.localdate(), time(0, 0)))
         cutoff_today = timezone.make_aware(
-            datetime.combine(date.today(), cutoff_time))
+            datetime.combine(timezone.localdate(), order_cutoff()))
         if self.completed:
-            return 'Complete'
+            return TransactionQuerySet.COMPLETE
         elif self.submitted > midnight_today and timezone.now() < cutoff_today:
-            return 'Submitted'
+            return TransactionQuerySet.SUBMITTED
         else:
-            return 'Processing'
+            return TransactionQuerySet.PROCESSING
+
+    @status.setter
+    def status(self, value):
+        # Set by TransactionQuerySet.with_status()
+        self._status = value
 
     @staticmethod
     def accepting_orders() -> bool:
         return config.CLOSE_TIME > datetime.now().time()
+
+
+class BalanceCheckpoint(models.Model):
+    balance = models.DecimalField(decimal_places=2, max_digits=6)
+    created = models.DateTimeField(default=timezone.now)
+    profile = models.OneToOneField(
+        'profiles.Profile', on_delete=models.CASCADE, related_name='balance_checkpoint')
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name='+',
+        help_text='Last completed transaction included in the balance.')
+
+    def __str__(self):
+        return '{} - ${} as of #{}'.format(self.profile, self.balance, self.transaction_id)
+
+
+class ArchivedTransaction(models.Model):
+    id = models.IntegerField(
+        primary_key=True, help_text='ID the transaction had before it was archived.')
+    amount = models.DecimalField(decimal_places=2, default=0, max_digits=6)
+    beginning_balance = models.DecimalField(
+        decimal_places=2, max_digits=6, null=True)
+    business_date = models.DateField(blank=True, default=None, null=True)
+    completed = models.DateTimeField(blank=True, default=None, null=True)
+    description = models.TextField(blank=True, default='')
+    ending_balance = models.DecimalField(
+        decimal_places=2, max_digits=6, null=True)
+    ps_transaction_id = models.IntegerField(blank=True, default=None, null=True)
+    school_year = models.CharField(
+        max_length=20, help_text='School year the transaction was archived at the end of.')
+    submitted = models.DateTimeField()
+    transaction_type = models.CharField(
+        choices=Transaction.TYPE_CHOICES, default=Transaction.DEBIT, max_length=2)
+    transactee = models.ForeignKey(
+        'profiles.Profile', on_delete=models.CASCADE, related_name='archived_transactions')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['transactee', 'submitted'], name='archived_transactee_submitted'),
+        ]
+        ordering = ['submitted']
+
+    def __str__(self):
+        return '{} - {} ({})'.format(self.transactee, self.description, self.school_year)
+
+
+class ArchivedMenuLineItem(models.Model):
+    menu_item = models.ForeignKey(
+        'menu.MenuItem', on_delete=models.CASCADE, related_name='archived_line_items')
+    transaction = models.ForeignKey(
+        ArchivedTransaction, on_delete=models.CASCADE, related_name='line_item')
+    quantity = models.SmallIntegerField()
+
+    def __str__(self):
+        return str(self.quantity) + ' - ' + self.menu_item.name
@@ -0,0 +1,90 @@
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+
+from menu.models import MenuItem
+from profiles.models import Profile
+from transactions import tallies
+from transactions.models import MenuLineItem, Transaction
+
+
+class DuplicateOrderError(Exception):
+    """ The transactee has already placed an order for the business day """
+
+
+class UnavailableItemError(Exception):
+    """ An ordered item is not on the menu the order was checked against """
+
+    def __init__(self, item):
+        self.item = item
+        super().__init__('{} is not available.'.format(item))
+
+
+def resolve_items(item_ids: Iterable[int], menu: List[MenuItem]) -> List[MenuItem]:
+    """
+    Map menu item IDs onto an already loaded menu. Any IDs that are not on
+    the menu are loaded together in a single query.
+    """
+    item_ids = list(item_ids)
+    items_by_id = {item.id: item for item in menu}
+    missing = set(item_ids) - items_by_id.keys()
+    if missing:
+        items_by_id.update(MenuItem.objects.in_bulk(missing))
+    try:
+        return [items_by_id[item_id] for item_id in item_ids]
+    except KeyError as e:
+        raise UnavailableItemError(e.args[0])
+
+
+def place_order(
+    transactee: Profile,
+    items: Iterable[MenuItem],
+    menu: List[MenuItem] = None,
+    submitted: datetime = None,
+    one_per_day: bool = True,
+    replaces: int = None
+) -> Transaction:
+    """
+    Create an order and its line items in a single database transaction.
+
+    When a menu is given, every item must be on it. Orders placed with
+    one_per_day are tied to their business date, and the one_order_per_day
+    constraint rejects a second order for the same transactee and day.
+    The transaction ID in replaces is deleted before the new order is saved.
+    """
+    counted_items = Counter(items)
+    if menu is not None:
+        for item in counted_items:
+            if item not in menu:
+                raise UnavailableItemError(item)
+    if not submitted:
+        submitted = timezone.now()
+    order = Transaction(
+        amount=sum(item.cost * quantity for item, quantity in counted_items.items()),
+        description=', '.join('({}) {}'.format(quantity, item.name) for item, quantity in counted_items.items()),
+        submitted=submitted,
+        transaction_type=Transaction.DEBIT,
+        transactee=transactee
+    )
+    if one_per_day:
+        order.business_date = timezone.localdate(submitted)
+    with db_transaction.atomic():
+        if replaces:
+            for old_order in Transaction.objects.filter(id=replaces):
+                old_order.delete()
+        try:
+            order.save()
+        except IntegrityError:
+            if one_per_day:
+                raise DuplicateOrderError
+            raise
+        MenuLineItem.objects.bulk_create([
+            MenuLineItem(menu_item=item, quantity=quantity, transaction=order)
+            for item, quantity in counted_items.items()
+        ])
+        # bulk_create skips the MenuLineItem signals, so count the items here
+        tallies.add_order(order, counted_items)
+    return order
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from profiles.models import Profile
+from transactions.models import Transaction
+
+
+def settle_orders(orders: QuerySet, completed: datetime = None) -> int:
+    """
+    Complete every unprocessed order in the queryset in one database
+    transaction. The transactees are locked, each order is charged against
+    a running balance in submitted order, and the results are written back
+    with a bulk update of the ending balances and one UPDATE for the rest.
+    The completed time is taken once the locks are held, so it follows any
+    posting that held them first. Returns the number of orders settled.
+    """
+    pending = orders.filter(completed__isnull=True)
+    with db_transaction.atomic():
+        profile_ids = set(pending.values_list('transactee_id', flat=True))
+        if not profile_ids:
+            return 0
+        # Lock in ID order so concurrent settlements cannot deadlock
+        profiles = Profile.objects.select_for_update()\
+            .filter(id__in=profile_ids).order_by('id').only('id', 'current_balance')
+        balances = {profile.id: profile for profile in profiles}
+        if completed is None:
+            completed = timezone.now()
+        # Re-read the orders under the locks in case another request
+        # completed some of them first
+        settled = list(pending.select_for_update()
+                       .filter(transactee_id__in=profile_ids)
+                       .order_by('transactee_id', 'submitted', 'id')
+                       .only('id', 'amount', 'transactee_id', 'submitted'))
+        for order in settled:
+            profile = balances[order.transactee_id]
+            profile.current_balance = profile.current_balance - order.amount
+            order.ending_balance = profile.current_balance
+        # Only the ending balances differ per row, the rest is set in one UPDATE
+        Transaction.objects.bulk_update(settled, ['ending_balance'], batch_size=500)
+        Transaction.objects.filter(id__in=[order.id for order in settled]).update(
+            beginning_balance=F('ending_balance') + F('amount'), completed=completed)
+        Profile.objects.bulk_update(balances.values(), ['current_balance'], batch_size=500)
+    return len(settled)
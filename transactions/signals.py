@@ -1,28 +1,47 @@
-from django.db.models.signals import pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 
-from transactions.models import Transaction
+from transactions import ledger, tallies
+from transactions.models import MenuLineItem, Transaction
 
 
 @receiver(pre_delete, sender=Transaction)
 def update_balances(sender, instance, **kwargs):
-    if instance.completed:
-        following_completed = Transaction.objects.filter(
-            transactee=instance.transactee,
-            completed__gte=instance.completed
-        )
-        amount = 0
-        if instance.transaction_type == Transaction.CREDIT:
-            amount = -(instance.amount)
-        else:
-            amount = instance.amount
-        for completed_transaction in following_completed:
-            if not completed_transaction.completed == instance.completed:
-                completed_transaction.beginning_balance = completed_transaction.beginning_balance + amount
-                completed_transaction.ending_balance = completed_transaction.ending_balance + amount
-            elif completed_transaction.beginning_balance < instance.beginning_balance:
-                completed_transaction.beginning_balance = completed_transaction.beginning_balance + amount
-                completed_transaction.ending_balance = completed_transaction.ending_balance + amount
-            completed_transaction.save()
-        instance.transactee.current_balance = instance.transactee.current_balance + amount
-        instance.transactee.save()
+    if instance.completed and ledger.rebase_on_delete.get():
+        ledger.rebase_deleted(instance)
+
+
+def line_item_order(line_item: MenuLineItem) -> Transaction:
+    return Transaction.objects.select_related('transactee__grade')\
+        .filter(id=line_item.transaction_id).first()
+
+
+@receiver(pre_save, sender=MenuLineItem)
+def remember_line_item(sender, instance, raw=False, **kwargs):
+    instance._tallied = None
+    if instance.pk and not raw:
+        instance._tallied = MenuLineItem.objects.filter(pk=instance.pk)\
+            .values_list('menu_item_id', 'quantity').first()
+
+
+@receiver(post_save, sender=MenuLineItem)
+def tally_line_item(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    order = line_item_order(instance)
+    if order:
+        business_date, lunch_period_id = tallies.tally_key(order)
+        if getattr(instance, '_tallied', None):
+            menu_item_id, quantity = instance._tallied
+            tallies.adjust(business_date, lunch_period_id, menu_item_id, -quantity)
+        tallies.adjust(business_date, lunch_period_id, instance.menu_item_id, instance.quantity)
+
+
+@receiver(post_delete, sender=MenuLineItem)
+def untally_line_item(sender, instance, **kwargs):
+    if not tallies.untally_on_delete.get():
+        return
+    order = line_item_order(instance)
+    if order:
+        business_date, lunch_period_id = tallies.tally_key(order)
+        tallies.adjust(business_date, lunch_period_id, instance.menu_item_id, -instance.quantity)
@@ -0,0 +1,113 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date
+from typing import Dict, Iterable
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from transactions.models import ArchivedMenuLineItem, DailyItemTally, MenuLineItem, Transaction
+
+
+# Cleared by untallied_deletes, so the post_delete receiver in
+# transactions/signals.py leaves the tallies of bulk deletes alone
+untally_on_delete = ContextVar('untally_on_delete', default=True)
+
+
+def tally_key(order: Transaction) -> (date, int):
+    """ The (business date, lunch period ID) an order's items are counted under """
+    grade = order.transactee.grade
+    return timezone.localdate(order.submitted), grade.lunch_period_id if grade else None
+
+
+def adjust(business_date: date, lunch_period_id: int, menu_item_id: int, quantity: int):
+    """ Add quantity (which may be negative) to a single tally row """
+    tallies = DailyItemTally.objects.filter(
+        business_date=business_date, lunch_period=lunch_period_id, menu_item=menu_item_id)
+    if tallies.update(quantity=F('quantity') + quantity):
+        return
+    try:
+        with db_transaction.atomic():
+            DailyItemTally.objects.create(
+                business_date=business_date, lunch_period_id=lunch_period_id,
+                menu_item_id=menu_item_id, quantity=quantity)
+    except IntegrityError:
+        # Another request created the row first
+        tallies.update(quantity=F('quantity') + quantity)
+
+
+def add_order(order: Transaction, item_counts: Dict, sign: int = 1):
+    """ Count (or with sign=-1, uncount) an order's {MenuItem: quantity} """
+    business_date, lunch_period_id = tally_key(order)
+    for item, quantity in item_counts.items():
+        adjust(business_date, lunch_period_id, item.id, sign * quantity)
+
+
+def subtract(line_items: QuerySet) -> int:
+    """
+    Take the line items' quantities out of their tallies with one grouped
+    query and one UPDATE, before they are deleted in bulk. Returns the
+    number of tally rows changed.
+    """
+    grouped = line_items.values(
+        'transaction__submitted__date',
+        'transaction__transactee__grade__lunch_period',
+        'menu_item'
+    ).annotate(total=Sum('quantity')).order_by()
+    matches = Q()
+    changes = []
+    for group in grouped:
+        match = Q(business_date=group['transaction__submitted__date'],
+                  lunch_period=group['transaction__transactee__grade__lunch_period'],
+                  menu_item=group['menu_item'])
+        matches |= match
+        changes.append(When(match, then=Value(group['total'])))
+    if not changes:
+        return 0
+    return DailyItemTally.objects.filter(matches).update(
+        quantity=F('quantity') - Case(*changes, default=Value(0), output_field=IntegerField()))
+
+
+@contextmanager
+def untallied_deletes():
+    """ Delete line items without adjusting the tallies row by row """
+    token = untally_on_delete.set(False)
+    try:
+        yield
+    finally:
+        untally_on_delete.reset(token)
+
+
+def rebuild(days: Iterable[date] = None) -> int:
+    """
+    Recompute the tallies from current and archived line items, for the
+    given days or for all history when no days are given. Returns the
+    number of tally rows.
+    """
+    tallies = DailyItemTally.objects.all()
+    if days is not None:
+        days = list(days)
+        tallies = tallies.filter(business_date__in=days)
+    counts = defaultdict(int)
+    # Archived orders from closed school years are still counted
+    for line_items in (MenuLineItem.objects.all(), ArchivedMenuLineItem.objects.all()):
+        if days is not None:
+            line_items = line_items.filter(transaction__submitted__date__in=days)
+        grouped = line_items.values(
+            'transaction__submitted__date',
+            'transaction__transactee__grade__lunch_period',
+            'menu_item'
+        ).annotate(total=Sum('quantity')).order_by()
+        for group in grouped:
+            key = (group['transaction__submitted__date'], group['transaction__transactee__grade__lunch_period'], group['menu_item'])
+            counts[key] += group['total']
+    with db_transaction.atomic():
+        tallies.delete()
+        DailyItemTally.objects.bulk_create([
+            DailyItemTally(business_date=business_date, lunch_period_id=lunch_period_id, menu_item_id=menu_item_id, quantity=quantity)
+            for (business_date, lunch_period_id, menu_item_id), quantity in counts.items()
+        ], batch_size=1000)
+    return len(counts)
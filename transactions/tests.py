@@ -1,3 +1,327 @@
+import re
+
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, pre_delete
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from cafeteria.models import GradeLevel, LunchPeriod, School
+from cafeteria.tests import SeededSchoolTestCase
+from menu.models import MenuItem
+from profiles.models import Profile
+from transactions import ledger, tallies
+from transactions.archive import archive_transactions
+from transactions.models import ArchivedMenuLineItem, ArchivedTransaction, BalanceCheckpoint, DailyItemTally, MenuLineItem, Transaction
+
+
+class QueryPlanTests(TestCase):
+    """ EXPLAIN the hot path queries and fail on a sequential scan """
+    PROFILES = 400
+    DAYS = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        period = LunchPeriod.objects.create(display_name='First')
+        school = School.objects.create(id=1, name='Plan School', school_number=1, active=True)
+        grade = GradeLevel.objects.create(value=5, school=school, lunch_period=period)
+        User.objects.bulk_create([
+            User(username='plan-{}'.format(number), first_name='Plan', last_name=str(number))
+            for number in range(cls.PROFILES)
+        ])
+        # Re-read the rows, since not every database returns bulk created IDs
+        users = User.objects.filter(username__startswith='plan-').order_by('id')
+        Profile.objects.bulk_create([
+            Profile(
+                active=number % 10 != 0,
+                current_balance=Decimal(number % 7 - 1),
+                grade=grade if number % 20 else None,
+                last_sync=now,
+                role=Profile.STUDENT if number % 20 else Profile.STAFF,
+                user=user
+            )
+            for number, user in enumerate(users)
+        ])
+        profiles = list(Profile.objects.order_by('id'))
+        transactions = []
+        for profile in profiles:
+            for day in range(cls.DAYS):
+                submitted = now - timedelta(days=day)
+                completed = submitted if day else None
+                transactions.append(Transaction(
+                    amount=Decimal('3.00'), business_date=submitted.date(), completed=completed,
+                    ps_transaction_id=1 if day > 2 else None, submitted=submitted,
+                    transactee=profile, transaction_type=Transaction.DEBIT
+                ))
+            transactions.append(Transaction(
+                amount=Decimal('20.00'), completed=now, submitted=now - timedelta(days=cls.DAYS),
+                transactee=profile, transaction_type=Transaction.CREDIT
+            ))
+        Transaction.objects.bulk_create(transactions, batch_size=1000)
+        cls.profile = profiles[1]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # A table this small is cheaper to scan, so only fall back to a
+            # sequential scan when no index can be used at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset: QuerySet):
+        table = queryset.model._meta.db_table
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            scans = re.findall(r'Seq Scan on {}\b'.format(table), plan)
+        else:
+            scans = [line for line in plan.splitlines()
+                     if re.search(r'\bSCAN (TABLE )?{}\b'.format(table), line) and 'USING' not in line]
+        self.assertFalse(scans, 'Sequential scan of {}:\n{}'.format(table, plan))
+
+    def test_profile_transactions(self):
+        self.assertUsesIndex(Transaction.objects.filter(transactee=self.profile).order_by('-submitted'))
+
+    def test_todays_order(self):
+        today = timezone.localdate()
+        self.assertUsesIndex(Transaction.objects.filter(transactee=self.profile).filter(submitted__date=today)
+                             .filter(transaction_type=Transaction.DEBIT).filter(completed__isnull=True))
+
+    def test_pending_orders_for_day(self):
+        today = timezone.localdate()
+        self.assertUsesIndex(Transaction.objects.filter(
+            transaction_type=Transaction.DEBIT, completed__isnull=True, submitted__date=today))
+
+    def test_unexported_transactions(self):
+        self.assertUsesIndex(Transaction.objects.filter(completed__isnull=False, ps_transaction_id__isnull=True))
+
+    def test_active_staff(self):
+        self.assertUsesIndex(Profile.objects.filter(role=Profile.STAFF).filter(active=True).order_by())
+
+    def test_debtors(self):
+        self.assertUsesIndex(Profile.objects.filter(active=True).filter(current_balance__lt=0).order_by())
+
+    def test_lunch_card_lookup(self):
+        self.assertUsesIndex(Profile.objects.filter(lunch_uuid=self.profile.lunch_uuid))
+
+
+class DeleteTransactionsTests(TestCase):
+
+    def setUp(self):
+        period = LunchPeriod.objects.create(display_name='First')
+        school = School.objects.create(id=1, name='Delete School', school_number=1, active=True)
+        self.grade = GradeLevel.objects.create(value=5, school=school, lunch_period=period)
+        self.pizza = MenuItem.objects.create(name='Pizza', short_name='Pizza', cost=Decimal('3.00'),
+                                             category=MenuItem.ENTREE, sequence=1)
+        self.milk = MenuItem.objects.create(name='Milk', short_name='Milk', cost=Decimal('0.50'),
+                                            category=MenuItem.DRINK, sequence=2)
+
+    def place_orders(self, count: int, username: str):
+        user = User.objects.create(username=username)
+        profile = Profile.objects.create(user=user, grade=self.grade, last_sync=timezone.now())
+        for _ in range(count):
+            order = Transaction.objects.create(amount=Decimal('3.50'), submitted=timezone.now(),
+                                               transactee=profile, transaction_type=Transaction.DEBIT)
+            MenuLineItem.objects.create(transaction=order, menu_item=self.pizza, quantity=1)
+            MenuLineItem.objects.create(transaction=order, menu_item=self.milk, quantity=2)
+        return Transaction.objects.filter(transactee=profile)
+
+    def tally_quantities(self):
+        return dict(DailyItemTally.objects.values_list('menu_item__name', 'quantity'))
+
+    def post_history(self, username: str) -> (Profile, list):
+        """ Post the same deposits and orders to a new profile, three of the orders at one time """
+        profile = Profile.objects.create(user=User.objects.create(username=username), last_sync=timezone.now())
+        start = timezone.now() - timedelta(days=1)
+        history = []
+        for amount, transaction_type, minutes in [
+                ('20.00', Transaction.CREDIT, 0), ('3.50', Transaction.DEBIT, 1), ('2.25', Transaction.DEBIT, 2),
+                ('1.00', Transaction.DEBIT, 2), ('4.00', Transaction.DEBIT, 2), ('10.00', Transaction.CREDIT, 3),
+                ('3.50', Transaction.DEBIT, 4), ('0.75', Transaction.DEBIT, 5)]:
+            transaction = Transaction.objects.create(amount=Decimal(amount), submitted=start, transactee=profile,
+                                                     transaction_type=transaction_type)
+            history.append(ledger.post(transaction, start + timedelta(minutes=minutes)))
+        return profile, history
+
+    def balances(self, profile: Profile) -> (list, Decimal):
+        transactions = Transaction.objects.filter(transactee=profile).order_by('completed', '-beginning_balance')
+        return list(transactions.values_list('amount', 'beginning_balance', 'ending_balance')), \
+            Profile.objects.get(id=profile.id).current_balance
+
+    def test_bulk_deletes_rebase_like_single_deletes(self):
+        deleted = [1, 3, 4, 6]
+        bulk_profile, bulk_history = self.post_history('bulk')
+        single_profile, single_history = self.post_history('single')
+        ledger.delete_transactions(Transaction.objects.filter(id__in=[bulk_history[number].id for number in deleted]))
+        for number in deleted:
+            # Re-read each one, since the deletes before it rebased its balances
+            Transaction.objects.get(id=single_history[number].id).delete()
+        self.assertEqual(self.balances(bulk_profile), self.balances(single_profile))
+        remaining, current_balance = self.balances(bulk_profile)
+        self.assertEqual([(balances[1], balances[2]) for balances in remaining], [
+            (Decimal('0.00'), Decimal('20.00')), (Decimal('20.00'), Decimal('17.75')),
+            (Decimal('17.75'), Decimal('27.75')), (Decimal('27.75'), Decimal('27.00'))])
+        self.assertEqual(current_balance, Decimal('27.00'))
+
+    def test_tallies_follow_bulk_deletes(self):
+        kept = self.place_orders(3, 'kept')
+        self.place_orders(4, 'deleted')
+        self.assertEqual(self.tally_quantities(), {'Pizza': 7, 'Milk': 14})
+        ledger.delete_transactions(Transaction.objects.exclude(id__in=kept))
+        self.assertEqual(self.tally_quantities(), {'Pizza': 3, 'Milk': 6})
+        tallies.rebuild()
+        self.assertEqual(self.tally_quantities(), {'Pizza': 3, 'Milk': 6})
+
+    def test_queries_do_not_grow_with_line_items(self):
+        queries = []
+        for count in (2, 12):
+            orders = self.place_orders(count, 'orders-{}'.format(count))
+            with CaptureQueriesContext(connection) as captured:
+                ledger.delete_transactions(orders)
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_archive_keeps_tallies_and_balances(self):
+        orders = self.place_orders(3, 'archived')
+        for order in orders:
+            ledger.post(order)
+        profile = Profile.objects.get(user__username='archived')
+        ledger.checkpoint(Profile.objects.filter(id=profile.id))
+        deleted = mock.Mock()
+        for signal in (pre_delete, post_delete):
+            signal.connect(deleted, weak=False)
+            self.addCleanup(signal.disconnect, deleted)
+        with mock.patch('transactions.archive.BATCH_SIZE', 2):
+            self.assertEqual(archive_transactions(orders, '2025-2026'), 3)
+        # The originals are deleted without loading them or sending a signal per row
+        deleted.assert_not_called()
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(MenuLineItem.objects.exists())
+        self.assertEqual(ArchivedTransaction.objects.filter(transactee=profile).count(), 3)
+        self.assertEqual(ArchivedMenuLineItem.objects.count(), 6)
+        self.assertEqual(Profile.objects.get(id=profile.id).current_balance, Decimal('-10.50'))
+        self.assertEqual(self.tally_quantities(), {'Pizza': 3, 'Milk': 6})
+
+    def test_archive_queries_do_not_grow_with_transactions(self):
+        queries = []
+        for count in (2, 12):
+            orders = self.place_orders(count, 'archived-{}'.format(count))
+            with CaptureQueriesContext(connection) as captured:
+                archive_transactions(orders, '2025-2026')
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+
+class BalanceRebuildTests(TestCase):
+    """ balancecorrection's window function replay, from the start and from a checkpoint """
+
+    def setUp(self):
+        self.profile = Profile.objects.create(user=User.objects.create(username='rebuilt'), last_sync=timezone.now())
+        start = timezone.now() - timedelta(days=1)
+        self.history = []
+        for minutes, (amount, transaction_type) in enumerate([
+                ('20.00', Transaction.CREDIT), ('3.50', Transaction.DEBIT), ('2.25', Transaction.DEBIT),
+                ('10.00', Transaction.CREDIT), ('4.00', Transaction.DEBIT)]):
+            transaction = Transaction.objects.create(amount=Decimal(amount), submitted=start, transactee=self.profile,
+                                                     transaction_type=transaction_type)
+            self.history.append(ledger.post(transaction, start + timedelta(minutes=minutes)))
+        self.correct = self.balances()
+
+    def balances(self) -> (list, Decimal):
+        return list(Transaction.objects.filter(transactee=self.profile).order_by('completed')
+                    .values_list('id', 'beginning_balance', 'ending_balance')), \
+            Profile.objects.get(id=self.profile.id).current_balance
+
+    def corrupt(self, *numbers: int):
+        for number in numbers:
+            Transaction.objects.filter(id=self.history[number].id).update(
+                beginning_balance=Decimal('99.00'), ending_balance=Decimal('99.00'))
+        Profile.objects.filter(id=self.profile.id).update(current_balance=Decimal('99.00'))
+
+    def correct_balances(self, *args) -> str:
+        output = StringIO()
+        call_command('balancecorrection', '-p', str(self.profile.id), *args, stdout=output)
+        return output.getvalue()
+
+    def checkpoint_at(self, number: int):
+        ledger.record_checkpoints([(self.profile.id, self.history[number].id, self.history[number].ending_balance)])
+
+    def test_dry_run_reports_without_writing(self):
+        self.corrupt(1, 3)
+        corrupted = self.balances()
+        output = self.correct_balances('--dry-run', '--full')
+        self.assertIn('Transaction #{} for'.format(self.history[1].id), output)
+        self.assertIn('Transaction #{} for'.format(self.history[3].id), output)
+        self.assertIn('current balance 99.00 -> 20.25', output)
+        self.assertIn('Would correct 2 transactions and 1 current balances', output)
+        self.assertEqual(self.balances(), corrupted)
+
+    def test_full_rebuild(self):
+        self.checkpoint_at(2)
+        self.corrupt(0, 1, 4)
+        self.assertIn('Corrected 3 transactions and 1 current balances', self.correct_balances('--full'))
+        self.assertEqual(self.balances(), self.correct)
+        # The replay proved the checkpoint's transactions wrong
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+        self.assertIn('Corrected 0 transactions and 0 current balances', self.correct_balances('--full'))
+
+    def test_rebuild_from_checkpoint(self):
+        self.checkpoint_at(2)
+        self.corrupt(1, 3)
+        self.assertIn('Corrected 1 transactions and 1 current balances', self.correct_balances())
+        transactions, current_balance = self.balances()
+        self.assertEqual(current_balance, self.correct[1])
+        self.assertEqual(transactions[3], self.correct[0][3])
+        # Transactions up to the checkpoint are not replayed
+        self.assertEqual(transactions[1][1:], (Decimal('99.00'), Decimal('99.00')))
+        self.correct_balances('--full')
+        self.assertEqual(self.balances(), self.correct)
+
+    def test_deletes_before_a_checkpoint_invalidate_it(self):
+        self.checkpoint_at(2)
+        Transaction.objects.get(id=self.history[4].id).delete()
+        self.assertTrue(BalanceCheckpoint.objects.exists())
+        Transaction.objects.get(id=self.history[1].id).delete()
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+
+        self.checkpoint_at(3)
+        ledger.delete_transactions(Transaction.objects.filter(id=self.history[0].id))
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+        self.assertIn('Corrected 0 transactions and 0 current balances', self.correct_balances())
+
+
+class TransactionViewQueryTests(SeededSchoolTestCase):
+
+    def day_kwargs(self):
+        return {'year': self.today.year, 'month': self.today.month, 'day': self.today.day}
+
+    def test_transaction_list(self):
+        self.assertQueryBudget(4, reverse('transaction-list'))
+
+    def test_order_list(self):
+        self.assertQueryBudget(4, reverse('transaction-orders'), data={'order_by': 'grade', 'sort': 'DESC'})
+
+    def test_deposit_list(self):
+        self.assertQueryBudget(4, reverse('transaction-deposits'))
+
+    def test_homeroom_orders(self):
+        self.client.force_login(self.teacher.user)
+        self.assertQueryBudget(5, reverse('homeroom-orders'))
+
+    def test_misc_receipts_report(self):
+        self.assertQueryBudget(3, reverse('misc-receipts-report-day', kwargs=self.day_kwargs()))
 
-# Create your tests here.
+    def test_deposit_checklist(self):
+        self.assertQueryBudget(3, reverse('deposit-checklist-day', kwargs=self.day_kwargs()))
@@ -3,7 +3,7 @@ from transactions.models import Transaction
 
 
 def export_transactions(transactions: [Transaction]) -> int:
-    client = Powerschool()
+    client = Powerschool(batch=True)
     count: int = 0
     for transaction in transactions:
         transaction_info = {}
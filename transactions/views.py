@@ -22,9 +22,9 @@ from django.views.generic import DayArchiveView, TodayArchiveView
 from cafeteria.decorators import admin_access_allowed
 from menu.models import MenuItem
 from profiles.models import Profile
-from transactions.models import Transaction, MenuLineItem
+from transactions.models import Transaction, TransactionQuerySet, MenuLineItem
 from transactions.forms import ItemOrderForm, TransactionDepositForm
-from transactions import helpers
+from transactions import helpers, ledger, orders, settlement
 
 
 logger = logging.getLogger(__file__)
@@ -49,13 +49,7 @@ class OrderMixin:
 
     def process_order(self, order: Transaction):
         try:
-            transactee = order.transactee
-            order.beginning_balance = transactee.current_balance
-            order.ending_balance = transactee.current_balance - order.amount
-            order.completed = timezone.now()
-            order.save()
-            transactee.current_balance = order.ending_balance
-            transactee.save()
+            ledger.post(order)
         except:
             raise Exception
 
@@ -64,12 +58,10 @@ class OrderMixin:
             orders = Transaction.objects.filter(
                 transaction_type=Transaction.DEBIT,
                 submitted__date=day,
-                completed__date=None,
             )
-            if orders:
-                for order in orders:
-                    self.process_order(order)
-                return True, 'Successfully processed {} transactions for {}.'.format(orders.count(), day.strftime('%b %-d, %Y'))
+            count = settlement.settle_orders(orders)
+            if count:
+                return True, 'Successfully processed {} transactions for {}.'.format(count, day.strftime('%b %-d, %Y'))
             else:
                 raise Exception
         except:
@@ -79,9 +71,7 @@ class OrderMixin:
 
     def process_single_order(self, id: int) -> (bool, str):
         try:
-            order = Transaction.objects.get(id=id)
-            if not order.completed:
-                self.process_order(order)
+            if settlement.settle_orders(Transaction.objects.filter(id=id)):
                 return True, 'Successfully processed transaction #{}.'.format(id)
             else:
                 raise Exception
@@ -109,11 +99,15 @@ class TransactionMixin:
                 transaction_type=Transaction.DEBIT)
         else:
             queryset = Transaction.objects.all()
+        queryset = queryset.select_related('transactee__user', 'transactee__grade').with_status()
+        status = self.request.GET.get('status')
+        if status in TransactionQuerySet.STATUS_CHOICES:
+            queryset = queryset.filter(status=status)
         sort_order = self.request.GET.get('sort') or 'ASC'
         self.ascending = sort_order == 'ASC'
         sorting = self.request.GET.get('order_by') or 'submitted'
         if sorting == 'grade':
-            sorting = 'transactee__grade.value'
+            sorting = 'transactee__grade__value'
         if not self.ascending:
             sorting = '-' + sorting
         self.ascending = not self.ascending
@@ -147,7 +141,8 @@ class ExportChecksView(LoginRequiredMixin, UserIsStaffMixin, View):
             Q(description__icontains='Check #')
             | Q(description__icontains='Cash')
         )
-        deposits = deposits.filter(transaction_type=Transaction.CREDIT)
+        deposits = deposits.filter(transaction_type=Transaction.CREDIT)\
+            .select_related('transactee__user', 'transactee__grade')
         workbook_name = 'misc-receipts-form.xlsx'
         if ('year' in self.kwargs) and ('month' in self.kwargs) and ('day' in self.kwargs):
             day = date(self.kwargs['year'],
@@ -230,10 +225,10 @@ class ExportChecksView(LoginRequiredMixin, UserIsStaffMixin, View):
             currency_bold_single_top = workbook.add_format(
                 {'bold': True, 'font_size': 12, 'num_format': '[$$-409]#,##0.00', 'top': 1})
             worksheet.write(
-                row + 1, 3, '=SUM(D6:D{})'.format(deposits.count() + 5), currency_bold_single_top)
+                row + 1, 3, '=SUM(D6:D{})'.format(len(deposits) + 5), currency_bold_single_top)
             worksheet.write(row + 1, 4, '', currency_bold_single_top)
             worksheet.write(
-                row + 1, 5, '=SUM(F6:F{})'.format(deposits.count() + 5), currency_bold_single_top)
+                row + 1, 5, '=SUM(F6:F{})'.format(len(deposits) + 5), currency_bold_single_top)
             worksheet.set_row(row + 1, 18, general_row_format)
 
             worksheet.write(row + 2, 2, 'Grand Total', bold)
@@ -278,7 +273,7 @@ class HomeroomOrdersArchiveView(LoginRequiredMixin, TodayArchiveView):
         return Transaction.objects.filter(
             transactee__in=self.request.user.profile.students.all(),
             transaction_type=Transaction.DEBIT
-        )
+        ).select_related('transactee__user').with_status()
 
 
 class OrderProcessView(LoginRequiredMixin, UserIsStaffMixin, OrderMixin, View):
@@ -336,7 +331,7 @@ class UsersTodayArchiveView(LoginRequiredMixin, TodayArchiveView):
         return Transaction.objects.filter(
             transactee=self.request.user.profile,
             transaction_type=Transaction.DEBIT
-        )
+        ).with_status()
 
 
 class UsersTransactionsArchiveView(LoginRequiredMixin, ListView):
@@ -355,7 +350,7 @@ class UsersTransactionsArchiveView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         queryset = Transaction.objects.filter(
-            transactee=self.request.user.profile)
+            transactee=self.request.user.profile).with_status()
         sort_order = self.request.GET.get('sort') or 'ASC'
         self.ascending = sort_order == 'ASC'
         sorting = self.request.GET.get('order_by') or 'submitted'
@@ -393,7 +388,8 @@ def batch_deposit(request):
 @login_required
 @admin_access_allowed
 def deposit_checklist(request, *args, **kwargs):
-    deposits = Transaction.objects.filter(transaction_type=Transaction.CREDIT)
+    deposits = Transaction.objects.filter(transaction_type=Transaction.CREDIT)\
+        .select_related('transactee__user', 'transactee__grade')
     workbook_name = 'misc-deposit-form.xlsx'
     if ('year' in kwargs) and ('month' in kwargs) and ('day' in kwargs):
         day = date(kwargs['year'], kwargs['month'], kwargs['day'])
@@ -462,7 +458,7 @@ def deposit_checklist(request, *args, **kwargs):
         worksheet.write(row + 1, 4, 'Total', bold)
 
         grade_total_format = workbook.add_format({'align': 'center', 'bold': True, 'font_size': 12, 'num_format': '[$$-409]#,##0.00', 'top': 6})
-        worksheet.write(row + 1, 5, '=SUM(F6:F{})'.format(deposits.count() + 5), grade_total_format)
+        worksheet.write(row + 1, 5, '=SUM(F6:F{})'.format(len(deposits) + 5), grade_total_format)
         worksheet.set_row(row + 1, 18, general_row_format)
 
         workbook.close()
@@ -514,24 +510,8 @@ def new_single_order(request):
                 return redirect('transaction-order-create')
             else:
                 transactee = User.objects.get(id=request.POST['transactee']).profile
-                counted_items = Counter(ordered_items_list)
-                description = ''
-                cost = 0
-                for item in counted_items:
-                    if description:
-                        description = description + ', '
-                    description = description + '({}) {}'.format(counted_items[item], item.name)
-                    cost = cost + (item.cost * counted_items[item])
                 try:
-                    transaction = Transaction(
-                        amount=cost,
-                        description=description,
-                        transaction_type=Transaction.DEBIT,
-                        transactee=transactee
-                    )
-                    transaction.save()
-                    for item in counted_items:
-                        transaction.menu_items.add(item, through_defaults={'quantity': counted_items[item]})
+                    orders.place_order(transactee, ordered_items_list, one_per_day=False)
                     messages.success(request, 'Successfully created an order for {}.'.format(transactee.name()))
                     return redirect('profile-detail', transactee.id)
                 except Exception as e: